@@ -0,0 +1,366 @@
+import argparse
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+import amp.cohort_scanner as cohort_scanner
+import amp.image_io as image_io
+from amp.tiff_utils import parse_compress
+
+from typing import Any, Callable, Dict, Hashable, List, Union
+
+# background removal algorithm and batch runner, independent of the Qt plugin
+
+SETTINGS_NAME = 'background_settings.json'
+
+# parameter (minimum, maximum, decimals), matching the plugin's spin boxes
+PARAM_RANGES = {
+    'blur': (0, 99, 1),
+    'thresh': (0, 1, 2),
+    'cap': (0, 255, 0),
+    'remove': (0, 255, 0),
+    'evalcap': (0, 255, 0),
+}
+
+
+def cap_source(background_image: Any, cap: int) -> Any:
+    """Caps a background channel; the first step of `generate_mask`
+
+    Args:
+        background_image (ndarray): background channel to create mask with (const)
+        cap (int): intensity cap of the background channel
+
+    Returns:
+        ndarray: background, set to the cap where it's over the cap and 0 elsewhere
+    """
+    capped_background = np.zeros_like(background_image)
+    capped_background[background_image > cap] = cap
+    return capped_background
+
+
+def blur_source(capped_background: Any, blur: float) -> Any:
+    """Blurs and normalizes a capped background channel (see `cap_source`)
+
+    Args:
+        capped_background (ndarray): capped background channel
+        blur (float): gaussian blur sigma
+
+    Returns:
+        ndarray: blurred background, normalized to [0, 1]
+    """
+    background_mask = gaussian_filter(capped_background, blur)
+    background_mask = np.interp(background_mask,
+                                (background_mask.min(),
+                                 background_mask.max()),
+                                (0, 1))
+    return background_mask
+
+
+def threshold_mask(blurred_background: Any, thresh: float) -> Any:
+    """Binarizes a normalized, blurred background (see `blur_source`)
+
+    Args:
+        blurred_background (ndarray): normalized, blurred background channel
+        thresh (float): threshold of the normalized, blurred background
+
+    Returns:
+        ndarray: binarized mask
+    """
+    return np.where(blurred_background > thresh, 1, 0)
+
+
+def generate_mask(background_image: Any, blur: float, thresh: float, cap: int) -> Any:
+    """Generates binaraized mask used for background removal
+
+    Args:
+        background_image (ndarray): background channel to create mask with (const)
+        blur (float): gaussian blur sigma
+        thresh (float): threshold of the normalized, blurred background
+        cap (int): intensity cap of the background channel
+
+    Returns:
+        background_mask (ndarray): generated binarized mask
+    """
+    return threshold_mask(blur_source(cap_source(background_image, cap), blur), thresh)
+
+
+class MaskCache(object):
+    """ Memoizes each stage of mask generation, so targets sharing a source and parameters don't
+    refilter it, and parameter changes only recompute the stages they affect
+
+    Capped backgrounds are keyed by (source, cap), blurred backgrounds by (source, blur, cap) and
+    masks by (source, blur, cap, thresh).  Cached arrays are read-only, and the cache can be
+    shared between threads.
+
+    Args:
+        max_entries (int | None):
+            maximum number of entries kept per stage.  If None, nothing is evicted.
+    """
+    def __init__(self, max_entries: Union[int, None] = None) -> None:
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._capped: OrderedDict = OrderedDict()
+        self._blurred: OrderedDict = OrderedDict()
+        self._masks: OrderedDict = OrderedDict()
+
+    def get_mask(self, source_key: Hashable, background_image: Any, blur: float, thresh: float,
+                 cap: int) -> Any:
+        """ Gets a mask, generating it if it isn't cached
+
+        Args:
+            source_key (Hashable):
+                identifies the background channel, e.g (FOV tree path, source channel)
+            background_image (ndarray):
+                background channel to create mask with (const)
+            blur, thresh, cap:
+                mask parameters (see `generate_mask`)
+
+        Returns:
+            ndarray:
+                read-only binarized mask
+        """
+        blurred = self._get(
+            self._blurred, (source_key, blur, cap),
+            lambda: blur_source(
+                self._get(
+                    self._capped, (source_key, cap),
+                    lambda: cap_source(background_image, cap)
+                ),
+                blur
+            )
+        )
+        return self._get(
+            self._masks, (source_key, blur, cap, thresh),
+            lambda: threshold_mask(blurred, thresh)
+        )
+
+    def clear(self) -> None:
+        """ Drops all cached backgrounds and masks
+        """
+        with self._lock:
+            self._capped.clear()
+            self._blurred.clear()
+            self._masks.clear()
+
+    def _get(self, entries: OrderedDict, key: Hashable, generate: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key in entries:
+                entries.move_to_end(key)
+                return entries[key]
+
+        # generated outside the lock, so other stages/threads aren't blocked
+        data = generate()
+        data.flags.writeable = False
+        with self._lock:
+            entries[key] = data
+            if self.max_entries is not None:
+                while len(entries) > self.max_entries:
+                    entries.popitem(last=False)
+        return data
+
+
+def evaluate_target(mask: Any, target_data: Any, remove_value: int) -> Any:
+    """ Subtracts remove value from target image at positive mask values
+
+    Args:
+        mask (np.array):
+            boolean background mask
+        target_data (np.array):
+            target channel data
+        remove_value (int):
+            intensity value to deduct from target
+
+    Returns:
+        np.array:
+            processed data
+    """
+    processed_channel = np.copy(target_data).astype('int')
+    processed_channel[mask.astype('bool')] -= remove_value
+    processed_channel[processed_channel < 0] = 0
+
+    return processed_channel
+
+
+def clamp_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    """ Clamps and rounds parameters as the plugin's spin boxes do, so headless runs match runs
+    started from the plugin
+
+    Args:
+        params (dict): target parameters
+
+    Returns:
+        dict: clamped parameters
+    """
+    clamped = dict(params)
+    for name, (minimum, maximum, decimals) in PARAM_RANGES.items():
+        if name in clamped:
+            clamped[name] = min(max(round(clamped[name], decimals), minimum), maximum)
+    return clamped
+
+
+def remove_point_background(channels: Dict[str, Any],
+                            settings: Dict[str, Dict[str, Dict[str, Any]]]) -> Dict[str, Any]:
+    """ Removes background from a single FOV
+
+    Sources are applied in settings order, and targets cleaned by several sources are cleaned
+    cumulatively (a source that is also a target is used after its own cleaning).
+
+    Args:
+        channels (Dict[str, Callable[[], np.array]]):
+            loader of each channel's data, keyed by channel name
+        settings (dict):
+            target parameters, keyed by source channel then target channel
+
+    Returns:
+        Dict[str, np.array]:
+            cleaned data, keyed by target channel
+    """
+    cleaned_data: Dict[str, Any] = {}
+    for source, targets in settings.items():
+        if source not in channels:
+            continue
+        # each source is loaded, and blurred per (blur, cap), once
+        source_data = cleaned_data[source] if source in cleaned_data else channels[source]()
+        masks = MaskCache()
+        for target, params in targets.items():
+            if target not in channels:
+                continue
+            target_data = cleaned_data[target] if target in cleaned_data else channels[target]()
+            params = clamp_params(params)
+            mask = masks.get_mask(
+                source, source_data, params['blur'], params['thresh'], params['cap']
+            )
+            cleaned_data[target] = evaluate_target(mask, target_data, params['remove'])
+
+    return cleaned_data
+
+
+def load_settings(settings_path: str) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """ Loads background removal settings, as saved by the plugin
+
+    Args:
+        settings_path (str): path to settings json
+
+    Returns:
+        dict: target parameters, keyed by source channel then target channel
+    """
+    with open(settings_path, 'r') as fp:
+        return json.load(fp)
+
+
+def remove_cohort_background(cohort_head: str, settings: Dict[str, Dict[str, Dict[str, Any]]],
+                             points: Union[List[str], None] = None,
+                             progress_callback: Union[Callable[[int, int], None], None] = None,
+                             compress: Any = 6) -> str:
+    """ Removes background from the given FOVs of a cohort
+
+    Cleaned images are written to a 'background_removed' directory next to the cohort, and the
+    cohort itself is left untouched.  FOVs missing from the cohort are skipped.
+
+    Args:
+        cohort_head (str):
+            path to top level cohort directory
+        settings (dict):
+            target parameters, keyed by source channel then target channel
+        points (List[str] | None):
+            FOV tree paths to process.  If None, every FOV in the cohort is processed.
+        progress_callback (Callable[[int, int], None] | None):
+            called with the number of processed FOVs and the total after each FOV
+        compress (int | str | tuple):
+            compression of cleaned MIBItiff channels (see `tiff_utils.write_mibitiff`)
+
+    Raises:
+        FileExistsError
+
+    Returns:
+        str:
+            path to the cleaned cohort
+    """
+    src_dir = os.path.normpath(cohort_head)
+    parent_dir = os.path.dirname(src_dir)
+    tmp_dir = os.path.join(parent_dir, 'bg_removed_temp')
+    final_dir = os.path.join(parent_dir, 'background_removed')
+
+    # fail before any work is done, rather than once every FOV has been cleaned
+    for out_dir in (final_dir, tmp_dir):
+        if os.path.exists(out_dir):
+            raise FileExistsError(
+                f'{out_dir} already exists, move or remove it before removing background'
+            )
+
+    fovs = cohort_scanner.index_cohort(src_dir)
+    if points is None:
+        points = list(fovs.keys())
+
+    # clean a copy of the cohort, so the cohort is untouched if removal fails
+    shutil.copytree(src_dir, tmp_dir)
+
+    try:
+        for done, point in enumerate(points, 1):
+            channels = fovs.get(point, {})
+            loaders = {
+                channel: (lambda path=path: image_io.read_image_data(path))
+                for channel, path in channels.items()
+            }
+
+            # write all of a point's channels at once, so MIBItiffs are only rewritten once
+            cleaned_data = remove_point_background(loaders, settings)
+            image_io.write_channel_data({
+                tmp_dir + channels[target][len(src_dir):]: data
+                for target, data in cleaned_data.items()
+            }, compress)
+
+            if progress_callback is not None:
+                progress_callback(done, len(points))
+    except BaseException:
+        # don't leave a partial copy behind, it would block the next run
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    os.rename(tmp_dir, final_dir)
+
+    return final_dir
+
+
+def main(argv: Union[list, None] = None) -> None:
+    """ Command line entry point for headless background removal
+    """
+    parser = argparse.ArgumentParser(
+        description='Runs background removal over a cohort, using settings saved by the plugin.'
+    )
+    parser.add_argument('cohort', help='path to top level cohort directory')
+    parser.add_argument(
+        '--settings',
+        help=f"path to background removal settings (default: '<cohort>/{SETTINGS_NAME}')"
+    )
+    parser.add_argument(
+        '--points', nargs='+',
+        help="FOV tree paths to process, e.g 'cohort/fov1' (default: every FOV)"
+    )
+    parser.add_argument(
+        '--compress', type=parse_compress, default=6,
+        help="MIBItiff compression: a zlib level (0 for none), a codec name, or 'codec:level' "
+             "(default: 6)"
+    )
+    args = parser.parse_args(argv)
+
+    settings_path = args.settings or os.path.join(args.cohort, SETTINGS_NAME)
+    settings = load_settings(settings_path)
+
+    def _print_progress(done: int, total: int) -> None:
+        print(f'Processed {done}/{total} FOVs', flush=True)
+
+    final_dir = remove_cohort_background(
+        args.cohort, settings, args.points, progress_callback=_print_progress,
+        compress=args.compress
+    )
+    print(f'Background removed cohort written to {final_dir}')
+
+
+if __name__ == '__main__':
+    main()
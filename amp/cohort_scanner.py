@@ -0,0 +1,409 @@
+import os
+import json
+import concurrent.futures
+
+from tifffile import TiffFile
+
+import amp.tiff_utils as tiff_utils
+
+from typing import List, Dict, Tuple, Any, Union
+
+# tools for discovering cohort tifs, independent of the Qt tree
+
+# cohort manifests are written next to the cohort, so re-opening skips unchanged files
+_MANIFEST_VERSION = 1
+
+
+def _list_dir(path: str) -> Tuple[List[str], List[str], int]:
+    """ Lists the visible subdirectories and tifs of a directory
+
+    Args:
+        path (str): directory to list
+
+    Returns:
+        tuple (list, list, int):
+        - subdirectory names
+        - tif file names
+        - directory modification time (ns)
+    """
+    dirs = []
+    tifs = []
+    for entry in os.scandir(path):
+        if entry.is_dir() and not entry.name.startswith('.'):
+            dirs.append(entry.name)
+        elif entry.is_file() and '.tif' in entry.name:
+            tifs.append(entry.name)
+    return dirs, tifs, os.stat(path).st_mtime_ns
+
+
+def find_tif_dirs(cohort_head: str, max_depth: int = 6,
+                  executor: Union[concurrent.futures.Executor, None] = None,
+                  cancel_event: Any = None
+                  ) -> Tuple[List[Tuple[Tuple[str, ...], str, List[str]]], Dict[str, int]]:
+    """ Breadth-first search for the most shallow directories containing tifs
+
+    Mirrors the layout rules of `cohorttreewidget.tif_bfs`: all tifs of interest are assumed to be
+    at the same depth, and a subdirectory name shared by every tif directory (e.g 'TIFs') is
+    trimmed from the tree.
+
+    Args:
+        cohort_head (str):
+            path to top level cohort directory
+        max_depth (int):
+            Maximum file structure search depth. Default is 6.
+        executor (concurrent.futures.Executor | None):
+            pool used to list each layer's directories concurrently.  If None, directories are
+            listed serially.
+        cancel_event (threading.Event | None):
+            stops the search early when set
+
+    Raises:
+        concurrent.futures.CancelledError:
+            if the search was stopped early, rather than returning a partial layout
+
+    Returns:
+        tuple (list, dict):
+        - (tree parts, tif directory, tif names) for each directory containing tifs.  Tree parts
+          are the directory names leading from the cohort head to the tifs' tree parent.
+        - modification times (ns) of every listed directory, keyed by path relative to the head
+    """
+    dir_mtimes: Dict[str, int] = {}
+    layer: List[Tuple[str, ...]] = [()]
+    for _ in range(max_depth - 1):
+        if cancel_event is not None and cancel_event.is_set():
+            raise concurrent.futures.CancelledError('Cohort scan cancelled')
+
+        paths = [os.path.join(cohort_head, *parts) for parts in layer]
+        if executor is not None:
+            listings = list(executor.map(_list_dir, paths))
+        else:
+            listings = [_list_dir(path) for path in paths]
+
+        for parts, (_, _, mtime) in zip(layer, listings):
+            dir_mtimes[os.path.join('', *parts)] = mtime
+
+        tif_dirs = [
+            (parts, path, sorted(tifs))
+            for parts, path, (_, tifs, _) in zip(layer, paths, listings)
+            if tifs
+        ]
+        if tif_dirs:
+            # trim layer of universal subdirs if present
+            has_img_subdir = len({parts[-1] if parts else '' for parts, _, _ in tif_dirs}) == 1
+            if has_img_subdir and tif_dirs[0][0]:
+                tif_dirs = [(parts[:-1], path, tifs) for parts, path, tifs in tif_dirs]
+            return tif_dirs, dir_mtimes
+
+        layer = [
+            parts + (name,)
+            for parts, (dirs, _, _) in zip(layer, listings)
+            for name in sorted(dirs)
+        ]
+        if not layer:
+            break
+
+    return [], dir_mtimes
+
+
+def probe_tif(path: str) -> Dict[str, Any]:
+    """ Reads the header information needed to place a tif in the cohort tree
+
+    Only tags are read; no pixel data is decoded.  MIBItiff page indices are also stored in the
+    `tiff_utils` page index cache.
+
+    Args:
+        path (str): path to tif file
+
+    Returns:
+        dict:
+        - 'path': path to the tif
+        - 'mtime': modification time (ns)
+        - 'size': file size (bytes)
+        - 'is_mibitiff': is the file a MIBItiff?
+        - 'channels': MIBItiff channel targets, in page order (None for other tifs)
+        - 'shape': shape of the (first) page (None if unreadable)
+        - 'dtype': dtype string of the (first) page (None if unreadable)
+        - 'pages': MIBItiff page map; 'channels', 'offsets' and 'metadata' of the page index
+    """
+    stat = os.stat(path)
+    shape = None
+    dtype = None
+    index = None
+    try:
+        with TiffFile(path) as tif:
+            page = tif.pages[0]
+            shape = list(page.shape)
+            dtype = page.dtype.str
+            try:
+                index = tiff_utils.index_pages(tif)
+            except (KeyError, ValueError):
+                pass
+    except Exception as e:
+        # unreadable tifs are still listed, like in tif_bfs
+        print(f'Could not read tif header of {path}: {e}')
+
+    pages = None
+    if index is not None:
+        pages = {key: index[key] for key in ('channels', 'offsets', 'metadata')}
+        tiff_utils.seed_page_index(path, stat.st_size, stat.st_mtime_ns, **pages)
+
+    return {
+        'path': path,
+        'mtime': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'is_mibitiff': index is not None,
+        'channels': None if index is None else [target for _, target in index['channels']],
+        'shape': shape,
+        'dtype': dtype,
+        'pages': pages,
+    }
+
+
+def probe_tif_cached(path: str, known: Union[Dict[str, Any], None] = None) -> Dict[str, Any]:
+    """ Reuses a previous probe of a tif if the file hasn't changed since, otherwise re-probes it
+
+    Args:
+        path (str): path to tif file
+        known (dict | None): previous probe (e.g from a cohort manifest)
+
+    Returns:
+        dict:
+            tif probe, formatted as in `probe_tif`
+    """
+    if known is not None:
+        stat = os.stat(path)
+        if (known['mtime'], known['size']) == (stat.st_mtime_ns, stat.st_size):
+            if known['pages'] is not None:
+                tiff_utils.seed_page_index(path, known['size'], known['mtime'], **known['pages'])
+            return dict(known, path=path)
+
+    return probe_tif(path)
+
+
+def manifest_path(cohort_head: str) -> str:
+    """ Gets the manifest path of a cohort
+
+    The manifest sits next to the cohort rather than inside it, so it never ends up in the cohort
+    tree or in cohort copies, and writing it doesn't change the cohort's directory mtimes.
+
+    Args:
+        cohort_head (str): path to top level cohort directory
+
+    Returns:
+        str:
+            path to the cohort's manifest
+    """
+    cohort_head = os.path.normpath(os.path.abspath(cohort_head))
+    return os.path.join(
+        os.path.dirname(cohort_head), f'.{os.path.basename(cohort_head)}_manifest.json'
+    )
+
+
+def read_manifest(cohort_head: str) -> Union[Dict[str, Any], None]:
+    """ Reads the cohort manifest, if a valid one exists
+
+    Args:
+        cohort_head (str): path to top level cohort directory
+
+    Returns:
+        dict | None:
+            manifest contents
+    """
+    try:
+        with open(manifest_path(cohort_head), 'r') as fp:
+            manifest = json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get('version') != _MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def write_manifest(cohort_head: str, max_depth: int, dir_mtimes: Dict[str, int],
+                   tif_dirs: List[Tuple[Tuple[str, ...], str, List[str]]],
+                   entries: List[Dict[str, Any]]) -> None:
+    """ Writes the cohort manifest.  Paths are stored relative to the cohort head, so the
+    manifest stays valid if the cohort is moved along with it.
+
+    Args:
+        cohort_head (str): path to top level cohort directory
+        max_depth (int): search depth used for the scan
+        dir_mtimes (dict): listed directory modification times, as given by `find_tif_dirs`
+        tif_dirs (list): tif directories, as given by `find_tif_dirs`
+        entries (list): tif entries, formatted as in `scan_cohort`
+    """
+    manifest = {
+        'version': _MANIFEST_VERSION,
+        'max_depth': max_depth,
+        'dirs': dict(dir_mtimes),
+        'tif_dirs': [
+            [list(parts), os.path.relpath(tif_dir, cohort_head), tifs]
+            for parts, tif_dir, tifs in tif_dirs
+        ],
+        'tifs': {
+            os.path.relpath(entry['path'], cohort_head): dict(entry, path=None)
+            for entry in entries
+        },
+    }
+
+    try:
+        with open(manifest_path(cohort_head), 'w') as fp:
+            json.dump(manifest, fp)
+    except OSError as e:
+        print(f'Could not write cohort manifest: {e}')
+
+
+def plan_scan(cohort_head: str, max_depth: int = 6,
+              executor: Union[concurrent.futures.Executor, None] = None,
+              cancel_event: Any = None
+              ) -> Tuple[List[Tuple[Tuple[str, ...], str, List[str]]], Dict[str, int],
+                         Dict[str, Dict[str, Any]], bool]:
+    """ Gets the cohort's tif layout, reusing the manifest's layout if no listed directory changed
+
+    Args:
+        cohort_head (str):
+            path to top level cohort directory
+        max_depth (int):
+            Maximum file structure search depth. Default is 6.
+        executor (concurrent.futures.Executor | None):
+            pool used for directory listing/stats
+        cancel_event (threading.Event | None):
+            stops the search early when set
+
+    Raises:
+        concurrent.futures.CancelledError:
+            if the search was stopped early
+
+    Returns:
+        tuple (list, dict, dict, bool):
+        - tif directories, as given by `find_tif_dirs`
+        - listed directory modification times, as given by `find_tif_dirs`
+        - previous tif probes, keyed by absolute path
+        - was the manifest's layout reused?
+    """
+    manifest = read_manifest(cohort_head)
+    if manifest is None or manifest['max_depth'] != max_depth:
+        return find_tif_dirs(cohort_head, max_depth, executor, cancel_event) + ({}, False)
+
+    known = {
+        os.path.join(cohort_head, rel_path): entry
+        for rel_path, entry in manifest['tifs'].items()
+    }
+
+    def _dir_mtime(rel_dir: str) -> Union[int, None]:
+        try:
+            return os.stat(os.path.join(cohort_head, rel_dir)).st_mtime_ns
+        except OSError:
+            return None
+
+    rel_dirs = list(manifest['dirs'].keys())
+    if executor is not None:
+        mtimes = list(executor.map(_dir_mtime, rel_dirs))
+    else:
+        mtimes = [_dir_mtime(rel_dir) for rel_dir in rel_dirs]
+
+    # added/removed entries change directory mtimes, so the layout must be re-walked
+    if mtimes != [manifest['dirs'][rel_dir] for rel_dir in rel_dirs]:
+        return find_tif_dirs(cohort_head, max_depth, executor, cancel_event) + (known, False)
+
+    tif_dirs = [
+        (tuple(parts), os.path.join(cohort_head, rel_dir), tifs)
+        for parts, rel_dir, tifs in manifest['tif_dirs']
+    ]
+    return tif_dirs, manifest['dirs'], known, True
+
+
+def scan_cohort(cohort_head: str, max_depth: int = 6,
+                max_workers: int = 8) -> List[Dict[str, Any]]:
+    """ Finds and probes every tif of interest within a cohort
+
+    Unchanged tifs recorded in the cohort manifest aren't re-probed.  The manifest is rewritten
+    if anything changed.
+
+    Args:
+        cohort_head (str):
+            path to top level cohort directory
+        max_depth (int):
+            Maximum file structure search depth. Default is 6.
+        max_workers (int):
+            number of threads used for directory listing and tif probing
+
+    Returns:
+        list:
+            tif entries, formatted as in `probe_tif` with the additional key 'parts' holding the
+            tif's tree parts (see `find_tif_dirs`)
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        tif_dirs, dir_mtimes, known, reused = plan_scan(cohort_head, max_depth, executor)
+        jobs = [
+            (parts, os.path.join(tif_dir, tif))
+            for parts, tif_dir, tifs in tif_dirs
+            for tif in tifs
+        ]
+        probes = executor.map(
+            lambda path: probe_tif_cached(path, known.get(path)),
+            [path for _, path in jobs]
+        )
+        entries = [
+            dict(probe, parts=list(parts))
+            for (parts, _), probe in zip(jobs, probes)
+        ]
+
+    if not reused or any(is_reprobed(entry, known) for entry in entries):
+        write_manifest(cohort_head, max_depth, dir_mtimes, tif_dirs, entries)
+
+    return entries
+
+
+def is_reprobed(entry: Dict[str, Any], known: Dict[str, Dict[str, Any]]) -> bool:
+    """ Checks if a tif entry differs from its previous probe
+
+    Args:
+        entry (dict): tif entry
+        known (dict): previous tif probes, keyed by absolute path
+
+    Returns:
+        bool:
+            was the tif new or changed?
+    """
+    previous = known.get(entry['path'])
+    return previous is None or (previous['mtime'], previous['size']) != (entry['mtime'], entry['size'])
+
+
+def index_cohort(cohort_head: str, entries: Union[List[Dict[str, Any]], None] = None
+                 ) -> Dict[str, Dict[str, str]]:
+    """ Maps the cohort tree's FOV paths to their channels, as laid out by the cohort tree widget
+
+    Tree paths start with the cohort directory's name, e.g 'cohort/fov1' for a directory of
+    single channel tifs or 'cohort/run/fov1.tiff' for a MIBItiff.  Plugin settings are keyed by
+    these paths.
+
+    Args:
+        cohort_head (str):
+            path to top level cohort directory
+        entries (list | None):
+            tif entries, formatted as in `scan_cohort`.  If None, the cohort is scanned.
+
+    Returns:
+        dict:
+            item path of each channel (see `amp.image_io`), keyed by FOV tree path then channel
+    """
+    cohort_head = os.path.normpath(cohort_head)
+    if entries is None:
+        entries = scan_cohort(cohort_head)
+
+    head = os.path.basename(cohort_head)
+    fovs: Dict[str, Dict[str, str]] = {}
+    for entry in entries:
+        fov_path = '/'.join([head] + list(entry['parts']))
+        if entry['is_mibitiff']:
+            fov_path = f"{fov_path}/{os.path.basename(entry['path'])}"
+            for target in entry['channels']:
+                item_path = f"{entry['path']}|{target.replace('|', '_')}"
+                fovs.setdefault(fov_path, {})[os.path.basename(item_path.split('|')[1])] = item_path
+        else:
+            channel = os.path.basename(entry['path'].split('.')[0])
+            fovs.setdefault(fov_path, {})[channel] = entry['path']
+
+    return fovs
@@ -2,27 +2,69 @@ from re import sub
 from PyQt5 import QtWidgets, QtCore
 
 import numpy as np
-import skimage.io as io
 import os
 from pathlib import Path
 import sip
+import threading
+import time
+import concurrent.futures
 
-from typing import List, Set, Union, Any
+from typing import List, Set, Union, Any, Dict, Tuple
 
 import amp.tiff_utils as tiff_utils
+import amp.cohort_scanner as cohort_scanner
+import amp.image_io as image_io
 
 # Only supports single page tifs as of 6/22/2020
 
 
 class CohortTreeWidgetItem(QtWidgets.QTreeWidgetItem):
-    def __init__(self, parent: QtWidgets.QWidget = None, path: str = None) -> None:
+    def __init__(self, parent: QtWidgets.QWidget = None, path: str = None,
+                 is_mibitiff: Union[bool, None] = None) -> None:
         super().__init__(parent)
         self.path = path
-        self.is_mibitiff = tiff_utils.is_mibitiff(path.split('|')[0])
+        self._is_mibitiff = is_mibitiff
+
+        # channels whose items are only made once the item is expanded (lazy loading only)
+        self.pending_channels: List[Tuple[str, str, bool]] = []
+
+    @property
+    def is_mibitiff(self) -> bool:
+        # only tif files are probed, and each at most once
+        if self._is_mibitiff is None:
+            file_path = self.path.split('|')[0]
+            self._is_mibitiff = (
+                '.tif' in os.path.basename(file_path)
+                and os.path.isfile(file_path)
+                and tiff_utils.is_mibitiff(file_path)
+            )
+        return self._is_mibitiff
 
     def parent(self) -> 'CohortTreeWidgetItem':
         return super().parent()
 
+    def defer_channels(self, channels: List[Tuple[str, str, bool]]) -> None:
+        """ Defers creation of channel items until this item is expanded or indexed into
+
+        Args:
+            channels (List[Tuple[str, str, bool]]):
+                item path, channel name and MIBItiff status of each channel
+        """
+        self.pending_channels.extend(channels)
+        self.setChildIndicatorPolicy(QtWidgets.QTreeWidgetItem.ShowIndicator)
+
+    def populate(self) -> None:
+        """ Creates any deferred channel items
+        """
+        if not self.pending_channels:
+            return
+
+        channels, self.pending_channels = self.pending_channels, []
+        self.setChildIndicatorPolicy(QtWidgets.QTreeWidgetItem.DontShowIndicatorWhenChildless)
+        for path, channel_name, is_mibitiff in channels:
+            set_channel_item(CohortTreeWidgetItem(self, path, is_mibitiff), channel_name)
+        self.sortChildren(0, 0)
+
     def __hash__(self) -> int:
         return hash(id(self))
 
@@ -33,6 +75,7 @@ class CohortTreeWidgetItem(QtWidgets.QTreeWidgetItem):
         return x is not self
 
     def get_child_by_name(self, name: str) -> 'CohortTreeWidgetItem':
+        self.populate()
         child_out = None
         for index in range(self.childCount()):
             child = self.child(index)
@@ -42,15 +85,14 @@ class CohortTreeWidgetItem(QtWidgets.QTreeWidgetItem):
         return child_out
 
     def get_image_data(self) -> Union[Any, None]:
+        """ reads image data through the shared image cache
+
+        Returns:
+            np.array | None:
+                read-only image data, or None if the item isn't an image
+        """
         if '.tif' in self.path:
-            if self.is_mibitiff and len(self.path.split('|')) > 1:
-                img_data, _ = tiff_utils.read_mibitiff(
-                    self.path.split('|')[0],
-                    channels=[self.path.split('|')[1]]
-                )
-                return img_data[:, :, 0]
-            else:
-                return io.imread(self.path)
+            return image_io.read_image_data(self.path)
         else:
             return None
 
@@ -63,13 +105,154 @@ class CohortTreeWidgetItem(QtWidgets.QTreeWidgetItem):
         """
 
         if '.tif' in self.path:
-            if self.is_mibitiff and len(self.path.split('|')) > 1:
-                tiff_utils.overwrite_mibitiff_channel(*self.path.split('|'), new_data)
-            else:
-                io.imsave(self.path, new_data.astype(np.uint8), plugin='tifffile')
+            image_io.write_image_data(self.path, new_data)
         else:
             return
 
+    def write_channel_data(self, channel_data: Dict[str, Any]) -> None:
+        """ writes image data to several child channels, rewriting each MIBItiff only once
+
+        Args:
+            channel_data (Dict[str, np.array]):
+                image data to write out, keyed by channel name
+        """
+        item_data: Dict[str, Any] = {}
+        for channel, new_data in channel_data.items():
+            channel_item = self.get_child_by_name(channel)
+            if channel_item is None:
+                print(f'Could not find channel {channel} in {self.path}')
+                continue
+            item_data[channel_item.path] = new_data
+
+        image_io.write_channel_data(item_data)
+
+
+# streamed tree updates are batched to limit redraws
+_SCAN_BATCH_SIZE = 64
+_SCAN_BATCH_INTERVAL = 0.25
+
+
+class CohortScanner(QtCore.QObject):
+    """ Walks and probes a cohort on a worker pool, streaming found tifs back in batches
+
+    Signals are only emitted on the thread owning the scanner, and never after `cancel` is called.
+
+    Atributes:
+        tifs_found (QtCore.pyqtSignal(list)):
+            batch of tif entries (see `cohort_scanner.scan_cohort`)
+        progress (QtCore.pyqtSignal(int, int)):
+            number of tifs probed, and total tifs to probe (0 until the walk finishes)
+        finished (QtCore.pyqtSignal()):
+            emitted once the whole cohort has been scanned
+        cancelled (QtCore.pyqtSignal()):
+            emitted instead of `finished` if the scan is cancelled
+    """
+    tifs_found = QtCore.pyqtSignal(list)
+    progress = QtCore.pyqtSignal(int, int)
+    finished = QtCore.pyqtSignal()
+    cancelled = QtCore.pyqtSignal()
+
+    # cross-thread relays (queued onto the scanner's thread)
+    _batch_ready = QtCore.pyqtSignal(list, int, int)
+    _scan_done = QtCore.pyqtSignal()
+
+    def __init__(self, cohort_head: str, max_depth: int = 6, max_workers: int = 8,
+                 parent: QtCore.QObject = None) -> None:
+        super().__init__(parent)
+        self.cohort_head = cohort_head
+        self.max_depth = max_depth
+        self.max_workers = max_workers
+
+        self.cancel_event = threading.Event()
+        self.done = False
+
+        self._batch_ready.connect(self._on_batch_ready)
+        self._scan_done.connect(self._on_scan_done)
+
+    def start(self) -> None:
+        """ Starts scanning in the background
+        """
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def cancel(self) -> None:
+        """ Stops scanning.  Tifs found after this call are discarded.
+        """
+        if self.done or self.cancel_event.is_set():
+            return
+        self.cancel_event.set()
+        self.done = True
+        self.cancelled.emit()
+
+    def _run(self) -> None:
+        """ Scan routine (runs on a background thread)
+        """
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                tif_dirs, dir_mtimes, known, reused = cohort_scanner.plan_scan(
+                    self.cohort_head, self.max_depth, executor, self.cancel_event
+                )
+            except concurrent.futures.CancelledError:
+                return
+            except OSError as e:
+                print(f'Could not scan cohort {self.cohort_head}: {e}')
+                tif_dirs, dir_mtimes, known, reused = [], {}, {}, True
+
+            futures = {}
+            for parts, tif_dir, tifs in tif_dirs:
+                for tif in tifs:
+                    path = os.path.join(tif_dir, tif)
+                    future = executor.submit(cohort_scanner.probe_tif_cached, path, known.get(path))
+                    futures[future] = parts
+            self._batch_ready.emit([], 0, len(futures))
+
+            entries = []
+            batch = []
+            last_emit = 0.0
+            for future in concurrent.futures.as_completed(futures):
+                if self.cancel_event.is_set():
+                    for pending in futures:
+                        pending.cancel()
+                    return
+                try:
+                    entry = dict(future.result(), parts=list(futures[future]))
+                    entries.append(entry)
+                    batch.append(entry)
+                except OSError as e:
+                    print(f'Could not probe tif: {e}')
+
+                # first results go out right away, so fovs become clickable asap
+                if (len(batch) >= _SCAN_BATCH_SIZE
+                        or time.monotonic() - last_emit > _SCAN_BATCH_INTERVAL):
+                    self._batch_ready.emit(batch, len(entries), len(futures))
+                    batch = []
+                    last_emit = time.monotonic()
+
+            self._batch_ready.emit(batch, len(entries), len(futures))
+
+        # a cancelled scan may be missing tifs, and must never be saved as the cohort's layout
+        if self.cancel_event.is_set():
+            return
+        if not reused or any(cohort_scanner.is_reprobed(entry, known) for entry in entries):
+            cohort_scanner.write_manifest(
+                self.cohort_head, self.max_depth, dir_mtimes, tif_dirs, entries
+            )
+        self._scan_done.emit()
+
+    @QtCore.pyqtSlot(list, int, int)
+    def _on_batch_ready(self, batch: List[Dict[str, Any]], n_probed: int, n_total: int) -> None:
+        if self.cancel_event.is_set():
+            return
+        if batch:
+            self.tifs_found.emit(batch)
+        self.progress.emit(n_probed, n_total)
+
+    @QtCore.pyqtSlot()
+    def _on_scan_done(self) -> None:
+        if self.cancel_event.is_set():
+            return
+        self.done = True
+        self.finished.emit()
+
 
 class CohortTreeWidget(QtWidgets.QTreeWidget):
     def __init__(self, parent: QtWidgets.QWidget = None) -> None:
@@ -77,11 +260,141 @@ class CohortTreeWidget(QtWidgets.QTreeWidget):
         self.channels: Set[str] = set()
         self.head: CohortTreeWidgetItem = None
 
-    def load_cohort(self, cohort_head: str) -> None:
+        # tree parts -> directory items, for streamed loading
+        self.dir_items: Dict[Tuple[str, ...], CohortTreeWidgetItem] = {}
+        self.scanner: Union[CohortScanner, None] = None
+        self.lazy = False
+
+        self.itemExpanded.connect(self.on_item_expanded)
+
+    def load_cohort(self, cohort_head: str, lazy: bool = False) -> None:
+        """ Builds tree view of the cohort
+
+        Args:
+            cohort_head (str):
+                path to top level cohort directory
+            lazy (bool):
+                Only create FOV channel items once the FOV is expanded (or indexed into).
+                Default is False.
+        """
+        self.cancel_scan()
+
         # list lowest depth tifs
         self.head = CohortTreeWidgetItem(self, cohort_head)
         self.head.setText(0, os.path.basename(cohort_head))
-        self.channels = tif_bfs([self.head])
+
+        # reuses (and refreshes) the cohort manifest
+        self.channels = set()
+        self.dir_items = {(): self.head}
+        self.lazy = lazy
+        self.add_tif_entries(cohort_scanner.scan_cohort(cohort_head))
+
+    def load_cohort_async(self, cohort_head: str, lazy: bool = False) -> CohortScanner:
+        """ Starts building the tree view of the cohort in the background
+
+        Found tifs are added to the tree in batches as they're probed, so early fovs can be
+        viewed before the scan completes.
+
+        Args:
+            cohort_head (str):
+                path to top level cohort directory
+            lazy (bool):
+                Only create FOV channel items once the FOV is expanded (or indexed into).
+                Default is False.
+
+        Returns:
+            CohortScanner:
+                running scanner (for progress/cancellation)
+        """
+        self.cancel_scan()
+
+        self.head = CohortTreeWidgetItem(self, cohort_head)
+        self.head.setText(0, os.path.basename(cohort_head))
+        self.head.setExpanded(True)
+        self.channels = set()
+        self.dir_items = {(): self.head}
+        self.lazy = lazy
+
+        self.scanner = CohortScanner(cohort_head, parent=self)
+        self.scanner.tifs_found.connect(self.add_tif_entries)
+        self.scanner.start()
+
+        return self.scanner
+
+    def cancel_scan(self) -> None:
+        """ Cancels any running background scan
+        """
+        if self.scanner is not None:
+            self.scanner.cancel()
+            self.scanner = None
+
+    def add_tif_entries(self, entries: List[Dict[str, Any]]) -> None:
+        """ Adds probed tifs to the tree, creating their parent directories as needed
+
+        Args:
+            entries (List[Dict[str, Any]]):
+                tif entries, formatted as in `cohort_scanner.scan_cohort`
+        """
+        if self.head is None:
+            return
+
+        touched: Set[CohortTreeWidgetItem] = set()
+        fovs: Set[CohortTreeWidgetItem] = set()
+        for entry in entries:
+            parent = self._get_dir_item(tuple(entry['parts']), touched)
+            channels = entry_channels(entry)
+            if entry['is_mibitiff']:
+                # MIBItiffs are fovs of their own
+                fov = CohortTreeWidgetItem(parent, entry['path'], is_mibitiff=True)
+                fov.setText(0, os.path.basename(entry['path']))
+                touched.add(parent)
+            else:
+                fov = parent
+            fov.defer_channels(channels)
+            fovs.add(fov)
+            self.channels |= {channel_name for _, channel_name, _ in channels}
+
+        # channel items of collapsed fovs are made on expansion in lazy mode
+        for fov in fovs:
+            if not self.lazy or fov.isExpanded():
+                fov.populate()
+        for item in touched - fovs:
+            item.sortChildren(0, 0)
+
+    def _get_dir_item(self, parts: Tuple[str, ...],
+                      touched: Set[CohortTreeWidgetItem]) -> CohortTreeWidgetItem:
+        """ Gets (or creates) the directory item at the given tree parts
+
+        Args:
+            parts (Tuple[str, ...]):
+                directory names leading from the cohort head
+            touched (Set[CohortTreeWidgetItem]):
+                items whose children changed (parents of created items are added)
+
+        Returns:
+            CohortTreeWidgetItem:
+                directory item
+        """
+        if parts in self.dir_items:
+            return self.dir_items[parts]
+
+        parent = self._get_dir_item(parts[:-1], touched)
+        dir_item = CohortTreeWidgetItem(parent, os.path.join(parent.path, parts[-1]))
+        dir_item.setText(0, parts[-1])
+        dir_item.setFlags(dir_item.flags() & (~QtCore.Qt.ItemIsUserCheckable))
+        touched.add(parent)
+
+        self.dir_items[parts] = dir_item
+        return dir_item
+
+    def on_item_expanded(self, item: CohortTreeWidgetItem) -> None:
+        """ Callback for creating the deferred channel items of expanded fovs
+
+        Args:
+            item (CohortTreeWidgetItem): expanded item (given via signal)
+        """
+        if isinstance(item, CohortTreeWidgetItem):
+            item.populate()
 
     def get_channels(self) -> List[str]:
         return list(self.channels)
@@ -124,6 +437,10 @@ class CohortTreeWidget(QtWidgets.QTreeWidget):
 
         """
 
+        # deferred channels aren't cloned, so they're created first
+        if include_channels:
+            self.populate_all()
+
         # create deep copy
         head_out = self.head.clone()
 
@@ -132,6 +449,16 @@ class CohortTreeWidget(QtWidgets.QTreeWidget):
 
         return head_out
 
+    def populate_all(self) -> None:
+        """ Creates every deferred channel item in the tree
+        """
+        items = [self.head] if self.head is not None else []
+        while items:
+            item = items.pop()
+            item.populate()
+            items.extend(item.child(index) for index in range(item.childCount()))
+
+
 def add_checks(heads: List[QtWidgets.QTreeWidgetItem], excludes: Union[Set[str], None]) -> None:
     """ Recursively adds checks to all members of the tree widget
 
@@ -157,6 +484,67 @@ def add_checks(heads: List[QtWidgets.QTreeWidgetItem], excludes: Union[Set[str],
         add_checks([head.child(index) for index in range(head.childCount())], excludes)
 
 
+def set_channel_item(item: CohortTreeWidgetItem, channel_name: str) -> None:
+    """ Configures a tree item as a checkable channel
+
+    Args:
+        item (CohortTreeWidgetItem):
+            item to configure
+        channel_name (str):
+            displayed channel name
+    """
+    item.setFlags(item.flags() |
+                  QtCore.Qt.ItemIsUserCheckable |
+                  QtCore.Qt.ItemIsEnabled |
+                  QtCore.Qt.ItemNeverHasChildren)
+    item.setCheckState(0, QtCore.Qt.Unchecked)
+    item.setText(0, channel_name)
+
+
+def entry_channels(entry: Dict[str, Any]) -> List[Tuple[str, str, bool]]:
+    """ Lists the channel items of a scanned tif
+
+    Args:
+        entry (Dict[str, Any]):
+            tif entry, formatted as in `cohort_scanner.scan_cohort`
+
+    Returns:
+        List[Tuple[str, str, bool]]:
+            item path, channel name and MIBItiff status of each channel
+    """
+    if not entry['is_mibitiff']:
+        return [(entry['path'], os.path.basename(entry['path'].split('.')[0]), False)]
+
+    channels = []
+    for target in entry['channels']:
+        path = f"{entry['path']}|{target.replace('|', '_')}"
+        channels.append((path, os.path.basename(path.split('|')[1]), True))
+    return channels
+
+
+def add_mibitiff_channels(tif_item: CohortTreeWidgetItem) -> Set[str]:
+    """ Adds channel items to a MIBItiff item.  Channels are read from tag metadata only.
+
+    Args:
+        tif_item (CohortTreeWidgetItem):
+            MIBItiff tree item
+
+    Returns:
+        Set[str]:
+            added channel names
+    """
+    channels: Set[str] = set()
+    for _, target in tiff_utils.get_page_index(tif_item.path)['channels']:
+        channel_item = CohortTreeWidgetItem(
+            tif_item, f"{tif_item.path}|{target.replace('|', '_')}", is_mibitiff=True
+        )
+        channel_name = os.path.basename(channel_item.path.split('|')[1])
+        set_channel_item(channel_item, channel_name)
+        channels.add(channel_name)
+    tif_item.setText(0, os.path.basename(tif_item.path))
+    return channels
+
+
 def tif_bfs(heads: List[CohortTreeWidgetItem], max_depth: int = 6) -> None:
     """Recursive assembler of QtTreeWidget structure via breadth-first search.
 
@@ -184,10 +572,11 @@ def tif_bfs(heads: List[CohortTreeWidgetItem], max_depth: int = 6) -> None:
     layer_tifs: List[CohortTreeWidgetItem] = []
     # build search space for next recursion
     for head in heads:
+        entries = list(os.scandir(head.path))
         # create directory tree items (if no tifs found)
         layer_dirs.extend(
             [CohortTreeWidgetItem(head, entry.path)
-             for entry in os.scandir(head.path)
+             for entry in entries
              if entry.is_dir()
              and not entry.name.startswith('.')
              and len(layer_tifs) < 1]
@@ -195,7 +584,7 @@ def tif_bfs(heads: List[CohortTreeWidgetItem], max_depth: int = 6) -> None:
         # create tiff tree items
         layer_tifs.extend(
             [CohortTreeWidgetItem(head, entry.path)
-             for entry in os.scandir(head.path)
+             for entry in entries
              if entry.is_file()
              and '.tif' in entry.name]
         )
@@ -220,32 +609,12 @@ def tif_bfs(heads: List[CohortTreeWidgetItem], max_depth: int = 6) -> None:
 
         # check for mibitiff and set channels to be checkable
         for lt in layer_tifs:
-            if tiff_utils.is_mibitiff(lt.path):
-                _ , tif_channels = tiff_utils.read_mibitiff(lt.path)
-                layer_channels = [
-                    CohortTreeWidgetItem(lt, f"{lt.path}|{tif_channel[1].replace('|', '_')}")
-                    for tif_channel in tif_channels
-                ]
-                # redundant iteration (easier to read imo)
-                for lc in layer_channels:
-                    lc.setFlags(lc.flags() |
-                        QtCore.Qt.ItemIsUserCheckable |
-                        QtCore.Qt.ItemIsEnabled |
-                        QtCore.Qt.ItemNeverHasChildren)
-                    lc.setCheckState(0, QtCore.Qt.Unchecked)
-                    channel_name = os.path.basename(lc.path.split('|')[1])
-                    channels.add(channel_name)
-                    lc.setText(0, channel_name)
-                    lt.setText(0, os.path.basename(lt.path))
+            if lt.is_mibitiff:
+                channels |= add_mibitiff_channels(lt)
             else:
-                lt.setFlags(lt.flags() |
-                            QtCore.Qt.ItemIsUserCheckable |
-                            QtCore.Qt.ItemIsEnabled |
-                            QtCore.Qt.ItemNeverHasChildren)
-                lt.setCheckState(0, QtCore.Qt.Unchecked)
                 channel_name = os.path.basename(lt.path.split('.')[0])
+                set_channel_item(lt, channel_name)
                 channels.add(channel_name)
-                lt.setText(0, channel_name)
 
         return channels
     # if no tifs are found, repeat recursion
@@ -2,8 +2,12 @@
 # end custom imports - DO NOT MANUALLY EDIT ABOVE
 from PyQt5 import QtWidgets, QtGui, uic
 
+from amp.image_stats import ImageStats
+from amp.mplwidget import contrast_limits
 from amp.resource_path import resource_path
 
+from typing import Union
+
 class ContrastWindow(QtWidgets.QMainWindow):
 
     def __init__(self) -> None:
@@ -26,7 +30,33 @@ class ContrastWindow(QtWidgets.QMainWindow):
         self.minCapSlider.setTracking(False)
         self.maxCapSlider.setTracking(False)
 
-        pass
+        # intensity statistics of the shown image, for labeling the caps with intensities
+        self.image_stats: Union[ImageStats, None] = None
+        for slider in (self.minCapSlider, self.maxCapSlider):
+            slider.sliderMoved.connect(lambda x: self._update_cap_labels())
+            slider.valueChanged.connect(lambda x: self._update_cap_labels())
+
+    def set_image_stats(self, stats: Union[ImageStats, None]) -> None:
+        """ Sets the image the caps' intensities are shown for
+
+        Args:
+            stats (ImageStats | None):
+                intensity statistics of the shown image, or None if it doesn't use the caps
+        """
+        self.image_stats = stats
+        self._update_cap_labels()
+
+    def _update_cap_labels(self) -> None:
+        if self.image_stats is None:
+            self.label.setText('Max')
+            self.label_2.setText('Min')
+            return
+
+        vmin, vmax = contrast_limits(
+            self.image_stats, self.minCapSlider.sliderPosition(), self.maxCapSlider.sliderPosition()
+        )
+        self.label.setText(f'Max ({vmax:g})')
+        self.label_2.setText(f'Min ({vmin:g})')
 
     def closeEvent(self, a0: QtGui.QCloseEvent) -> None:
         self.hide()
@@ -0,0 +1,180 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from typing import Callable, Dict, Tuple, Any, Union
+
+# default budget for decoded channel data (1 GiB)
+DEFAULT_MAX_BYTES = 2 ** 30
+
+# default budget for memory mapped channel data (8 GiB).  mapped pages are paged in and out by the
+# OS, but each mapping still holds its file (even after it's replaced) and address space
+DEFAULT_MAX_MAPPED_BYTES = 8 * 2 ** 30
+
+
+class ImageCache(object):
+    """Bounded LRU cache of decoded channel images, shared across the viewer and plugins
+
+    Entries are keyed by item path (e.g 'fov1/TIFs/CD3.tif' or 'fov1.tiff|CD3') and the file's
+    modification time and size, so edits made outside of AMP are picked up automatically.  Cached arrays
+    are made read-only and handed out without copying; callers must copy before modifying.
+
+    Decoded and memory mapped arrays are budgeted separately, and each is evicted least recently used
+    first.  A budget of 0 disables caching of that kind of array.
+
+    Atributes:
+        max_bytes (int):
+            byte budget for decoded arrays
+        n_bytes (int):
+            decoded bytes currently cached
+        max_mapped_bytes (int):
+            byte budget for memory mapped arrays
+        n_mapped_bytes (int):
+            memory mapped bytes currently cached
+        hits (int):
+            number of cache hits
+        misses (int):
+            number of cache misses
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_mapped_bytes: int = DEFAULT_MAX_MAPPED_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.max_mapped_bytes = max_mapped_bytes
+        self.n_mapped_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: Dict[Tuple[str, int, int], Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str, loader: Callable[[], Any]) -> Any:
+        """ Gets channel data from the cache, loading it on a miss
+
+        Args:
+            path (str):
+                item path of the channel
+            loader (Callable[[], np.ndarray]):
+                reads the channel data from disk
+
+        Returns:
+            np.ndarray:
+                read-only channel data
+        """
+        stat = os.stat(path.split('|')[0])
+        key = (path, stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        data = loader()
+        data.flags.writeable = False
+
+        with self._lock:
+            max_bytes = self.max_mapped_bytes if _is_mapped(data) else self.max_bytes
+            if key not in self._entries and 0 < max_bytes and data.nbytes <= max_bytes:
+                # channels of older versions of the file won't be read again
+                file_path = path.split('|')[0]
+                for stale_key in [
+                    stale_key for stale_key in self._entries
+                    if stale_key[0].split('|')[0] == file_path and stale_key[1:] != key[1:]
+                ]:
+                    self._remove(stale_key)
+                self._entries[key] = data
+                self._add_cost(data, 1)
+                self._evict()
+
+        return data
+
+    def invalidate(self, path: str) -> None:
+        """ Drops all cached channels read from the given item's file
+
+        Args:
+            path (str):
+                item path of a channel (or file) that was written to
+        """
+        file_path = path.split('|')[0]
+        with self._lock:
+            for key in [key for key in self._entries if key[0].split('|')[0] == file_path]:
+                self._remove(key)
+
+    def set_max_bytes(self, max_bytes: int, max_mapped_bytes: Union[int, None] = None) -> None:
+        """ Changes the cache's byte budgets, evicting entries as needed
+
+        Args:
+            max_bytes (int):
+                new byte budget for decoded arrays
+            max_mapped_bytes (int | None):
+                new byte budget for memory mapped arrays.  If None, it's left unchanged.
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            if max_mapped_bytes is not None:
+                self.max_mapped_bytes = max_mapped_bytes
+            self._evict()
+
+    def clear(self) -> None:
+        """ Drops all cached channels
+        """
+        with self._lock:
+            self._entries.clear()
+            self.n_bytes = 0
+            self.n_mapped_bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """ Gets cache usage counters
+
+        Returns:
+            Dict[str, int]:
+                hits, misses, number of entries, and cached bytes and byte budget of decoded and
+                memory mapped arrays
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self.n_bytes,
+                'max_bytes': self.max_bytes,
+                'mapped_bytes': self.n_mapped_bytes,
+                'max_mapped_bytes': self.max_mapped_bytes,
+            }
+
+    def _add_cost(self, data: Any, sign: int) -> None:
+        # counts an array towards (or off) its budget (lock must be held)
+        if _is_mapped(data):
+            self.n_mapped_bytes += sign * data.nbytes
+        else:
+            self.n_bytes += sign * data.nbytes
+
+    def _remove(self, key: Tuple[str, int, int]) -> None:
+        # drops an entry (lock must be held)
+        self._add_cost(self._entries.pop(key), -1)
+
+    def _evict(self) -> None:
+        # drop least recently used entries until within both budgets (lock must be held)
+        for key in list(self._entries):
+            if self.n_bytes <= self.max_bytes and self.n_mapped_bytes <= self.max_mapped_bytes:
+                break
+            over_budget = (
+                self.n_mapped_bytes > self.max_mapped_bytes if _is_mapped(self._entries[key])
+                else self.n_bytes > self.max_bytes
+            )
+            if over_budget:
+                self._remove(key)
+
+
+def _is_mapped(data: Any) -> bool:
+    # memory mapped arrays are paged in and out by the OS, so are budgeted separately
+    return isinstance(data, np.memmap)
+
+
+# process-wide cache
+image_cache = ImageCache()
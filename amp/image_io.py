@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import skimage.io as io
+
+from typing import Any, Dict
+
+import amp.tiff_utils as tiff_utils
+from amp.image_cache import image_cache
+
+# reading/writing of cohort images by item path, independent of the Qt tree.
+# item paths are tif paths, or 'path/to/file.tiff|target' for MIBItiff channels.
+
+
+def read_image_data(path: str) -> Any:
+    """ Reads image data through the shared image cache
+
+    Args:
+        path (str):
+            item path of the image
+
+    Returns:
+        np.array:
+            read-only image data
+    """
+    return image_cache.get(path, lambda: _read_image_data(path))
+
+
+def _read_image_data(path: str) -> Any:
+    if len(path.split('|')) > 1:
+        img_data, _ = tiff_utils.read_mibitiff(
+            path.split('|')[0],
+            channels=[path.split('|')[1]]
+        )
+        return img_data[:, :, 0]
+    else:
+        # uncompressed tifs are mapped instead of decoded
+        img_data = tiff_utils.memmap_tif(path)
+        return io.imread(path) if img_data is None else img_data
+
+
+def write_image_data(path: str, new_data: Any, compress: Any = 6) -> None:
+    """ Writes image data to an item path
+
+    Args:
+        path (str):
+            item path of the image
+        new_data (np.array):
+            image data to write out to file
+        compress (int | str | tuple):
+            compression of MIBItiff channels (see `tiff_utils.write_mibitiff`).  Other tifs are
+            written uncompressed.
+    """
+    if len(path.split('|')) > 1:
+        tiff_utils.overwrite_mibitiff_channel(*path.split('|'), new_data, compress=compress)
+    else:
+        # replace, rather than truncate, the file so existing memory maps stay valid
+        tmp_fd, tmp_path = tempfile.mkstemp(suffix='.partial', dir=os.path.dirname(path))
+        os.close(tmp_fd)
+        try:
+            io.imsave(tmp_path, new_data.astype(np.uint8), plugin='tifffile')
+            shutil.copymode(path, tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    image_cache.invalidate(path)
+
+
+def write_channel_data(channel_data: Dict[str, Any], compress: Any = 6) -> None:
+    """ Writes image data to several item paths, rewriting each MIBItiff only once
+
+    Args:
+        channel_data (Dict[str, np.array]):
+            image data to write out, keyed by item path
+        compress (int | str | tuple):
+            compression of MIBItiff channels (see `tiff_utils.write_mibitiff`).  Other tifs are
+            written uncompressed.
+    """
+    mibitiff_data: Dict[str, Dict[str, Any]] = {}
+    for path, new_data in channel_data.items():
+        if len(path.split('|')) > 1:
+            file_path, target = path.split('|')
+            mibitiff_data.setdefault(file_path, {})[target] = new_data
+        else:
+            write_image_data(path, new_data, compress)
+
+    for file_path, file_channel_data in mibitiff_data.items():
+        tiff_utils.overwrite_mibitiff_channels(file_path, file_channel_data, compress=compress)
+        image_cache.invalidate(file_path)
@@ -0,0 +1,170 @@
+import threading
+import weakref
+
+import numpy as np
+
+from typing import Any, Dict, Iterable
+
+# intensity statistics of images, computed once per image and shared by the viewer and plugins
+
+# percentiles computed along with the statistics
+PERCENTILES = (1, 50, 99)
+
+# integer images spanning at most this many values are histogrammed with a bin per value
+_MAX_INT_BINS = 2 ** 16
+
+# number of histogram bins of other images
+_N_BINS = 256
+
+
+class ImageStats(object):
+    """ Intensity statistics (min, max, histogram and percentiles) of an image
+
+    Integer images spanning at most `_MAX_INT_BINS` values get a bin per value, so any of their
+    percentiles is found exactly from the histogram, rather than by sorting the image.  Other images
+    get `_N_BINS` bins, and only the percentiles computed up front are exact.
+
+    Stats only weakly reference their image, so caching them doesn't keep the image alive.
+
+    Args:
+        image (np.ndarray):
+            image data
+        percentiles (Iterable[float]):
+            percentiles to compute up front
+
+    Atributes:
+        min (number):
+            minimum intensity
+        max (number):
+            maximum intensity
+        dtype (np.dtype):
+            image dtype
+        size (int):
+            number of pixels
+        counts (np.ndarray):
+            histogram counts
+        bin_edges (np.ndarray):
+            histogram bin edges (unit bins starting at `min` for exact histograms)
+        exact (bool):
+            whether the histogram has a bin per value
+    """
+    def __init__(self, image: Any, percentiles: Iterable[float] = PERCENTILES) -> None:
+        self.min = np.min(image)
+        self.max = np.max(image)
+        self.dtype = image.dtype
+        self.size = image.size
+        self.exact = (
+            image.dtype.kind in 'biu' and int(self.max) - int(self.min) < _MAX_INT_BINS
+        )
+
+        if self.exact:
+            values = image.ravel()
+            if self.min != 0:
+                values = values.astype(np.int64) - int(self.min)
+            self.counts = np.bincount(values, minlength=int(self.max) - int(self.min) + 1)
+            self.bin_edges = np.arange(int(self.min), int(self.max) + 2)
+            self._percentiles: Dict[float, float] = {}
+        else:
+            self.counts, self.bin_edges = np.histogram(
+                image, bins=_N_BINS, range=(float(self.min), float(self.max))
+            )
+            percentiles = list(percentiles)
+            self._percentiles = dict(zip(percentiles, np.percentile(image, percentiles)))
+        self._cumulative_counts = np.cumsum(self.counts)
+
+        self._image = weakref.ref(image)
+
+    def describes(self, image: Any) -> bool:
+        """ Checks if these are the stats of the given image (rather than of a copy)
+
+        Args:
+            image (np.ndarray):
+                image data
+
+        Returns:
+            bool:
+                whether these stats were computed from `image`
+        """
+        return self._image() is image
+
+    def percentile(self, q: float) -> float:
+        """ Gets a percentile of the image's intensities
+
+        Matches `np.percentile` (linear interpolation) for exact histograms and up front
+        percentiles.  Other percentiles are estimated from the histogram.
+
+        Args:
+            q (float):
+                percentile, in [0, 100]
+
+        Returns:
+            float:
+                intensity at the percentile
+        """
+        if q in self._percentiles:
+            return self._percentiles[q]
+
+        # (fractional) index of the percentile in the sorted image
+        index = (self.size - 1) * (q / 100)
+        lower = int(np.floor(index))
+        if self.exact:
+            lower_value, upper_value = self.bin_edges[np.searchsorted(
+                self._cumulative_counts, [lower, min(lower + 1, self.size - 1)], side='right'
+            )].astype(np.float64)
+            fraction = index - lower
+            # same interpolation as np.percentile
+            if fraction >= 0.5:
+                value = upper_value - (upper_value - lower_value) * (1 - fraction)
+            else:
+                value = lower_value + (upper_value - lower_value) * fraction
+        else:
+            value = float(np.interp(
+                index + 1, np.concatenate(([0], self._cumulative_counts)), self.bin_edges
+            ))
+
+        self._percentiles[q] = value
+        return value
+
+
+# stats of read-only images, keyed by image id (entries are dropped along with their image)
+_stats_lock = threading.RLock()
+_cached_stats: Dict[int, ImageStats] = {}
+
+
+def image_stats(image: Any) -> ImageStats:
+    """ Gets an image's intensity statistics, computing them on first use
+
+    Stats of read-only images (e.g from the image cache) are kept for as long as the image is, and
+    shared by everything showing or processing it.  Writeable images may change, so their stats
+    are computed on each call; keep the result around instead.
+
+    Args:
+        image (np.ndarray):
+            image data
+
+    Returns:
+        ImageStats:
+            intensity statistics of the image
+    """
+    if image.flags.writeable:
+        return ImageStats(image)
+
+    key = id(image)
+    with _stats_lock:
+        stats = _cached_stats.get(key)
+        if stats is not None and stats.describes(image):
+            return stats
+
+    # computed outside the lock, so other images aren't blocked
+    stats = ImageStats(image)
+    with _stats_lock:
+        _cached_stats[key] = stats
+        weakref.finalize(image, _forget_stats, key, stats)
+    return stats
+
+
+def _forget_stats(key: int, stats: ImageStats) -> None:
+    # drops an image's stats once the image is freed (unless its id was reused since)
+    with _stats_lock:
+        if _cached_stats.get(key) is stats:
+            del _cached_stats[key]
@@ -0,0 +1,126 @@
+import hashlib
+import os
+import zipfile
+
+import numpy as np
+
+from typing import Any, Dict, Union
+
+# on-disk cache of mean knn distances and fitted thresholds, so they survive plugin reloads and
+# sessions.  entries live in a hidden directory next to the cohort (not inside it, so denoised
+# and background removed copies of the cohort don't carry them along).
+
+
+def knn_cache_dir(cohort_head: str) -> str:
+    """ Gets the knn cache directory of a cohort
+
+    Args:
+        cohort_head (str):
+            path to top level cohort directory
+
+    Returns:
+        str:
+            path to the cohort's knn cache directory
+    """
+    cohort_head = os.path.normpath(os.path.abspath(cohort_head))
+    return os.path.join(
+        os.path.dirname(cohort_head), f'.{os.path.basename(cohort_head)}_knn_cache'
+    )
+
+
+class KnnCache(object):
+    """ Persisted mean knn distances, optimal thresholds and display caps of cohort channels
+
+    Entries are keyed by item path (e.g 'fov1/TIFs/CD3.tif' or 'fov1.tiff|CD3'), channel and k,
+    and are only returned while the file's modification time and size are unchanged.  Each
+    channel's entry is a single compressed file, written atomically, so worker processes can
+    share the cache.
+
+    Args:
+        cache_dir (str):
+            cache directory (see `knn_cache_dir`)
+    """
+    def __init__(self, cache_dir: str) -> None:
+        self.cache_dir = cache_dir
+
+    def get(self, path: str, channel: str, k_val: int) -> Union[Dict[str, Any], None]:
+        """ Gets a channel's cached results
+
+        Args:
+            path (str):
+                item path of the channel
+            channel (str):
+                channel name
+            k_val (int):
+                number of neighbors the distances were averaged over
+
+        Returns:
+            dict | None:
+                'knn' (mean knn distances), and 'opt_thresh' and 'cap' if they were cached.
+                None if the channel isn't cached, or its file has changed since.
+        """
+        entry_path = self._entry_path(path, channel, k_val)
+        if not os.path.exists(entry_path):
+            return None
+
+        try:
+            with np.load(entry_path, allow_pickle=False) as entry:
+                if str(entry['path']) != os.path.abspath(path) or str(entry['channel']) != channel:
+                    return None
+                if tuple(entry['stat']) != self._stat(path):
+                    return None
+                cached = {'knn': entry['knn']}
+                for name in ('opt_thresh', 'cap'):
+                    if not np.isnan(entry[name]):
+                        cached[name] = float(entry[name])
+                return cached
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            # unreadable entries are recomputed, and overwritten
+            return None
+
+    def put(self, path: str, channel: str, k_val: int, knn: Any,
+            opt_thresh: Union[float, None] = None, cap: Union[float, None] = None) -> None:
+        """ Caches a channel's results, replacing any previous entry
+
+        Args:
+            path (str):
+                item path of the channel
+            channel (str):
+                channel name
+            k_val (int):
+                number of neighbors the distances were averaged over
+            knn (np.ndarray):
+                mean knn distances
+            opt_thresh (float | None):
+                optimal threshold, if fitted
+            cap (float | None):
+                display cap, if computed
+        """
+        entry_path = self._entry_path(path, channel, k_val)
+        tmp_path = f'{entry_path[:-len(".npz")]}.{os.getpid()}.tmp.npz'
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            np.savez_compressed(
+                tmp_path,
+                path=os.path.abspath(path),
+                channel=channel,
+                stat=np.array(self._stat(path)),
+                knn=knn,
+                opt_thresh=np.nan if opt_thresh is None else opt_thresh,
+                cap=np.nan if cap is None else cap,
+            )
+            os.replace(tmp_path, entry_path)
+        except OSError as e:
+            # results are still usable without the cache, e.g on read-only drives
+            print(f'Could not cache knns of {path}: {e}')
+
+    def _entry_path(self, path: str, channel: str, k_val: int) -> str:
+        key = f'{os.path.abspath(path)}\n{channel}\n{int(k_val)}'
+        return os.path.join(
+            self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npz'
+        )
+
+    @staticmethod
+    def _stat(path: str) -> tuple:
+        stat = os.stat(path.split('|')[0])
+        return stat.st_mtime_ns, stat.st_size
@@ -0,0 +1,795 @@
+import argparse
+import concurrent.futures
+import functools
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import traceback
+
+import numpy as np
+from scipy.stats import gamma
+from scipy.special import digamma, gammaln, polygamma
+from sklearn.neighbors import KDTree
+
+import amp.cohort_scanner as cohort_scanner
+import amp.image_io as image_io
+from amp.image_cache import image_cache
+from amp.image_stats import image_stats
+from amp.knn_cache import KnnCache, knn_cache_dir
+from amp.tiff_utils import parse_compress
+
+from typing import Any, Callable, Dict, Iterator, List, Tuple, Union
+
+# knn denoising algorithm and batch runner, independent of the Qt plugin
+
+SETTINGS_NAME = 'denoising_settings.json'
+
+# parameter (minimum, maximum, decimals), matching the plugin's spin boxes
+PARAM_RANGES = {
+    'thresh': (0, 50, 1),
+    'cap': (0, 40, 0),
+}
+
+_INIT_KNN_THRESH = 6
+_DEFAULT_KVAL = 25
+
+# engines for mean knn distances: scikit-learn's KD-tree, or an exact search of the pixel grid
+KNN_METHODS = ('kd_tree', 'grid')
+_DEFAULT_KNN_METHOD = 'kd_tree'
+
+# grid search radius, past which remaining pixels fall back to the KD-tree
+_GRID_KNN_MAX_RADIUS = 10
+
+# KD-tree tunables: points per leaf, and points per query chunk (bounds query memory)
+_KNN_LEAF_SIZE = 30
+_KNN_CHUNK_SIZE = 65536
+
+# threads used for KD-tree queries (None for one per cpu); worker processes split the cpus
+_knn_jobs: Union[int, None] = None
+
+# knn distance histogram bin width used when fitting thresholds (well under the 0.1 threshold step)
+_THRESH_BIN_WIDTH = 0.01
+
+# seconds between cancellation checks while waiting on worker processes
+_CANCEL_POLL_INTERVAL = 0.1
+
+
+def _solve_alphas(alpha_eq_consts: Any, max_iter: int = 20, tol: float = 1e-8) -> Any:
+    """ Solves log(alpha) - digamma(alpha) = C for each component's shape parameter
+
+    Starts from Minka's closed form approximation (within ~1.5%), then refines every component at
+    once with Newton steps.
+
+    Args:
+        alpha_eq_consts (ndarray): C of each component (log of weighted mean x minus weighted mean
+            of log x, which is positive)
+        max_iter (int): maximum Newton steps
+        tol (float): relative change of alpha at which to stop
+
+    Returns:
+        ndarray: shape parameter of each component
+    """
+    c = alpha_eq_consts
+    alphas = (3 - c + np.sqrt((c - 3) ** 2 + 24 * c)) / (12 * c)
+    for _iter in range(max_iter):
+        f = np.log(alphas) - digamma(alphas) - c
+        df = 1 / alphas - polygamma(1, alphas)
+        # f is convex and decreasing, so steps are halved rather than crossing zero
+        next_alphas = alphas - f / df
+        next_alphas = np.where(next_alphas > 0, next_alphas, alphas / 2)
+        converged = np.all(np.abs(next_alphas - alphas) <= tol * alphas)
+        alphas = next_alphas
+        if converged:
+            break
+    return alphas
+
+def _gamma_log_joint(x, log_x, ws, alphas, betas):
+    """ log(w * gamma pdf) of each component at each x, as an (n_dists, len(x)) array
+    """
+    param_terms = alphas * np.log(betas) - gammaln(alphas) + np.log(ws)
+    return (
+        param_terms[:, np.newaxis]
+        + (alphas[:, np.newaxis] - 1) * log_x
+        - betas[:, np.newaxis] * x
+    )
+
+def _responsibilities(log_joint):
+    """ Normalizes log joints over components (shifted by their max, so nothing underflows)
+    """
+    z_cond_dists = np.exp(log_joint - np.max(log_joint, axis=0))
+    z_cond_dists /= np.sum(z_cond_dists, axis=0)
+    return z_cond_dists
+
+def _gamma_mixture(x, n_dists, max_iter, init_index, tol, weights=None):
+
+    # samples may be weighted, e.g by histogram counts
+    if weights is None:
+        weights = np.ones_like(x)
+
+    # every component needs samples to initialize from
+    for i in range(n_dists):
+        if np.sum(weights[init_index == i]) <= 0:
+            raise ValueError(f'No distances fall in initial mixture component {i}')
+
+    # for a gamma distribution, alpha = mean**2 / var, beta = mean / var
+    ws, alphas, betas = (np.zeros(n_dists), np.zeros(n_dists), np.zeros(n_dists))
+    for i in range(n_dists):
+        in_dist = init_index == i
+        mean = np.average(x[in_dist], weights=weights[in_dist])
+        var = np.average((x[in_dist] - mean) ** 2, weights=weights[in_dist])
+        ws[i] = np.sum(weights[in_dist]) / np.sum(weights)
+        alphas[i] = (mean ** 2) / var
+        betas[i] = mean / var
+
+    log_x = np.log(x)
+
+    # responsibilities are computed in log space, and Q is reused from the previous iteration
+    log_joint = _gamma_log_joint(x, log_x, ws, alphas, betas)
+    z_cond_dists = _responsibilities(log_joint) * weights
+    q = np.sum(z_cond_dists * log_joint)
+
+    for _iter in range(max_iter):
+
+        sum_Ts = np.sum(z_cond_dists, axis=1)
+        sum_Txs = np.dot(z_cond_dists, x)
+        sum_Tlogxs = np.dot(z_cond_dists, log_x)
+
+        alpha_eq_consts = np.log(sum_Txs / sum_Ts) - (sum_Tlogxs / sum_Ts)
+
+        # compute argmax's
+        a_hats = _solve_alphas(alpha_eq_consts)
+        b_hats = a_hats * sum_Ts / sum_Txs
+        w_hats = sum_Ts / np.sum(weights)
+
+        # get next iter distributions
+        log_joint = _gamma_log_joint(x, log_x, w_hats, a_hats, b_hats)
+        z_cond_dists = _responsibilities(log_joint) * weights
+
+        # compute delta_q
+        q_next = np.sum(z_cond_dists * log_joint)
+        delta_q = q_next - q
+
+        # update params
+        ws, alphas, betas = (w_hats, a_hats, b_hats)
+        q = q_next
+
+        if np.abs(delta_q) <= tol:
+            break
+
+    return ws, alphas, betas
+
+def _histogram_samples(knn_dists, bin_width):
+    """ Bins distances into (bin centers, counts), dropping empty bins
+    """
+    first_edge = np.floor(np.min(knn_dists) / bin_width) * bin_width
+    n_bins = int(np.ceil((np.max(knn_dists) - first_edge) / bin_width)) + 1
+    counts, edges = np.histogram(
+        knn_dists, bins=n_bins, range=(first_edge, first_edge + n_bins * bin_width)
+    )
+    centers = (edges[:-1] + edges[1:]) / 2
+    return centers[counts > 0], counts[counts > 0].astype(float)
+
+def optimize_threshold(knn_dists, max_N = None, bin_width = _THRESH_BIN_WIDTH):
+
+    knn_sample = None
+    if max_N is not None and knn_dists.shape[0] > max_N:
+        knn_sample = np.random.choice(knn_dists, size=max_N, replace=False)
+    else:
+        knn_sample = knn_dists
+
+    # fit the binned distribution (deterministic, and independent of the number of pixels)
+    weights = None
+    if bin_width is not None:
+        knn_sample, weights = _histogram_samples(knn_sample, bin_width)
+
+    # approximate initial distribution assignments
+    assignment_guess = np.zeros_like(knn_sample)
+    assignment_guess[knn_sample > _INIT_KNN_THRESH] = 1
+
+    w, alpha, beta = _gamma_mixture(knn_sample, 2, 500, assignment_guess, 1e-3, weights)
+
+    means = np.sort(alpha / beta)
+    x = np.linspace(means[0], means[1], num=int(10*(means[1] - means[0])))
+
+    dist1 = w[0] * gamma.pdf(x, alpha[0], scale = 1 / beta[0])
+    dist2 = w[1] * gamma.pdf(x, alpha[1], scale = 1 / beta[1])
+
+    if len(np.abs(dist1 - dist2)) == 0:
+        return _INIT_KNN_THRESH
+
+    return x[np.argmin(np.abs(dist1 - dist2))]
+
+
+def _grid_knn_sums(non_zeros: Any, shape: Tuple[int, ...], k_val: int,
+                   max_radius: int = _GRID_KNN_MAX_RADIUS) -> Tuple[Any, Any]:
+    """ Sums each nonzero pixel's k nearest neighbor distances, by searching grid offsets in
+    order of distance
+
+    Offsets at the same distance are searched together, so ties don't change the sums.
+
+    Args:
+        non_zeros (ndarray): nonzero indicies of the channel
+        shape (tuple): channel shape
+        k_val (int): number of neighbors to sum over
+        max_radius (int): largest offset distance searched
+
+    Returns:
+        tuple: neighbor distance sums, and indicies (into non_zeros) of pixels with fewer than
+        k_val neighbors within max_radius
+    """
+    # offsets within the radius, grouped into shells of equal distance
+    dy, dx = np.mgrid[-max_radius:max_radius + 1, -max_radius:max_radius + 1]
+    sq_dists = (dy ** 2 + dx ** 2).ravel()
+    in_radius = (sq_dists > 0) & (sq_dists <= max_radius ** 2)
+    dy, dx, sq_dists = dy.ravel()[in_radius], dx.ravel()[in_radius], sq_dists[in_radius]
+    order = np.argsort(sq_dists, kind='stable')
+    dy, dx, sq_dists = dy[order], dx[order], sq_dists[order]
+    shell_starts = np.flatnonzero(np.diff(sq_dists, prepend=-1))
+
+    # pad the occupancy grid by the radius, so offsets never leave it
+    padded_width = shape[1] + 2 * max_radius
+    occupied = np.zeros((shape[0] + 2 * max_radius, padded_width), dtype=bool)
+    occupied[non_zeros[:, 0] + max_radius, non_zeros[:, 1] + max_radius] = True
+    occupied = occupied.ravel()
+    flat_inds = (non_zeros[:, 0] + max_radius) * padded_width + non_zeros[:, 1] + max_radius
+    flat_offsets = dy * padded_width + dx
+
+    sums = np.zeros(non_zeros.shape[0])
+    found = np.zeros(non_zeros.shape[0], dtype=int)
+    pending = np.arange(non_zeros.shape[0])
+    for start, end in zip(shell_starts, np.append(shell_starts[1:], sq_dists.shape[0])):
+        in_shell = np.count_nonzero(
+            occupied[flat_inds[pending, np.newaxis] + flat_offsets[np.newaxis, start:end]],
+            axis=1
+        )
+        taken = np.minimum(in_shell, k_val - found[pending])
+        sums[pending] += taken * np.sqrt(sq_dists[start])
+        found[pending] += taken
+        pending = pending[found[pending] < k_val]
+        if pending.shape[0] == 0:
+            break
+
+    return sums, pending
+
+
+def _kd_tree_knn(non_zeros: Any, query_inds: Any, k_val: int,
+                 leaf_size: int = _KNN_LEAF_SIZE, chunk_size: int = _KNN_CHUNK_SIZE,
+                 n_jobs: Union[int, None] = None) -> Any:
+    """ Queries mean knn distances from a KD-tree, in chunks across threads
+
+    Each chunk is reduced to its mean distances as soon as it's queried, so memory is bounded by
+    the chunk size rather than the number of queried pixels.
+
+    Args:
+        non_zeros (ndarray): nonzero indicies of the channel
+        query_inds (ndarray): indicies (into non_zeros) of the pixels to query
+        k_val (int): number of neighbors to average over
+        leaf_size (int): KD-tree leaf size
+        chunk_size (int): pixels per query chunk
+        n_jobs (int | None): query threads.  If None, `_knn_jobs` is used.
+
+    Returns:
+        ndarray: mean knn distance of each queried pixel
+    """
+    if non_zeros.shape[0] < k_val + 1:
+        raise ValueError(
+            f'{k_val} nearest neighbors need at least {k_val + 1} nonzero pixels, '
+            f'but the channel has {non_zeros.shape[0]}'
+        )
+
+    points = non_zeros.astype(float)
+    tree = KDTree(points, leaf_size=leaf_size)
+
+    def _query_chunk(start: int) -> Any:
+        distances, _ = tree.query(points[query_inds[start:start + chunk_size]], k=int(k_val + 1))
+        return np.mean(distances[:, 1:], axis=1)
+
+    starts = range(0, query_inds.shape[0], chunk_size)
+    n_jobs = n_jobs or _knn_jobs or os.cpu_count() or 1
+    if n_jobs <= 1 or len(starts) <= 1:
+        chunk_means = [_query_chunk(start) for start in starts]
+    else:
+        # queries release the GIL, so chunks run in parallel
+        with concurrent.futures.ThreadPoolExecutor(min(n_jobs, len(starts))) as executor:
+            chunk_means = list(executor.map(_query_chunk, starts))
+
+    return np.concatenate(chunk_means) if chunk_means else np.zeros(0)
+
+
+def generate_knn(channel_data: Any, k_val: int = _DEFAULT_KVAL,
+                 method: str = _DEFAULT_KNN_METHOD, leaf_size: int = _KNN_LEAF_SIZE,
+                 chunk_size: int = _KNN_CHUNK_SIZE,
+                 n_jobs: Union[int, None] = None) -> Tuple[Any, Any]:
+    """Generates mean knn distance image for denoising
+
+    Args:
+        channel_data (ndarray): channel data used to compute mean knn dist
+        k_val (int): number of neighbors to average over
+        method (str): knn engine, one of `KNN_METHODS`.  'grid' searches the pixel grid around
+            each nonzero pixel (much faster on dense channels), and gives the same distances as
+            'kd_tree'.
+        leaf_size (int): KD-tree leaf size
+        chunk_size (int): pixels per KD-tree query chunk
+        n_jobs (int | None): KD-tree query threads.  If None, one per cpu is used (split between
+            worker processes).
+
+    Returns:
+        tuple: nonzero indicies, generated mean knn distances
+    """
+    if method not in KNN_METHODS:
+        raise ValueError(f"Unknown knn method '{method}', expected one of {KNN_METHODS}")
+
+    non_zeros = np.array(channel_data.nonzero()).T
+
+    # empty channels have nothing to denoise
+    if non_zeros.shape[0] == 0:
+        return non_zeros, np.zeros(0)
+
+    if method == 'grid':
+        sums, pending = _grid_knn_sums(non_zeros, channel_data.shape, int(k_val))
+        knn_mean = sums / k_val
+        # isolated pixels are left to the KD-tree
+        if pending.shape[0] > 0:
+            knn_mean[pending] = _kd_tree_knn(
+                non_zeros, pending, k_val, leaf_size, chunk_size, n_jobs
+            )
+        return non_zeros, knn_mean
+
+    knn_mean = _kd_tree_knn(
+        non_zeros, np.arange(non_zeros.shape[0]), k_val, leaf_size, chunk_size, n_jobs
+    )
+
+    return non_zeros, knn_mean
+
+
+def evaluate_target(non_zeros: Any, knn: Any, channel_data: Any, thresh: float,
+                    cap: Union[float, None] = None) -> Any:
+    """ Removes nonzero pixels whose mean knn distance is over the threshold
+
+    Args:
+        non_zeros (ndarray): nonzero indicies of the channel
+        knn (ndarray): mean knn distance of each nonzero pixel
+        channel_data (ndarray): channel data to denoise (const)
+        thresh (float): mean knn distance threshold
+        cap (float | None): intensity cap.  If None, intensities aren't capped.
+
+    Returns:
+        ndarray: denoised channel data
+    """
+    denoised = np.array(channel_data)
+    bad_inds = non_zeros[knn > thresh].T
+    if bad_inds.size > 0:
+        denoised[bad_inds[0], bad_inds[1]] = 0
+    if cap is not None:
+        denoised[denoised > cap] = cap
+
+    return denoised
+
+
+def clamp_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    """ Clamps and rounds parameters as the plugin's spin boxes do, so headless runs match runs
+    started from the plugin
+
+    Args:
+        params (dict): channel parameters
+
+    Returns:
+        dict: clamped parameters
+    """
+    clamped = dict(params)
+    for name, (minimum, maximum, decimals) in PARAM_RANGES.items():
+        if name in clamped:
+            clamped[name] = min(max(round(clamped[name], decimals), minimum), maximum)
+    return clamped
+
+
+def denoise_channel(channel_data: Any, params: Dict[str, Any], knn: Any = None,
+                    knn_method: str = _DEFAULT_KNN_METHOD, leaf_size: int = _KNN_LEAF_SIZE,
+                    chunk_size: int = _KNN_CHUNK_SIZE) -> Any:
+    """ Denoises a single channel
+
+    Args:
+        channel_data (ndarray): channel data to denoise (const)
+        params (dict): channel parameters, containing 'thresh' and 'cap'
+        knn (ndarray | None): precomputed mean knn distances.  If None, they're computed.
+        knn_method (str): knn engine used if computing distances (see `generate_knn`)
+        leaf_size (int): KD-tree leaf size used if computing distances
+        chunk_size (int): pixels per KD-tree query chunk used if computing distances
+
+    Returns:
+        ndarray: denoised channel data
+    """
+    params = clamp_params(params)
+    if knn is None:
+        non_zeros, knn = generate_knn(
+            channel_data, method=knn_method, leaf_size=leaf_size, chunk_size=chunk_size
+        )
+    else:
+        non_zeros = np.array(channel_data.nonzero()).T
+
+    return evaluate_target(non_zeros, knn, channel_data, params['thresh'], params['cap'])
+
+
+def load_settings(settings_path: str) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """ Loads denoising settings, as saved by the plugin
+
+    Args:
+        settings_path (str): path to settings json
+
+    Returns:
+        dict: channel parameters, keyed by FOV tree path then channel
+    """
+    with open(settings_path, 'r') as fp:
+        return json.load(fp)
+
+
+def _init_worker(knn_jobs: int = 1) -> None:
+    global _knn_jobs
+    # worker processes only read each image once, so caching would just hold memory
+    image_cache.set_max_bytes(0, 0)
+    _knn_jobs = knn_jobs
+
+
+def _denoise_point(channels: List[Tuple[str, str, str, Dict[str, Any], Any]],
+                   knn_method: str = _DEFAULT_KNN_METHOD,
+                   cache_dir: Union[str, None] = None, compress: Any = 6,
+                   leaf_size: int = _KNN_LEAF_SIZE, chunk_size: int = _KNN_CHUNK_SIZE) -> int:
+    """ Denoises one FOV's channels (runs in a worker process)
+
+    Args:
+        channels (list):
+            channel, source item path, destination item path, parameters and precomputed mean
+            knn distances (or None) of each channel
+        knn_method (str):
+            knn engine used for channels without precomputed distances
+        cache_dir (str | None):
+            knn cache directory (see `KnnCache`).  If None, nothing is cached.
+        compress (int | str | tuple):
+            compression of denoised MIBItiff channels (see `tiff_utils.write_mibitiff`)
+        leaf_size (int):
+            KD-tree leaf size (see `generate_knn`)
+        chunk_size (int):
+            pixels per KD-tree query chunk (see `generate_knn`)
+
+    Returns:
+        int:
+            number of denoised channels
+    """
+    cache = KnnCache(cache_dir) if cache_dir is not None else None
+
+    denoised = {}
+    for channel, src_path, dst_path, params, knn in channels:
+        channel_data = image_io.read_image_data(src_path)
+        if knn is None and cache is not None:
+            cached = cache.get(src_path, channel, _DEFAULT_KVAL)
+            if cached is not None:
+                knn = cached['knn']
+            else:
+                _, knn = generate_knn(
+                    channel_data, method=knn_method, leaf_size=leaf_size, chunk_size=chunk_size
+                )
+                cache.put(src_path, channel, _DEFAULT_KVAL, knn)
+        denoised[dst_path] = denoise_channel(
+            channel_data, params, knn, knn_method, leaf_size, chunk_size
+        )
+
+    # write all of a point's channels at once, so MIBItiffs are only rewritten once
+    image_io.write_channel_data(denoised, compress)
+    return len(channels)
+
+
+def _map_unordered(func: Callable[[Any], Any], tasks: List[Any],
+                   max_workers: Union[int, None] = None,
+                   cancel_event: Union[threading.Event, None] = None) -> Iterator[Any]:
+    """ Runs tasks on a process pool, yielding results as they complete
+
+    Args:
+        func (Callable):
+            module level function to run on each task
+        tasks (list):
+            picklable task arguments
+        max_workers (int | None):
+            maximum number of worker processes.  If None, one per cpu is used.  With a single
+            worker, tasks run in this process.
+        cancel_event (threading.Event | None):
+            once set, no further results are yielded and pending tasks are dropped
+
+    Returns:
+        Iterator:
+            task results, in completion order
+    """
+    if cancel_event is None:
+        cancel_event = threading.Event()
+
+    n_workers = min(max_workers or os.cpu_count() or 1, len(tasks))
+    if n_workers <= 1:
+        for task in tasks:
+            if cancel_event.is_set():
+                return
+            yield func(task)
+        return
+
+    # spawned, rather than forked, workers are safe to start from the Qt app's threads
+    # workers split the cpus between their knn query threads
+    knn_jobs = max(1, (os.cpu_count() or 1) // n_workers)
+    with multiprocessing.get_context('spawn').Pool(
+            n_workers, initializer=_init_worker, initargs=(knn_jobs,)) as pool:
+        results = pool.imap_unordered(func, tasks)
+        for _ in range(len(tasks)):
+            # poll, so cancelling doesn't wait on running tasks
+            while True:
+                if cancel_event.is_set():
+                    return
+                try:
+                    result = results.next(timeout=_CANCEL_POLL_INTERVAL)
+                    break
+                except multiprocessing.TimeoutError:
+                    continue
+            if cancel_event.is_set():
+                return
+            yield result
+
+
+def _knn_task(task: Tuple[str, str, str, Any, bool], knn_method: str = _DEFAULT_KNN_METHOD,
+              cache_dir: Union[str, None] = None, leaf_size: int = _KNN_LEAF_SIZE,
+              chunk_size: int = _KNN_CHUNK_SIZE
+              ) -> Tuple[str, str, Any, Union[float, None], float, str]:
+    """ Computes a channel's knn results (runs in a worker process)
+
+    Args:
+        task (tuple):
+            FOV tree path, channel, item path, precomputed mean knn distances (or None), and
+            whether to optimize the threshold
+        knn_method (str):
+            knn engine (see `generate_knn`)
+        cache_dir (str | None):
+            knn cache directory (see `KnnCache`).  If None, nothing is cached.
+        leaf_size (int):
+            KD-tree leaf size (see `generate_knn`)
+        chunk_size (int):
+            pixels per KD-tree query chunk (see `generate_knn`)
+
+    Returns:
+        tuple:
+            see `compute_knns`
+    """
+    point, channel, path, knn, optimize = task
+    cache = KnnCache(cache_dir) if cache_dir is not None else None
+    cached = (cache.get(path, channel, _DEFAULT_KVAL) if cache is not None else None) or {}
+
+    # the channel is only read if something isn't cached
+    channel_data = None
+    if knn is None:
+        knn = cached.get('knn')
+    if knn is None:
+        channel_data = image_io.read_image_data(path)
+        _, knn = generate_knn(
+            channel_data, method=knn_method, leaf_size=leaf_size, chunk_size=chunk_size
+        )
+
+    opt_thresh, error = None, ''
+    if optimize:
+        opt_thresh = cached.get('opt_thresh')
+        if opt_thresh is None:
+            try:
+                opt_thresh = optimize_threshold(knn)
+            except ValueError as e:
+                error = str(e) + '\n' + traceback.format_exc()
+
+    # set display cap to ~99th percentile
+    cap = cached.get('cap')
+    if cap is None:
+        if channel_data is None:
+            channel_data = image_io.read_image_data(path)
+        cap = image_stats(channel_data).percentile(99) + 1
+
+    computed = {'knn': knn, 'cap': cap}
+    if opt_thresh is not None:
+        computed['opt_thresh'] = opt_thresh
+    if cache is not None and any(name not in cached for name in computed):
+        cache.put(
+            path, channel, _DEFAULT_KVAL, knn,
+            computed.get('opt_thresh', cached.get('opt_thresh')), cap
+        )
+
+    return point, channel, knn, opt_thresh, cap, error
+
+
+def compute_knns(tasks: List[Tuple[str, str, str, Any, bool]],
+                 max_workers: Union[int, None] = None,
+                 cancel_event: Union[threading.Event, None] = None,
+                 knn_method: str = _DEFAULT_KNN_METHOD,
+                 cache_dir: Union[str, None] = None, leaf_size: int = _KNN_LEAF_SIZE,
+                 chunk_size: int = _KNN_CHUNK_SIZE
+                 ) -> Iterator[Tuple[str, str, Any, Union[float, None], float, str]]:
+    """ Computes mean knn distances, optimal thresholds and display caps, one channel per worker
+    process
+
+    Args:
+        tasks (list):
+            FOV tree path, channel, item path, precomputed mean knn distances (or None), and
+            whether to optimize the threshold, of each channel
+        max_workers (int | None):
+            maximum number of worker processes.  If None, one per cpu is used.
+        cancel_event (threading.Event | None):
+            once set, no further results are yielded and pending channels are dropped
+        knn_method (str):
+            knn engine (see `generate_knn`)
+        cache_dir (str | None):
+            knn cache directory (see `KnnCache`).  Cached results are reused, and new results
+            cached.  If None, nothing is cached.
+        leaf_size (int):
+            KD-tree leaf size (see `generate_knn`)
+        chunk_size (int):
+            pixels per KD-tree query chunk (see `generate_knn`)
+
+    Returns:
+        Iterator:
+            FOV tree path, channel, mean knn distances, optimal threshold (None if not
+            optimized), display cap, and threshold optimization error (empty if none), of each
+            channel in completion order
+    """
+    return _map_unordered(
+        functools.partial(
+            _knn_task, knn_method=knn_method, cache_dir=cache_dir, leaf_size=leaf_size,
+            chunk_size=chunk_size
+        ),
+        tasks, max_workers, cancel_event
+    )
+
+
+def denoise_cohort(cohort_head: str, settings: Dict[str, Dict[str, Dict[str, Any]]],
+                   knns: Union[Dict[str, Dict[str, Any]], None] = None,
+                   progress_callback: Union[Callable[[int, int], None], None] = None,
+                   max_workers: Union[int, None] = None,
+                   knn_method: str = _DEFAULT_KNN_METHOD,
+                   cache_dir: Union[str, None] = None, compress: Any = 6,
+                   cancel_event: Union[threading.Event, None] = None,
+                   leaf_size: int = _KNN_LEAF_SIZE, chunk_size: int = _KNN_CHUNK_SIZE) -> str:
+    """ Denoises every FOV/channel in the settings, one FOV per worker process
+
+    Denoised images are written to a 'denoised' directory next to the cohort, and the cohort
+    itself is left untouched.  FOVs or channels missing from the cohort are skipped.
+
+    Args:
+        cohort_head (str):
+            path to top level cohort directory
+        settings (dict):
+            channel parameters, keyed by FOV tree path then channel
+        knns (dict | None):
+            precomputed mean knn distances, keyed by FOV tree path then channel
+        progress_callback (Callable[[int, int], None] | None):
+            called with the number of denoised FOVs and the total after each FOV
+        max_workers (int | None):
+            maximum number of worker processes.  If None, one per cpu is used.
+        knn_method (str):
+            knn engine used for channels without precomputed distances (see `generate_knn`)
+        cache_dir (str | None):
+            knn cache directory (see `KnnCache`).  Cached distances are reused, and new ones
+            cached.  If None, nothing is cached.
+        compress (int | str | tuple):
+            compression of denoised MIBItiff channels (see `tiff_utils.write_mibitiff`)
+        cancel_event (threading.Event | None):
+            once set, pending FOVs are dropped and the partial copy is removed
+        leaf_size (int):
+            KD-tree leaf size (see `generate_knn`)
+        chunk_size (int):
+            pixels per KD-tree query chunk (see `generate_knn`)
+
+    Raises:
+        concurrent.futures.CancelledError
+
+    Returns:
+        str:
+            path to the denoised cohort
+    """
+    if knns is None:
+        knns = {}
+
+    src_dir = os.path.normpath(cohort_head)
+    parent_dir = os.path.dirname(src_dir)
+    tmp_dir = os.path.join(parent_dir, 'denoised_temp')
+    final_dir = os.path.join(parent_dir, 'denoised')
+
+    fovs = cohort_scanner.index_cohort(src_dir)
+
+    tasks = []
+    for point, targets in settings.items():
+        channels = fovs.get(point, {})
+        tasks.append([
+            (
+                target,
+                channels[target],
+                tmp_dir + channels[target][len(src_dir):],
+                params,
+                knns.get(point, {}).get(target)
+            )
+            for target, params in targets.items() if target in channels
+        ])
+
+    # denoise a copy of the cohort, so the cohort is untouched if denoising fails
+    shutil.copytree(src_dir, tmp_dir)
+
+    try:
+        denoise_point = functools.partial(
+            _denoise_point, knn_method=knn_method, cache_dir=cache_dir, compress=compress,
+            leaf_size=leaf_size, chunk_size=chunk_size
+        )
+        results = _map_unordered(denoise_point, tasks, max_workers, cancel_event)
+        for done, _ in enumerate(results, 1):
+            if progress_callback is not None:
+                progress_callback(done, len(tasks))
+
+        # a cancelled run leaves FOVs noisy, so it isn't kept
+        if cancel_event is not None and cancel_event.is_set():
+            raise concurrent.futures.CancelledError('Denoising cancelled')
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    os.rename(tmp_dir, final_dir)
+
+    return final_dir
+
+
+def main(argv: Union[list, None] = None) -> None:
+    """ Command line entry point for headless denoising
+    """
+    parser = argparse.ArgumentParser(
+        description='Runs KNN denoising over a cohort, using settings saved by the plugin.'
+    )
+    parser.add_argument('cohort', help='path to top level cohort directory')
+    parser.add_argument(
+        '--settings',
+        help=f"path to denoising settings (default: '<cohort>/{SETTINGS_NAME}')"
+    )
+    parser.add_argument(
+        '--workers', type=int,
+        help='number of worker processes (default: one per cpu)'
+    )
+    parser.add_argument(
+        '--knn-method', choices=KNN_METHODS, default=_DEFAULT_KNN_METHOD,
+        help=f"knn engine; 'grid' is faster on dense channels (default: {_DEFAULT_KNN_METHOD})"
+    )
+    parser.add_argument(
+        '--leaf-size', type=int, default=_KNN_LEAF_SIZE,
+        help=f'KD-tree leaf size (default: {_KNN_LEAF_SIZE})'
+    )
+    parser.add_argument(
+        '--chunk-size', type=int, default=_KNN_CHUNK_SIZE,
+        help=f'pixels per KD-tree query chunk; smaller chunks use less memory '
+             f'(default: {_KNN_CHUNK_SIZE})'
+    )
+    parser.add_argument(
+        '--no-cache', action='store_true',
+        help='neither reuse nor save knn distances cached next to the cohort'
+    )
+    parser.add_argument(
+        '--compress', type=parse_compress, default=6,
+        help="MIBItiff compression: a zlib level (0 for none), a codec name, or 'codec:level' "
+             "(default: 6)"
+    )
+    args = parser.parse_args(argv)
+    for option, value in (('--leaf-size', args.leaf_size), ('--chunk-size', args.chunk_size)):
+        if value < 1:
+            parser.error(f'{option} must be at least 1')
+
+    settings_path = args.settings or os.path.join(args.cohort, SETTINGS_NAME)
+    settings = load_settings(settings_path)
+
+    def _print_progress(done: int, total: int) -> None:
+        print(f'Denoised {done}/{total} FOVs', flush=True)
+
+    final_dir = denoise_cohort(
+        args.cohort, settings, progress_callback=_print_progress, max_workers=args.workers,
+        knn_method=args.knn_method,
+        cache_dir=None if args.no_cache else knn_cache_dir(args.cohort), compress=args.compress,
+        leaf_size=args.leaf_size, chunk_size=args.chunk_size
+    )
+    print(f'Denoised cohort written to {final_dir}')
+
+
+if __name__ == '__main__':
+    main()
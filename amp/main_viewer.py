@@ -9,16 +9,18 @@ import sys
 
 from PyQt5 import QtWidgets, QtCore, uic
 
+from matplotlib.backends.backend_qt5agg import FigureCanvas
+
 from amp.breakout_figure import BreakoutWindow
 from amp.contrast_window import ContrastWindow
-from amp.mplwidget import ImagePlot
+from amp.mplwidget import ImagePlot, Plot
 from amp.figure_manager import FigureManager
+from amp.render_scheduler import RenderScheduler
 
 import skimage.io as io
 from numpy import asarray
 
 import os
-import concurrent.futures
 
 from amp.plguin_loader import load_plugin
 
@@ -62,6 +64,11 @@ class MainViewer(QtWidgets.QMainWindow):
         # set default canvas for plot list
         self.PlotListWidget.set_canvas(self.MplWidget._canvas)
 
+        # plots are prepared on worker threads, and only drawn on the ui thread
+        self.render_scheduler = RenderScheduler(parent=self)
+        self.render_scheduler.drawn.connect(self.on_plot_drawn)
+        self.PlotListWidget.set_render_scheduler(self.render_scheduler)
+
         # set check breakout window callback
         self.PlotListWidget.set_breakout_callback(self._check_delete_breakout)
 
@@ -71,8 +78,16 @@ class MainViewer(QtWidgets.QMainWindow):
         # TODO: load cached plugins
         self.plugins: Dict[str, QtWidgets.QMainWindow] = {}
 
-        # General UI threadpool (probably shouldn't use this for big algos)
-        self.executer = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # cohort scan progress + cancellation (hidden until a scan starts)
+        self.scanProgressBar = QtWidgets.QProgressBar()
+        self.scanProgressBar.setMaximumWidth(200)
+        self.scanProgressBar.setFormat('%v/%m tifs')
+        self.cancelScanButton = QtWidgets.QPushButton('Cancel')
+        self.cancelScanButton.clicked.connect(self.CohortTreeWidget.cancel_scan)
+        self.statusbar.addPermanentWidget(self.scanProgressBar)
+        self.statusbar.addPermanentWidget(self.cancelScanButton)
+        self.scanProgressBar.hide()
+        self.cancelScanButton.hide()
 
         # connect UI callbacks
         self.PlotListWidget.itemChanged.connect(self.on_plot_item_change)
@@ -151,7 +166,8 @@ class MainViewer(QtWidgets.QMainWindow):
                             previous: PlotListWidgetItem) -> None:
         """ Callback for updating viewer to display new plots
 
-        Uses threadpool for 'pause-less' UI
+        Uses render scheduler for 'pause-less' UI.  Only the latest selection is drawn, so
+        scrolling through the plot list doesn't queue up redraws.
 
         Args:
             current: newly selected PlotListItem (given via signal)
@@ -159,15 +175,24 @@ class MainViewer(QtWidgets.QMainWindow):
 
         """
         if current:
-            self.executer.submit(
-                current.refresh,
-                self._check_contrast()
-            )
-            self.executer.submit(
-                current.plot.plot_update,
-                self.MplWidget._canvas,
-                current.plot.plot_data
-            )
+            current.refresh(self._check_contrast(), self.render_scheduler)
+
+    def on_plot_drawn(self, canvas: FigureCanvas, plot: Plot) -> None:
+        """ Callback for finished plot draws
+
+        Labels the contrast window's caps with the intensities of the image in the viewer
+
+        Args:
+            canvas: canvas the plot was drawn onto (given via signal)
+            plot: drawn plot (given via signal)
+
+        """
+        if canvas is not self.MplWidget._canvas:
+            return
+        if plot.plot_data.get('fixed_contrast', True):
+            self.contrast_window.set_image_stats(None)
+        else:
+            self.contrast_window.set_image_stats(plot.plot_data.get('stats'))
 
     def refresh_plots(self) -> None:
         """ Manually update viewer
@@ -176,9 +201,7 @@ class MainViewer(QtWidgets.QMainWindow):
         data has been written to an existing PlotListItem
 
         """
-        self.executer.submit(
-            self.PlotListWidget.refresh_current_plot
-        )
+        self.PlotListWidget.refresh_current_plot()
 
     def refresh_contrasts(self) -> None:
         """ Manually update contrast, with bypass on lock
@@ -186,10 +209,7 @@ class MainViewer(QtWidgets.QMainWindow):
         This allows for individual contrast settings on different plots
 
         """
-        self.executer.submit(
-            self.PlotListWidget.refresh_current_plot,
-            True
-        )
+        self.PlotListWidget.refresh_current_plot(True)
 
     def load_cohort(self) -> None:
         """ Callback for loading points into amp
@@ -205,20 +225,65 @@ class MainViewer(QtWidgets.QMainWindow):
     def replace_cohort(self, folderpath: str) -> None:
         """ Clears out any existing loaded cohort information in the viewer and any loaded plugins
         and replaces it with that of the new cohort
+
+        The cohort is scanned in the background; loaded plugins are refreshed once it finishes.
         """
         if self.CohortTreeWidget.head is not None:
+            # a replaced scan shouldn't report back
+            if self.CohortTreeWidget.scanner is not None:
+                self.CohortTreeWidget.scanner.finished.disconnect(self.on_scan_finished)
+                self.CohortTreeWidget.scanner.cancelled.disconnect(self.on_scan_cancelled)
+            self.CohortTreeWidget.cancel_scan()
             self.CohortTreeWidget.clear()
             for i in range(self.PlotListWidget.count()):
                 self.PlotListWidget.delete_item(i)
             self.PlotListWidget.clear()
 
-        self.CohortTreeWidget.load_cohort(folderpath)
+        scanner = self.CohortTreeWidget.load_cohort_async(folderpath, lazy=True)
+
+        # busy indicator until the total is known
+        self.scanProgressBar.setRange(0, 0)
+        self.scanProgressBar.show()
+        self.cancelScanButton.show()
+        self.statusbar.showMessage(f'Scanning {os.path.basename(folderpath)}...')
+
+        scanner.progress.connect(self.on_scan_progress)
+        scanner.finished.connect(self.on_scan_finished)
+        scanner.cancelled.connect(self.on_scan_cancelled)
+
+    def on_scan_progress(self, n_probed: int, n_total: int) -> None:
+        """ Callback for cohort scan progress
+
+        Args:
+            n_probed: number of tifs probed so far (given via signal)
+            n_total: total number of tifs to probe (given via signal)
+        """
+        self.scanProgressBar.setRange(0, n_total)
+        self.scanProgressBar.setValue(n_probed)
+
+    def on_scan_finished(self) -> None:
+        """ Callback for cohort scan completion
+
+        Plugins are only refreshed once the whole cohort is in the tree.
+        """
+        self.scanProgressBar.hide()
+        self.cancelScanButton.hide()
+        self.statusbar.showMessage('Cohort loaded', 5000)
 
         # refresh plugins
         for ui_path in self.plugins:
             self.plugins[ui_path].close()
             self.plugins[ui_path] = load_plugin(ui_path, self)
 
+    def on_scan_cancelled(self) -> None:
+        """ Callback for cohort scan cancellation
+
+        Plugins aren't refreshed, since the tree only holds part of the cohort.
+        """
+        self.scanProgressBar.hide()
+        self.cancelScanButton.hide()
+        self.statusbar.showMessage('Cohort scan cancelled', 5000)
+
     def on_file_toggle(self, item: CohortTreeWidgetItem, column: int) -> None:
         """ Callback for toggling image plot of tiff file
 
@@ -337,7 +402,7 @@ class MainViewer(QtWidgets.QMainWindow):
 
         # show new figure window
         self.breakout_windows[selected_path].show()
-        current_selected.refresh(self._check_contrast())
+        current_selected.refresh(self._check_contrast(), self.render_scheduler)
 
         # change current selection
         if current_nonhidden <= 1:
@@ -1,4 +1,5 @@
 from os import path
+import threading
 
 from PyQt5 import QtGui, QtWidgets
 
@@ -8,67 +9,334 @@ from matplotlib.backends.backend_qt5agg import (
 
 import numpy as np
 
+from amp.image_stats import ImageStats, image_stats
+
 from matplotlib.figure import Figure
 import matplotlib.cm as cm
 
 from matplotlib.image import AxesImage
 
-from typing import Callable, Dict, Any, List, Union
+from typing import Callable, Dict, Any, List, Tuple, Union
+
+# smallest image pyramid level (longest side, in pixels)
+_PYRAMID_MIN_SIZE = 256
+
+# pyramid pixels drawn around the view, so resampling at the view's edges isn't cut short
+_TILE_MARGIN = 2
 
 class Plot(object):
     # base class for plot objects
     # plot objects store a plot_update function, and associated plot_data
-    def __init__(self, plot_update: Callable[[FigureCanvas, Dict[str, Any]], None],
-                 plot_data: Dict[str, Any]) -> None:
+    # plot_prepare (optional) does the plot's pixel prep off the GUI thread, given the plot_data and
+    # a snapshot of the canvas' view (see canvas_view).  it mustn't modify plot_data; its result is
+    # passed on to plot_update, which draws it on the GUI thread (see RenderScheduler)
+    def __init__(self, plot_update: Callable[[FigureCanvas, Dict[str, Any], Any], None],
+                 plot_data: Dict[str, Any],
+                 plot_prepare: Union[Callable[[Dict[str, Any], Tuple], Any], None] = None) -> None:
         self.plot_update = plot_update
         self.plot_data = plot_data
+        self.plot_prepare = plot_prepare
 
 
-def image_plot_update(canvas: FigureCanvas, data: Dict[str, Any]) -> None:
-    # ImagePlot update function
-    cur_xlim = []
-    cur_ylim = []
-    if any([isinstance(c, AxesImage) for c in canvas.axes.get_children()]):
-        cur_xlim = canvas.axes.get_xlim()
-        cur_ylim = canvas.axes.get_ylim()
-        #_clean_canvas()
-    canvas.axes.clear()
-
-    # check plot data for contrast info
+def _halve(level: Any) -> Any:
+    # 2x2 block means of a pyramid level (odd edges are repeated)
+    height, width = level.shape
+    if height % 2 or width % 2:
+        level = np.pad(level, ((0, height % 2), (0, width % 2)), mode='edge')
+    return level.reshape(
+        level.shape[0] // 2, 2, level.shape[1] // 2, 2
+    ).mean(axis=(1, 3), dtype=np.float32)
+
+class ImagePyramid(object):
+    """ Mip-pyramid of an image, for drawing large images at the resolution they're viewed at
+
+    Each level halves the previous one, down to `_PYRAMID_MIN_SIZE`.  Levels are built on first
+    use (usually by a RenderScheduler worker, not the GUI thread), and are shared between canvases.
+
+    Atributes:
+        image (np.ndarray):
+            full resolution image (level 0)
+        n_levels (int):
+            number of levels
+    """
+    def __init__(self, image: Any) -> None:
+        self.image = image
+        self.n_levels = 1
+        if image.ndim == 2:
+            while max(image.shape) / 2 ** self.n_levels >= _PYRAMID_MIN_SIZE:
+                self.n_levels += 1
+
+        self._levels = [image]
+        self._lock = threading.Lock()
+
+    def level_for(self, data_per_screen_pixel: float) -> int:
+        """ Gets the coarsest level which still has a pixel per screen pixel
+
+        Args:
+            data_per_screen_pixel (float):
+                full resolution pixels per screen pixel
+
+        Returns:
+            int:
+                pyramid level
+        """
+        if data_per_screen_pixel < 2:
+            return 0
+        return min(int(np.log2(data_per_screen_pixel)), self.n_levels - 1)
+
+    def get_level(self, level: int) -> Any:
+        """ Gets a pyramid level, building it (and any finer levels) if needed
+
+        Args:
+            level (int):
+                pyramid level.  Level n is downsampled by 2**n.
+
+        Returns:
+            np.ndarray:
+                pyramid level
+        """
+        level = min(max(level, 0), self.n_levels - 1)
+        with self._lock:
+            while len(self._levels) <= level:
+                self._levels.append(_halve(self._levels[-1]))
+            return self._levels[level]
+
+def canvas_view(canvas: FigureCanvas) -> Tuple:
+    """ Snapshots a canvas' view, so plots can be prepared for it off the GUI thread
+
+    Args:
+        canvas (FigureCanvas):
+            canvas to snapshot (on the GUI thread)
+
+    Returns:
+        tuple:
+            sorted x and y limits, and the axes' width and height in screen pixels.  The limits are
+            None if the canvas isn't showing an image, as the next image is then shown in full.
+    """
+    bbox = canvas.axes.bbox
+    if canvas.image is None or canvas.image not in canvas.axes.images:
+        return None, None, bbox.width, bbox.height
+    return (
+        tuple(sorted(canvas.axes.get_xlim())), tuple(sorted(canvas.axes.get_ylim())),
+        bbox.width, bbox.height
+    )
+
+def _view_level(pyramid: ImagePyramid, view: Tuple) -> int:
+    # pyramid level a view (see canvas_view) is drawn from
+    xlim, ylim, width, height = view
+    if xlim is None:
+        image_height, image_width = pyramid.image.shape[:2]
+        xlim = (-0.5, image_width - 0.5)
+        ylim = (-0.5, image_height - 0.5)
+    data_per_screen_pixel = min(
+        (xlim[1] - xlim[0]) / max(width, 1),
+        (ylim[1] - ylim[0]) / max(height, 1)
+    )
+    return pyramid.level_for(data_per_screen_pixel)
+
+def _update_image_view(canvas: FigureCanvas) -> None:
+    # swaps the pyramid level and tile covering the canvas' view into its image artist
+    if canvas.image is None or canvas.image not in canvas.axes.images:
+        return
+
+    view = canvas_view(canvas)
+    xlim, ylim = view[:2]
+    level = _view_level(canvas.image_pyramid, view)
+    level_data = canvas.image_pyramid.get_level(level)
+
+    # pixel i of level n covers full resolution pixels [i * 2**n, (i + 1) * 2**n)
+    scale = 2 ** level
+    height, width = level_data.shape[:2]
+    col_start = min(max(int(np.floor((xlim[0] + 0.5) / scale)) - _TILE_MARGIN, 0), width)
+    col_end = min(max(int(np.ceil((xlim[1] + 0.5) / scale)) + _TILE_MARGIN, 0), width)
+    row_start = min(max(int(np.floor((ylim[0] + 0.5) / scale)) - _TILE_MARGIN, 0), height)
+    row_end = min(max(int(np.ceil((ylim[1] + 0.5) / scale)) + _TILE_MARGIN, 0), height)
+    if col_end <= col_start or row_end <= row_start:
+        # view is off the image
+        return
+
+    tile = (level, row_start, row_end, col_start, col_end)
+    if tile == canvas.image_tile:
+        return
+    canvas.image_tile = tile
+    canvas.image.set_data(level_data[row_start:row_end, col_start:col_end])
+    canvas.image.set_extent((
+        col_start * scale - 0.5, col_end * scale - 0.5,
+        row_end * scale - 0.5, row_start * scale - 0.5
+    ))
+
+def contrast_limits(stats: ImageStats, min_cap: float, max_cap: float) -> Tuple[float, float]:
+    """ Gets the color limits an image is shown with, given contrast window caps
+
+    Args:
+        stats (ImageStats):
+            intensity statistics of the image
+        min_cap (float):
+            min cap slider value
+        max_cap (float):
+            max cap slider value, relative to the image's maximum
+
+    Returns:
+        tuple:
+            lower and upper color limits
+    """
     # contrast is relative now
-    raw_imdata = data['image'].copy()
+    min_cap = min_cap / 100
+    max_cap = max_cap * stats.max / 100
+    # same as clipping the image to the caps (cast to its dtype), then autoscaling
+    vmin, vmax = np.array([
+        min(max(v, min_cap), max_cap) for v in (stats.min, stats.max)
+    ]).astype(stats.dtype)
+    return vmin, vmax
+
+def _contrast_limits(data: Dict[str, Any], stats: ImageStats) -> Tuple[float, float]:
+    # color limits of an ImagePlot
     if 'min_cap' in data.keys() and not data['fixed_contrast']:
-        min_cap = data['min_cap'] / 100
-        max_cap = data['max_cap'] * np.max(raw_imdata) / 100
-        raw_imdata[raw_imdata < min_cap] = min_cap
-        raw_imdata[raw_imdata > max_cap] = max_cap
-
-    canvas.axes.imshow(raw_imdata, cmap=cm.afmhot)
-    if cur_xlim:
-        canvas.axes.set_xlim(cur_xlim)
-        canvas.axes.set_ylim(cur_ylim)
+        return contrast_limits(stats, data['min_cap'], data['max_cap'])
+    return stats.min, stats.max
+
+def _redraw_artist(canvas: FigureCanvas, artist: Any) -> bool:
+    # re-renders one artist over the last drawn frame (blit), rather than the whole figure
+    try:
+        canvas.axes.draw_artist(artist)
+    except AttributeError:
+        # nothing has been drawn yet
+        return False
+    canvas.update()
+    return True
+
+def image_plot_prepare(data: Dict[str, Any], view: Tuple) -> Dict[str, Any]:
+    # ImagePlot prep function (thread safe)
+    # finds the contrast limits, and builds the pyramid level the view will be drawn from
+    pyramid = data.get('pyramid')
+    if pyramid is None or pyramid.image is not data['image']:
+        pyramid = ImagePyramid(data['image'])
+    stats = data.get('stats')
+    if stats is None or not stats.describes(data['image']):
+        stats = image_stats(data['image'])
+    pyramid.get_level(_view_level(pyramid, view))
+    return {'clim': _contrast_limits(data, stats), 'pyramid': pyramid, 'stats': stats}
+
+def image_plot_update(canvas: FigureCanvas, data: Dict[str, Any],
+                      prepared: Union[Dict[str, Any], None] = None) -> None:
+    # ImagePlot update function
+    # each canvas keeps a single image artist; only the pyramid level and tile covering the view
+    # are swapped into it, along with the contrast
+    if prepared is None or prepared['pyramid'].image is not data['image']:
+        # not prepared (or the image was replaced since)
+        prepared = image_plot_prepare(data, canvas_view(canvas))
+    vmin, vmax = prepared['clim']
+    data['pyramid'] = prepared['pyramid']
+    data['stats'] = prepared['stats']
+    image: Union[AxesImage, None] = canvas.image
+
+    if image is None or image not in canvas.axes.images:
+        # first image, or another plot type cleared the axes
+        canvas.axes.clear()
+        height, width = data['image'].shape[:2]
+        canvas.image = canvas.axes.imshow(
+            np.zeros((1, 1)), cmap=cm.afmhot, vmin=vmin, vmax=vmax,
+            extent=(-0.5, width - 0.5, height - 0.5, -0.5)
+        )
+        # tiles are swapped in without moving the view
+        canvas.axes.set_autoscale_on(False)
+        canvas.axes.callbacks.connect('xlim_changed', lambda ax: _update_image_view(canvas))
+        canvas.axes.callbacks.connect('ylim_changed', lambda ax: _update_image_view(canvas))
+        canvas.image_source = data['image']
+        canvas.image_pyramid = data['pyramid']
+        canvas.image_tile = None
+        _update_image_view(canvas)
+        canvas.draw()
+        return
+
+    image.set_clim(vmin, vmax)
+    if canvas.image_source is data['image']:
+        # contrast change only
+        if not _redraw_artist(canvas, image):
+            canvas.draw()
+        return
+
+    # the current view is kept across images
+    canvas.image_source = data['image']
+    canvas.image_pyramid = data['pyramid']
+    canvas.image_tile = None
+    _update_image_view(canvas)
     canvas.draw()
 
-def hist_plot_update(canvas: FigureCanvas, data: Dict[str, Any]) -> None:
+def _is_binned(data: Dict[str, Any], binned: Union[Tuple, None]) -> bool:
+    # checks that a HistPlot's binning is of its current data and bin count
+    return (
+        binned is not None
+        and binned[0] is data['flattened_data']
+        and binned[1] == data['n_bins']
+    )
+
+def hist_plot_prepare(data: Dict[str, Any], view: Tuple) -> Dict[str, Any]:
+    # HistPlot prep function (thread safe)
+    # bins the data, unless it's already been binned
+    binned = data.get('binned')
+    if not _is_binned(data, binned):
+        counts, bin_edges = np.histogram(data['flattened_data'], bins=data['n_bins'])
+        binned = (data['flattened_data'], data['n_bins'], counts, bin_edges)
+    return {'binned': binned}
+
+def hist_plot_update(canvas: FigureCanvas, data: Dict[str, Any],
+                     prepared: Union[Dict[str, Any], None] = None) -> None:
     # HistPlot update function
-    canvas.axes.clear()
-    canvas.axes.set_aspect('auto')
-    canvas.axes.hist(data['flattened_data'], bins=data['n_bins'])
-    if data['threshold'] is not None:
-        canvas.axes.axvline(data['threshold'], color='r', linestyle='dashed', linewidth=2)
+    # each canvas keeps its histogram's bars; threshold changes only move the threshold line
+    if prepared is None or not _is_binned(data, prepared['binned']):
+        # not prepared (or the data was replaced since)
+        prepared = hist_plot_prepare(data, None)
+    data['binned'] = prepared['binned']
+    _, _, counts, bin_edges = data['binned']
+
+    bars = canvas.hist_bars
+    if bars is None or canvas.hist_counts is not counts or bars.patches[0] not in canvas.axes.patches:
+        # new histogram, or another plot type cleared the axes
+        canvas.axes.clear()
+        canvas.axes.set_aspect('auto')
+        # each bin's left edge, weighted by its count, rebuilds the binned histogram
+        _, _, canvas.hist_bars = canvas.axes.hist(bin_edges[:-1], bins=bin_edges, weights=counts)
+        canvas.hist_counts = counts
+        canvas.hist_line = None
+
+    if data['threshold'] is None:
+        if canvas.hist_line is not None:
+            canvas.hist_line.remove()
+            canvas.hist_line = None
+    elif canvas.hist_line is None:
+        canvas.hist_line = canvas.axes.axvline(
+            data['threshold'], color='r', linestyle='dashed', linewidth=2
+        )
+    else:
+        canvas.hist_line.set_xdata([data['threshold'], data['threshold']])
+    # the view spans the bars and threshold line (which may lie outside the bins)
     canvas.axes.relim()
+    canvas.axes.autoscale_view()
     canvas.draw()
 
 class ImagePlot(Plot):
     # plots images via imshow
     def __init__(self, data: Any, fixed_contrast: bool = False) -> None:
-        super().__init__(image_plot_update, {'image': data, 'fixed_contrast': fixed_contrast})
+        super().__init__(image_plot_update, {
+            'image': data,
+            'fixed_contrast': fixed_contrast,
+            'pyramid': ImagePyramid(data),
+            # intensity statistics, computed on first draw
+            'stats': None,
+        }, image_plot_prepare)
 
 
 class HistPlot(Plot):
     # plots histograms via hist
     def __init__(self, data: Any, n_bins: int = 30, thresh: Union[float, None] = None) -> None:
-        super().__init__(hist_plot_update, {'flattened_data': data, 'n_bins': n_bins, 'threshold': thresh})
+        super().__init__(hist_plot_update, {
+            'flattened_data': data,
+            'n_bins': n_bins,
+            'threshold': thresh,
+            # data, bin count, counts and bin edges, binned on first draw
+            'binned': None,
+        }, hist_plot_prepare)
 
 # a more customizable toolbar (loadable icons)
 class CleanToolbar(NavigationToolbar):
@@ -114,6 +382,17 @@ class MplWidget(QtWidgets.QWidget):
         vertical_layout.addWidget(self._canvas)
 
         self._canvas.axes = self._canvas.figure.add_subplot(111)
+        # persistent image artist, the image data and pyramid it shows, and the pyramid level and
+        # tile currently drawn (see image_plot_update)
+        self._canvas.image = None
+        self._canvas.image_source = None
+        self._canvas.image_pyramid = None
+        self._canvas.image_tile = None
+        # histogram bars, the counts they show, and the threshold line (see hist_plot_update)
+        self._canvas.hist_bars = None
+        self._canvas.hist_counts = None
+        self._canvas.hist_line = None
+        self._canvas.mpl_connect('resize_event', lambda event: _update_image_view(self._canvas))
         self._canvas.axes.set_facecolor((0, 0, 0))
         self._canvas.figure.set_facecolor((0, 0, 0))
         self._canvas.axes.set_frame_on(False)
@@ -2,6 +2,7 @@ from PyQt5 import QtWidgets, QtCore
 
 from matplotlib.backends.backend_qt5agg import FigureCanvas
 from amp.mplwidget import Plot
+from amp.render_scheduler import RenderScheduler
 
 import sip
 
@@ -20,11 +21,15 @@ class PlotListWidgetItem(QtWidgets.QListWidgetItem):
         self.delete_callback = delete_callback
         self.canvas = canvas
 
-    def refresh(self, contrast_settings: Union[Tuple, None] = None):
+    def refresh(self, contrast_settings: Union[Tuple, None] = None,
+                render_scheduler: Union[RenderScheduler, None] = None):
         if contrast_settings is not None:
             self.plot.plot_data['min_cap'] = contrast_settings[0]
             self.plot.plot_data['max_cap'] = contrast_settings[1]
-        self.plot.plot_update(self.canvas, self.plot.plot_data)
+        if render_scheduler is not None:
+            render_scheduler.request(self.canvas, self.plot)
+        else:
+            self.plot.plot_update(self.canvas, self.plot.plot_data)
 
 
 class PlotListWidget(QtWidgets.QListWidget):
@@ -33,10 +38,14 @@ class PlotListWidget(QtWidgets.QListWidget):
         self.path_to_name: Dict[str, str] = {}
         self.canvas = None
         self.check_breakout_callback = None
+        self.render_scheduler = None
 
     def set_canvas(self, default_canvas: FigureCanvas) -> None:
         self.canvas = default_canvas
 
+    def set_render_scheduler(self, render_scheduler: RenderScheduler) -> None:
+        self.render_scheduler = render_scheduler
+
     def set_breakout_callback(self, callback: Callable[[str], None]) -> None:
         self.check_breakout_callback = callback
 
@@ -92,8 +101,9 @@ class PlotListWidget(QtWidgets.QListWidget):
     def refresh_current_plot(self, bypass_contrast_lock=False) -> None:
         contrast_settings = self.contrast_callback(bypass_contrast_lock)
 
-        self.currentItem().refresh(contrast_settings)
+        if self.currentItem() is not None:
+            self.currentItem().refresh(contrast_settings, self.render_scheduler)
 
         for i in range(self.count()):
             if self.item(i).canvas != self.canvas:
-                self.item(i).refresh(contrast_settings)
+                self.item(i).refresh(contrast_settings, self.render_scheduler)
@@ -7,6 +7,9 @@ import pathlib
 from typing import List, Union, Dict, Any
 from numbers import Number
 
+import amp.tiff_utils as tiff_utils
+from amp.image_cache import image_cache
+
 
 class Point:
     """Class containing relevent information and methods for a managing points within AMP plugins
@@ -89,6 +92,25 @@ class Point:
         data_out: Dict[str, Any] = {}
         for chan_name, chan_path in zip(chans, chans_filtered):
             full_path = os.path.join(self.tif_path, chan_path)
-            data_out[chan_name] = np.asarray(Image.open(full_path))
+            data_out[chan_name] = image_cache.get(
+                full_path,
+                lambda full_path=full_path: _read_channel(full_path)
+            )
 
         return data_out
+
+
+def _read_channel(path: str) -> Any:
+    """ Reads a channel tif, memory mapping it if it's uncompressed
+
+    Args:
+        path (str): path to channel tif
+
+    Returns:
+        np.ndarray:
+            channel data
+    """
+    data = tiff_utils.memmap_tif(path)
+    if data is None:
+        data = np.asarray(Image.open(path))
+    return data
@@ -0,0 +1,125 @@
+import concurrent.futures
+import traceback
+
+import numpy as np
+
+from PyQt5 import QtCore
+
+from typing import Any, Callable, Tuple
+
+# downsampled previews for interactive plugin parameter tuning
+
+# longest side of downsampled previews
+PREVIEW_SIZE = 512
+
+# milliseconds without adjustment before full resolution previews are computed
+IDLE_MS = 300
+
+
+def preview_factor(shape: Tuple[int, ...], max_size: int = PREVIEW_SIZE) -> int:
+    """ Gets the stride which brings an image's longest side down to the preview size
+
+    Args:
+        shape (tuple):
+            image shape
+        max_size (int):
+            longest side of the preview
+
+    Returns:
+        int:
+            preview stride (1 if the image is already small enough)
+    """
+    return max(1, int(np.ceil(max(shape[:2]) / max_size)))
+
+
+def downsample(data: Any, factor: int) -> Any:
+    """ Strides an image for previewing
+
+    Args:
+        data (np.array):
+            image data
+        factor (int):
+            stride along each axis
+
+    Returns:
+        np.array:
+            strided view of the image
+    """
+    return data[::factor, ::factor]
+
+
+class PreviewRunner(QtCore.QObject):
+    """ Computes full resolution previews on a background thread once adjustment stops
+
+    Only the latest scheduled computation's result is delivered; scheduling or cancelling drops
+    pending and running computations.
+
+    Atributes:
+        result_ready (QtCore.pyqtSignal(object, object)):
+            tag and result of the latest computation
+    """
+    result_ready = QtCore.pyqtSignal(object, object)
+
+    # cross-thread relay (queued onto the runner's thread)
+    _done = QtCore.pyqtSignal(int, object, object)
+
+    def __init__(self, idle_ms: int = IDLE_MS, parent: QtCore.QObject = None) -> None:
+        super().__init__(parent)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._generation = 0
+        self._pending = None
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(idle_ms)
+        self._timer.timeout.connect(self._submit_pending)
+
+        self._done.connect(self._on_done)
+
+    def schedule(self, func: Callable[..., Any], tag: Any, *args: Any) -> None:
+        """ Runs a computation in the background, once no other is scheduled for `idle_ms`
+
+        Args:
+            func (Callable):
+                thread safe computation
+            tag (Any):
+                passed along with the result, e.g to identify what was computed
+            *args (Any):
+                arguments of the computation
+        """
+        self.cancel()
+        self._pending = (func, tag, args)
+        self._timer.start()
+
+    def cancel(self) -> None:
+        """ Drops pending and running computations
+        """
+        self._generation += 1
+        self._pending = None
+        self._timer.stop()
+
+    def _submit_pending(self) -> None:
+        if self._pending is None:
+            return
+        func, tag, args = self._pending
+        self._pending = None
+        self._executor.submit(self._run, self._generation, func, tag, args)
+
+    def _run(self, generation: int, func: Callable[..., Any], tag: Any, args: Tuple) -> None:
+        """ Computation routine (runs on a background thread)
+        """
+        if generation != self._generation:
+            return
+        try:
+            result = func(*args)
+        except Exception:
+            print('Could not compute full resolution preview')
+            traceback.print_exc()
+            return
+        self._done.emit(generation, tag, result)
+
+    @QtCore.pyqtSlot(int, object, object)
+    def _on_done(self, generation: int, tag: Any, result: Any) -> None:
+        if generation != self._generation:
+            return
+        self.result_ready.emit(tag, result)
@@ -0,0 +1,117 @@
+import concurrent.futures
+import threading
+import traceback
+
+from PyQt5 import QtCore
+
+from matplotlib.backends.backend_qt5agg import FigureCanvas
+
+from amp.mplwidget import Plot, canvas_view
+
+import sip
+
+from typing import Any, Dict, Set, Tuple
+
+# renders plots onto canvases without blocking (or backing up) the GUI thread
+
+
+class RenderScheduler(QtCore.QObject):
+    """ Renders plots onto canvases, preparing their pixels on worker threads
+
+    Requests are coalesced per canvas: a request replaces any pending request for its canvas, and
+    only a canvas' latest request is drawn.  Plots are prepared (see `Plot.plot_prepare`) on a
+    worker, then drawn by their `plot_update` on the GUI thread, so rapidly switching plots only
+    draws the last one.
+
+    Args:
+        max_workers (int):
+            number of worker threads.  Each canvas is prepared by one worker at a time.
+        parent (QtCore.QObject):
+            Qt parent
+
+    Atributes:
+        drawn (QtCore.pyqtSignal(object, object)):
+            canvas and plot of each finished draw
+    """
+    drawn = QtCore.pyqtSignal(object, object)
+
+    # cross-thread relay (queued onto the GUI thread)
+    _prepared = QtCore.pyqtSignal(object, int, object, object)
+
+    def __init__(self, max_workers: int = 2, parent: QtCore.QObject = None) -> None:
+        super().__init__(parent)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._serial = 0
+
+        # serial of each canvas' latest request (GUI thread only)
+        self._latest: Dict[FigureCanvas, int] = {}
+
+        # requests waiting for a worker, and canvases being prepared, shared with workers
+        self._lock = threading.Lock()
+        self._pending: Dict[FigureCanvas, Tuple[int, Plot, Tuple]] = {}
+        self._preparing: Set[FigureCanvas] = set()
+
+        self._prepared.connect(self._on_prepared)
+
+    def request(self, canvas: FigureCanvas, plot: Plot) -> None:
+        """ Schedules drawing a plot onto a canvas, replacing any pending request for the canvas
+
+        Args:
+            canvas (FigureCanvas):
+                canvas to draw onto
+            plot (Plot):
+                plot to draw.  Its plot_data is read when it's prepared, not when it's requested.
+        """
+        if canvas is None:
+            return
+
+        self._serial += 1
+        self._latest[canvas] = self._serial
+        with self._lock:
+            self._pending[canvas] = (self._serial, plot, canvas_view(canvas))
+            if canvas in self._preparing:
+                # picked up by the canvas' worker once it's done
+                return
+            self._preparing.add(canvas)
+        self._executor.submit(self._prepare, canvas)
+
+    def _prepare(self, canvas: FigureCanvas) -> None:
+        """ Preparation routine (runs on a worker thread)
+        """
+        while True:
+            with self._lock:
+                if canvas not in self._pending:
+                    self._preparing.discard(canvas)
+                    return
+                serial, plot, view = self._pending.pop(canvas)
+
+            try:
+                prepared = None
+                if plot.plot_prepare is not None:
+                    prepared = plot.plot_prepare(plot.plot_data, view)
+            except Exception:
+                print('Could not prepare plot')
+                traceback.print_exc()
+                continue
+
+            with self._lock:
+                superseded = canvas in self._pending
+            if not superseded:
+                self._prepared.emit(canvas, serial, plot, prepared)
+
+    @QtCore.pyqtSlot(object, int, object, object)
+    def _on_prepared(self, canvas: FigureCanvas, serial: int, plot: Plot, prepared: Any) -> None:
+        if self._latest.get(canvas) != serial:
+            return
+        del self._latest[canvas]
+
+        if sip.isdeleted(canvas):
+            # e.g breakout window closed while preparing
+            return
+        try:
+            plot.plot_update(canvas, plot.plot_data, prepared)
+        except Exception:
+            print('Could not draw plot')
+            traceback.print_exc()
+            return
+        self.drawn.emit(canvas, plot)
@@ -1,12 +1,28 @@
 from fractions import Fraction
 import numpy as np
-from tifffile import TiffFile, TiffWriter
+from tifffile import TiffFile, TiffPage, TiffWriter, TIFF
 import json
 import datetime
+import os
+import concurrent.futures
+import functools
+import lzma
+import shutil
+import struct
+import tempfile
+import zlib
 from itertools import compress
 
 import sys
 
+from typing import Callable, Dict, Tuple, Any, List, Union
+
+# per-file page index cache, maps absolute path -> (size, mtime, index)
+_PAGE_INDEX_CACHE: Dict[str, Tuple[int, int, Dict[str, Any]]] = {}
+
+# classic TIFF offsets are 32 bit, larger files are written as BigTIFF by tifffile
+_CLASSIC_TIFF_LIMIT = 2 ** 32
+
 
 def read_mibitiff(file, channels=None, get_metadata=False):
     """ Reads MIBI data from an IonpathMIBI TIFF file.
@@ -21,6 +37,10 @@ def read_mibitiff(file, channels=None, get_metadata=False):
         - channel data
         - metadata (optional)
     """
+    # single channel lookups can skip straight to the indexed pages
+    if channels is not None and isinstance(file, str):
+        return _read_mibitiff_pages(file, channels, get_metadata)
+
     return_channels = []
     img_data = []
     metadata = {}
@@ -68,6 +88,179 @@ def read_mibitiff(file, channels=None, get_metadata=False):
         return np.stack(img_data, axis=2), return_channels
 
 
+def _read_mibitiff_pages(path: str, channels: List[Union[str, int]], get_metadata: bool):
+    """ Reads the requested channels of a MIBItiff via its page index
+
+    Only the pages holding the requested channels are parsed and decoded.
+
+    Args:
+        path (str): The string path to a MIBItiff file.
+        channels (list): Targets (or masses) to load
+        get_metadata (bool): Return global image metadata
+
+    Returns:
+        tuple (np.ndarray, list[tuple], dict):
+        - image data
+        - channel data
+        - metadata (optional)
+    """
+    index = get_page_index(path)
+
+    page_numbers = sorted({
+        index['targets'].get(channel, index['masses'].get(channel))
+        for channel in channels
+    } - {None})
+
+    if not page_numbers:
+        raise IndexError('Passed unknown channels...')
+
+    img_data = []
+    with TiffFile(path) as tif:
+        for page_number in page_numbers:
+            # jump directly to the page's IFD instead of walking the page chain
+            tif.filehandle.seek(index['offsets'][page_number])
+            img_data.append(TiffPage(tif, index=page_number).asarray())
+
+    return_channels = [tuple(index['channels'][page_number]) for page_number in page_numbers]
+
+    if get_metadata:
+        metadata = index['metadata'].copy()
+        metadata['channel.mass'], metadata['channel.target'] = return_channels[0]
+        return np.stack(img_data, axis=2), return_channels, metadata
+    else:
+        return np.stack(img_data, axis=2), return_channels
+
+
+def get_page_index(path: str) -> Dict[str, Any]:
+    """ Gets the channel to page index of a MIBItiff
+
+    Page tags are only parsed the first time a file is indexed.  The index is cached per file
+    and rebuilt whenever the file's size or modification time changes.
+
+    Args:
+        path (str): The string path to a MIBItiff file
+
+    Raises:
+        ValueError
+
+    Returns:
+        dict:
+        - 'channels': (mass, target) for each page, in page order
+        - 'offsets': IFD offset of each page
+        - 'targets': map from target name to page number
+        - 'masses': map from channel mass to page number
+        - 'metadata': image description of the first page
+    """
+    key = os.path.abspath(path)
+    stat = os.stat(key)
+
+    cached = _PAGE_INDEX_CACHE.get(key)
+    if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+        return cached[2]
+
+    with TiffFile(key) as tif:
+        index = index_pages(tif)
+    _PAGE_INDEX_CACHE[key] = (stat.st_size, stat.st_mtime_ns, index)
+
+    return index
+
+
+def index_pages(tif: TiffFile) -> Dict[str, Any]:
+    """ Builds the channel to page index of an opened MIBItiff (uncached)
+
+    Args:
+        tif (TiffFile): opened tiff file
+
+    Raises:
+        ValueError
+
+    Returns:
+        dict:
+            page index, formatted as in `get_page_index`
+    """
+    # make sure it's a mibitiff
+    _check_version(tif)
+
+    channels = []
+    offsets = []
+    metadata = {}
+    for page in tif.pages:
+        description = json.loads(
+            page.tags['ImageDescription'].value
+        )
+        channels.append((description['channel.mass'], description['channel.target']))
+        offsets.append(page.offset)
+
+        if not metadata:
+            metadata = description
+
+    return _build_page_index(channels, offsets, metadata)
+
+
+def seed_page_index(path: str, size: int, mtime: int, channels: List[Tuple[int, str]],
+                    offsets: List[int], metadata: Dict[str, Any]) -> None:
+    """ Stores a previously built page index (e.g from a cohort manifest) in the index cache
+
+    Args:
+        path (str): The string path to a MIBItiff file
+        size (int): file size the index was built for
+        mtime (int): file modification time (ns) the index was built for
+        channels (list): (mass, target) for each page
+        offsets (list): IFD offset of each page
+        metadata (dict): image description of the first page
+    """
+    _PAGE_INDEX_CACHE[os.path.abspath(path)] = (
+        size, mtime, _build_page_index(channels, offsets, metadata)
+    )
+
+
+def _build_page_index(channels: List[Tuple[int, str]], offsets: List[int],
+                      metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """ Assembles page index lookups from per page channel info
+
+    Args:
+        channels (list): (mass, target) for each page
+        offsets (list): IFD offset of each page
+        metadata (dict): image description of the first page
+
+    Returns:
+        dict:
+            page index, formatted as in `get_page_index`
+    """
+    return {
+        'channels': [tuple(channel) for channel in channels],
+        'offsets': list(offsets),
+        'targets': {target: page for page, (_, target) in enumerate(channels)},
+        'masses': {mass: page for page, (mass, _) in enumerate(channels)},
+        'metadata': metadata,
+    }
+
+
+def memmap_tif(path: str) -> Union[np.memmap, None]:
+    """ Memory maps the image data of an uncompressed, single page tif
+
+    Args:
+        path (str): The string path to a tiff file
+
+    Returns:
+        np.memmap | None:
+            read-only mapping of the image data, or None if the file can't be mapped (e.g it's
+            compressed, tiled, or has several pages)
+    """
+    try:
+        with TiffFile(path) as tif:
+            if len(tif.pages) != 1 or not tif.pages[0].is_memmappable:
+                return None
+            page = tif.pages[0]
+            offset = page.is_contiguous[0]
+            dtype = page.dtype.newbyteorder(tif.byteorder)
+            shape = page.shape
+
+        return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+    except Exception:
+        return None
+
+
 def is_mibitiff(path: str) -> bool:
     """ Checks that file is MIBItiff, but raises no error
 
@@ -78,6 +271,9 @@ def is_mibitiff(path: str) -> bool:
         bool:
             is the file a mibitiff?
     """
+    if isinstance(path, str) and _has_cached_index(path):
+        return True
+
     try:
         with TiffFile(path) as tif:
             _check_version(tif)
@@ -86,22 +282,409 @@ def is_mibitiff(path: str) -> bool:
         return False
 
 
-def overwrite_mibitiff_channel(file, channel, data):
+def _has_cached_index(path: str) -> bool:
+    """ Checks for an up to date page index for the given file
+
+    Args:
+        path (str): The string path to a tiff file
+
+    Returns:
+        bool:
+            is there a valid cached page index?
+    """
+    key = os.path.abspath(path)
+    cached = _PAGE_INDEX_CACHE.get(key)
+    if cached is None:
+        return False
+    try:
+        stat = os.stat(key)
+    except OSError:
+        return False
+    return cached[:2] == (stat.st_size, stat.st_mtime_ns)
+
+
+def overwrite_mibitiff_channel(file, channel, data, compress=6):
     """ Overwrites data within a mibitiff channel with the provided data
 
     Args:
         file (str): The string path or an open file object pointing to a MIBItiff file.
         channel (str): The target channel to overwrite
         data (ndarray): The image data
+        compress (int | str | tuple): Compression of the overwritten page, as for `write_mibitiff`
     """
+    overwrite_mibitiff_channels(file, {channel: data}, compress=compress)
+
+
+def overwrite_mibitiff_channels(file, channel_data, compress=6, max_workers=None):
+    """ Overwrites data within several mibitiff channels, rewriting the file once
+
+    Pages of untouched channels are copied verbatim, without decoding or re-compressing them.
+    Overwritten pages keep their tags, except for strip layout, compression and sample range.
+
+    Args:
+        file (str): The string path or an open file object pointing to a MIBItiff file.
+        channel_data (dict): Maps target channels (or masses) to new image data
+        compress (int | str | tuple): Compression of overwritten pages, as for `write_mibitiff`
+        max_workers (int | None): Number of threads used to encode pages
+    """
+    if not isinstance(file, str):
+        _overwrite_mibitiff_channels_decoded(file, channel_data, compress, max_workers)
+        return
+
+    compression, encoder = _get_encoder(compress)
+
+    index = get_page_index(file)
+    new_pages = {}
+    for channel, data in channel_data.items():
+        page_number = index['targets'].get(channel, index['masses'].get(channel))
+        if page_number is None:
+            raise IndexError('Passed unknown channels...')
+        new_pages[page_number] = data
+
+    byteorder, pages = _read_raw_pages(file, index['offsets'])
+    if pages is not None:
+        kept_bytes = sum(
+            len(strip) for page_number, (_, strips) in enumerate(pages)
+            if page_number not in new_pages for strip in strips
+        )
+        new_bytes = sum(np.asarray(data).nbytes for data in new_pages.values())
+        if kept_bytes + _estimate_tiff_size(new_bytes, len(pages)) >= _CLASSIC_TIFF_LIMIT:
+            pages = None
+    if pages is None:
+        # BigTIFF, tiled and over-sized layouts aren't handled by the raw page writer
+        _overwrite_mibitiff_channels_decoded(file, channel_data, compress, max_workers)
+        return
+
+    # write next to the original, so the file is never left half written
+    _PAGE_INDEX_CACHE.pop(os.path.abspath(file), None)
+    tmp_fd, tmp_path = tempfile.mkstemp(
+        suffix='.partial', dir=os.path.dirname(os.path.abspath(file))
+    )
+    try:
+        with os.fdopen(tmp_fd, 'wb') as fh, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # overwritten pages are encoded concurrently
+            encoded_pages = {
+                page_number: executor.submit(
+                    _replace_page_data, pages[page_number][0], data, byteorder, compression,
+                    encoder
+                )
+                for page_number, data in new_pages.items()
+            }
+            offsets = _write_tiff_pages(
+                fh,
+                (
+                    encoded_pages[page_number].result() if page_number in encoded_pages else page
+                    for page_number, page in enumerate(pages)
+                ),
+                byteorder
+            )
+        shutil.copymode(file, tmp_path)
+        os.replace(tmp_path, file)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    stat = os.stat(file)
+    seed_page_index(file, stat.st_size, stat.st_mtime_ns, index['channels'], offsets,
+                    index['metadata'])
+
+
+def _read_raw_pages(path: str, offsets: List[int]) -> Tuple[str, Union[List[Any], None]]:
+    """ Reads the raw tags and encoded strips of each page
 
+    Args:
+        path (str): The string path to a tiff file
+        offsets (list): IFD offset of each page
+
+    Returns:
+        tuple (str, list | None):
+        - struct byte order of the file
+        - raw tag entries and encoded strips of each page, or None for unsupported layouts
+    """
+    with open(path, 'rb') as fh:
+        byteorder = {b'II': '<', b'MM': '>'}[fh.read(2)]
+        if struct.unpack(byteorder + 'H', fh.read(2))[0] != 42:
+            return byteorder, None
+
+        pages = []
+        for offset in offsets:
+            entries = _read_ifd(fh, offset, byteorder)
+            if 273 not in entries:
+                return byteorder, None
+
+            strips = []
+            for strip_offset, strip_byte_count in zip(_unpack_entry(entries[273], byteorder),
+                                                      _unpack_entry(entries[279], byteorder)):
+                fh.seek(strip_offset)
+                strips.append(fh.read(strip_byte_count))
+            pages.append((entries, strips))
+
+    return byteorder, pages
+
+
+def _overwrite_mibitiff_channels_decoded(file, channel_data, compress=6, max_workers=None):
+    """ Overwrites mibitiff channels by decoding and re-writing every page
+
+    Args:
+        file (str): The string path or an open file object pointing to a MIBItiff file.
+        channel_data (dict): Maps target channels to new image data
+        compress (int | str | tuple): Page compression, as for `write_mibitiff`
+        max_workers (int | None): Number of threads used to encode pages
+    """
     img_data, file_channels, metadata = read_mibitiff(file, get_metadata=True)
 
-    # overwrite channel with new data
-    img_data[:, :, [file_channel[1] for file_channel in file_channels].index(channel)] = data
+    # overwrite channels with new data
+    targets = [file_channel[1] for file_channel in file_channels]
+    for channel, data in channel_data.items():
+        img_data[:, :, targets.index(channel)] = data
 
     # write tiff out
-    write_mibitiff(file, img_data, file_channels, metadata, prefixed=True)
+    write_mibitiff(file, img_data, file_channels, metadata, prefixed=True, compress=compress,
+                   max_workers=max_workers)
+
+
+# byte size and struct format of each TIFF field type
+_TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+_TIFF_TYPE_FORMATS = {1: 'B', 2: 's', 3: 'H', 4: 'I', 5: 'I', 6: 'b', 7: 'B', 8: 'h', 9: 'i',
+                      10: 'i', 11: 'f', 12: 'd', 13: 'I'}
+
+# TIFF sample formats, keyed by numpy dtype kind
+_SAMPLE_FORMATS = {'u': 1, 'i': 2, 'f': 3}
+
+
+def _read_ifd(fh, offset: int, byteorder: str) -> Dict[int, Tuple[int, int, bytes]]:
+    """ Reads the raw tag entries of a classic TIFF IFD
+
+    Args:
+        fh (file): opened tiff file
+        offset (int): IFD offset
+        byteorder (str): struct byte order of the file
+
+    Returns:
+        dict:
+            (field type, count, packed value) of each tag, keyed by tag code
+    """
+    fh.seek(offset)
+    n_entries = struct.unpack(byteorder + 'H', fh.read(2))[0]
+    raw_entries = fh.read(12 * n_entries)
+
+    entries = {}
+    for i in range(n_entries):
+        code, field_type, count, value = struct.unpack(
+            byteorder + 'HHI4s', raw_entries[12 * i:12 * (i + 1)]
+        )
+        size = count * _TIFF_TYPE_SIZES[field_type]
+        if size > 4:
+            fh.seek(struct.unpack(byteorder + 'I', value)[0])
+            value = fh.read(size)
+        entries[code] = (field_type, count, value[:size])
+
+    return entries
+
+
+def _pack_entry(field_type: int, values: Union[List[Any], bytes], byteorder: str
+                ) -> Tuple[int, int, bytes]:
+    """ Packs tag values into a raw tag entry
+
+    Args:
+        field_type (int): TIFF field type
+        values (list | bytes): tag values, or encoded string for ASCII tags
+        byteorder (str): struct byte order of the file
+
+    Returns:
+        tuple (int, int, bytes):
+            field type, count and packed value
+    """
+    if field_type == 2:
+        value = values + b'\0'
+        return field_type, len(value), value
+
+    count = len(values) // 2 if field_type in (5, 10) else len(values)
+    fmt = f'{byteorder}{len(values)}{_TIFF_TYPE_FORMATS[field_type]}'
+    return field_type, count, struct.pack(fmt, *values)
+
+
+def _unpack_entry(entry: Tuple[int, int, bytes], byteorder: str) -> Tuple[Any, ...]:
+    """ Unpacks the values of a raw tag entry
+
+    Args:
+        entry (tuple): field type, count and packed value
+        byteorder (str): struct byte order of the file
+
+    Returns:
+        tuple:
+            tag values (rationals are flattened to numerator, denominator pairs)
+    """
+    field_type, count, value = entry
+    if field_type == 2:
+        return (value,)
+    n_values = 2 * count if field_type in (5, 10) else count
+    return struct.unpack(f'{byteorder}{n_values}{_TIFF_TYPE_FORMATS[field_type]}', value)
+
+
+def _page_dtype(entries: Dict[int, Tuple[int, int, bytes]], byteorder: str) -> np.dtype:
+    """ Gets the sample dtype of a page from its raw tag entries
+
+    Args:
+        entries (dict): raw tag entries of the page
+        byteorder (str): struct byte order of the file
+
+    Returns:
+        np.dtype:
+            sample dtype, in file byte order
+    """
+    bits = _unpack_entry(entries[258], byteorder)[0]
+    sample_format = _unpack_entry(entries[339], byteorder)[0] if 339 in entries else 1
+    kind = {value: key for key, value in _SAMPLE_FORMATS.items()}[sample_format]
+    return np.dtype(f'{byteorder}{kind}{bits // 8}')
+
+
+def _encode_strips(data: Any, encoder: Union[Callable[[Any], bytes], None]
+                   ) -> Tuple[int, List[bytes]]:
+    """ Splits a 2D image into encoded strips, laid out like tifffile's
+
+    Args:
+        data (np.ndarray): image data, in file byte order
+        encoder (Callable | None): strip encoder, as given by `_get_encoder`
+
+    Returns:
+        tuple (int, list):
+        - rows per strip
+        - encoded strips
+    """
+    if encoder is None:
+        return data.shape[0], [np.ascontiguousarray(data).tobytes()]
+
+    rows_per_strip = min(data.shape[0], max(1, 65536 // (data.shape[1] * data.dtype.itemsize)))
+    strips = [
+        bytes(encoder(np.ascontiguousarray(data[row:row + rows_per_strip])))
+        for row in range(0, data.shape[0], rows_per_strip)
+    ]
+    return rows_per_strip, strips
+
+
+def _replace_page_data(entries: Dict[int, Tuple[int, int, bytes]], data: Any, byteorder: str,
+                       compression: int, encoder: Union[Callable[[Any], bytes], None]
+                       ) -> Tuple[Dict[int, Tuple[int, int, bytes]], List[bytes]]:
+    """ Swaps the image data of a page, keeping all other tags
+
+    Args:
+        entries (dict): raw tag entries of the page
+        data (np.ndarray): new image data, cast to the page's dtype
+        byteorder (str): struct byte order of the file
+        compression (int): TIFF compression code
+        encoder (Callable | None): strip encoder, as given by `_get_encoder`
+
+    Raises:
+        ValueError
+
+    Returns:
+        tuple (dict, list):
+        - updated raw tag entries
+        - encoded strips
+    """
+    shape = (_unpack_entry(entries[257], byteorder)[0], _unpack_entry(entries[256], byteorder)[0])
+    if np.shape(data) != shape:
+        raise ValueError(f'Channel data of shape {np.shape(data)} does not fit page of shape {shape}')
+
+    data = np.asarray(data).astype(_page_dtype(entries, byteorder))
+    rows_per_strip, strips = _encode_strips(data, encoder)
+
+    entries = dict(entries)
+    entries.pop(317, None)
+    entries[259] = _pack_entry(3, [compression], byteorder)
+    entries[278] = _pack_entry(4, [rows_per_strip], byteorder)
+    for code, value in ((340, 0), (341, data.max())):
+        if code in entries:
+            field_type = entries[code][0]
+            value = float(value) if field_type in (11, 12) else int(value)
+            entries[code] = _pack_entry(field_type, [value], byteorder)
+
+    return entries, strips
+
+
+def _estimate_tiff_size(n_bytes: int, n_pages: int) -> int:
+    """ Estimates an upper bound on the size of a tiff file written by `_write_tiff_pages`
+
+    Args:
+        n_bytes (int): size of the uncompressed image data
+        n_pages (int): number of pages
+
+    Returns:
+        int:
+            estimated file size, in bytes
+    """
+    # incompressible data grows slightly under zlib and LZMA, and each page carries its tags
+    return int(n_bytes * 1.01) + 4096 * (n_pages + 1)
+
+
+def _write_tiff_pages(fh, pages, byteorder: str = '<') -> List[int]:
+    """ Writes pages of pre-encoded strips to a classic TIFF file
+
+    Strip offsets and byte counts are filled in as the strips are written.
+
+    Args:
+        fh (file): file opened for binary writing
+        pages (iterable): raw tag entries and encoded strips of each page
+        byteorder (str): struct byte order of the file
+
+    Raises:
+        ValueError
+
+    Returns:
+        list:
+            IFD offset of each page
+    """
+    fh.write({'<': b'II', '>': b'MM'}[byteorder] + struct.pack(byteorder + 'HI', 42, 0))
+    next_ifd_pointer = 4
+
+    ifd_offsets = []
+    for entries, strips in pages:
+        strip_offsets = []
+        for strip in strips:
+            strip_offsets.append(fh.tell())
+            fh.write(strip)
+
+        entries = dict(entries)
+        entries[273] = _pack_entry(4, strip_offsets, byteorder)
+        entries[279] = _pack_entry(4, [len(strip) for strip in strips], byteorder)
+
+        # IFDs start on a word boundary
+        if fh.tell() % 2:
+            fh.write(b'\0')
+        ifd_offset = fh.tell()
+        if ifd_offset >= _CLASSIC_TIFF_LIMIT:
+            raise ValueError('Pages do not fit the 4 GB limit of a classic TIFF file')
+
+        # values over 4 bytes are stored after the IFD
+        ifd = [struct.pack(byteorder + 'H', len(entries))]
+        overflow = []
+        overflow_offset = ifd_offset + 6 + 12 * len(entries)
+        for code in sorted(entries):
+            field_type, count, value = entries[code]
+            if len(value) > 4:
+                ifd.append(struct.pack(byteorder + 'HHII', code, field_type, count, overflow_offset))
+                value += b'\0' * (len(value) % 2)
+                overflow.append(value)
+                overflow_offset += len(value)
+            else:
+                ifd.append(struct.pack(byteorder + 'HHI', code, field_type, count)
+                           + value.ljust(4, b'\0'))
+        ifd.append(struct.pack(byteorder + 'I', 0))
+        fh.write(b''.join(ifd + overflow))
+
+        # link the previous IFD to this one
+        end = fh.tell()
+        fh.seek(next_ifd_pointer)
+        fh.write(struct.pack(byteorder + 'I', ifd_offset))
+        fh.seek(end)
+
+        next_ifd_pointer = ifd_offset + 2 + 12 * len(entries)
+        ifd_offsets.append(ifd_offset)
+
+    return ifd_offsets
 
 
 def _check_version(file: TiffFile):
@@ -125,8 +708,12 @@ _PREFIXED_METADATA_ATTRIBUTES = ('run', 'coordinates', 'size', 'slide',
                                  'version')
 
 
-def write_mibitiff(filepath, img_data, channel_tuples, metadata, prefixed=False):
+def write_mibitiff(filepath, img_data, channel_tuples, metadata, prefixed=False, compress=6,
+                   max_workers=None):
     """ Writes MIBI data to a multipage TIFF.
+
+    Files over the 4 GB limit of classic TIFF are written as BigTIFF.
+
     Args:
         filepath (str):
             The path to the target file
@@ -138,57 +725,248 @@ def write_mibitiff(filepath, img_data, channel_tuples, metadata, prefixed=False)
             MIBItiff specific metadata
         prefixed (bool):
             Specifies if metadata atributes are already prefixed with 'mibi.'
+        compress (int | str | tuple):
+            Page compression, given as for tifffile: 0 or None for no compression, a zlib level
+            (1-9), a codec name (e.g 'ZSTD', 'LZW', 'LZMA'), or a (codec name, level) tuple.
+            Codecs other than zlib and LZMA require the imagecodecs package.  Default is 6.
+        max_workers (int | None):
+            Number of threads used to encode pages.  If None, one per CPU is used.
     """
+    channel_tuples = list(channel_tuples)
+    compression, encoder = _get_encoder(compress)
 
     # set up mibitiff metadata
     ranges = [(0, m) for m in img_data.max(axis=(0, 1))]
 
-    range_dtype = _range_dtype_map(img_data.dtype)
-
-    coordinates = [
-        (286, '2i', 1, _micron_to_cm(metadata[f'{"mibi." if prefixed else ""}coordinates'][0])),
-        (287, '2i', 1, _micron_to_cm(metadata[f'{"mibi." if prefixed else ""}coordinates'][1]))
-    ]
-    resolution = (img_data.shape[0] * 1e4 / float(metadata[f'{"mibi." if prefixed else ""}size']),
-                  img_data.shape[1] * 1e4 / float(metadata[f'{"mibi." if prefixed else ""}size']),
-                  'CENTIMETER')
+    range_type = 12 if _range_dtype_map(img_data.dtype) == 'd' else 4
+
+    byteorder = '<'
+    dtype = img_data.dtype.newbyteorder(byteorder)
+
+    prefix = 'mibi.' if prefixed else ''
+    resolution = (img_data.shape[0] * 1e4 / float(metadata[f'{prefix}size']),
+                  img_data.shape[1] * 1e4 / float(metadata[f'{prefix}size']))
+
+    # tags shared by every page, laid out as tifffile writes them
+    base_entries = {
+        256: _pack_entry(4, [img_data.shape[1]], byteorder),
+        257: _pack_entry(4, [img_data.shape[0]], byteorder),
+        258: _pack_entry(3, [dtype.itemsize * 8], byteorder),
+        259: _pack_entry(3, [compression], byteorder),
+        262: _pack_entry(3, [1], byteorder),
+        277: _pack_entry(3, [1], byteorder),
+        282: _pack_entry(5, _rational(resolution[0]), byteorder),
+        283: _pack_entry(5, _rational(resolution[1]), byteorder),
+        286: _pack_entry(10, _micron_to_cm(metadata[f'{prefix}coordinates'][0]), byteorder),
+        287: _pack_entry(10, _micron_to_cm(metadata[f'{prefix}coordinates'][1]), byteorder),
+        296: _pack_entry(3, [3], byteorder),
+        305: _pack_entry(2, b'IonpathMIBIv1.0', byteorder),
+    }
+    if dtype.kind != 'u':
+        base_entries[339] = _pack_entry(3, [_SAMPLE_FORMATS[dtype.kind]], byteorder)
+    date = None
+    if 'date' in metadata.keys():
+        date = datetime.datetime.strptime(metadata['date'], '%Y-%m-%dT%H:%M:%S')
+        base_entries[306] = _pack_entry(2, date.strftime('%Y:%m:%d %H:%M:%S').encode(), byteorder)
 
     description = {}
     for key, value in metadata.items():
-        if key in _PREFIXED_METADATA_ATTRIBUTES:
-            description[f'mibi.{key}'] = value
-
-    with TiffWriter(filepath) as infile:
-        for index, channel_tuple in enumerate(channel_tuples):
-            mass, target = channel_tuple
-            _metadata = description.copy()
-            _metadata.update({
-                'image.type': 'SIMS',
-                'channel.mass': int(mass),
-                'channel.target': target,
-            })
-            page_name = (
-                285, 's', 0, '{} ({})'.format(target,
-                                              mass)
-            )
-            min_value = (340, range_dtype, 1, ranges[index][0])
-            max_value = (341, range_dtype, 1, ranges[index][1])
-            page_tags = coordinates + [page_name, min_value, max_value]
-
-            date = \
-                None if 'date' not in metadata.keys() else datetime.datetime.strptime(
-                    metadata['date'],
-                    '%Y-%m-%dT%H:%M:%S'
-                )
+        attribute = key[len('mibi.'):] if prefixed and key.startswith('mibi.') else key
+        if attribute in _PREFIXED_METADATA_ATTRIBUTES:
+            description[f'mibi.{attribute}'] = value
+
+    descriptions = []
+    for mass, target in channel_tuples:
+        _metadata = description.copy()
+        _metadata.update({
+            'image.type': 'SIMS',
+            'channel.mass': int(mass),
+            'channel.target': target,
+            'shape': list(img_data.shape[:2]),
+        })
+        descriptions.append(_metadata)
+
+    def _encode_page(index: int) -> Tuple[Dict[int, Tuple[int, int, bytes]], List[bytes]]:
+        mass, target = channel_tuples[index]
+        rows_per_strip, strips = _encode_strips(
+            np.asarray(img_data[:, :, index], dtype=dtype), encoder
+        )
+
+        entries = dict(base_entries)
+        entries[270] = _pack_entry(2, json.dumps(descriptions[index]).encode(), byteorder)
+        entries[278] = _pack_entry(4, [rows_per_strip], byteorder)
+        entries[285] = _pack_entry(
+            2, '{} ({})'.format(target, mass).encode('ascii', 'replace'), byteorder
+        )
+        for code, value in zip((340, 341), ranges[index]):
+            value = float(value) if range_type == 12 else int(value)
+            entries[code] = _pack_entry(range_type, [value], byteorder)
+        return entries, strips
+
+    # stale page indices can survive rewrites within the filesystem's mtime resolution
+    if isinstance(filepath, str):
+        _PAGE_INDEX_CACHE.pop(os.path.abspath(filepath), None)
+
+    # the raw page writer only writes classic TIFF, so larger files are left to tifffile
+    if _estimate_tiff_size(img_data.nbytes, len(channel_tuples)) >= _CLASSIC_TIFF_LIMIT:
+        tags = [
+            [
+                (286, '2i', 1, _micron_to_cm(metadata[f'{prefix}coordinates'][0])),
+                (287, '2i', 1, _micron_to_cm(metadata[f'{prefix}coordinates'][1])),
+                (285, 's', 0, '{} ({})'.format(target, mass)),
+                (340, _range_dtype_map(img_data.dtype), 1, ranges[index][0]),
+                (341, _range_dtype_map(img_data.dtype), 1, ranges[index][1]),
+            ]
+            for index, (mass, target) in enumerate(channel_tuples)
+        ]
+        _write_bigtiff(filepath, img_data, descriptions, tags, resolution, compression, compress,
+                       date)
+        return
+
+    # pages are encoded concurrently, and written in order as they finish
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pages = executor.map(_encode_page, range(len(channel_tuples)))
+        if isinstance(filepath, str):
+            with open(filepath, 'wb') as fh:
+                offsets = _write_tiff_pages(fh, pages, byteorder)
+        else:
+            offsets = _write_tiff_pages(filepath, pages, byteorder)
+
+    if isinstance(filepath, str) and channel_tuples:
+        stat = os.stat(filepath)
+        seed_page_index(filepath, stat.st_size, stat.st_mtime_ns,
+                        [(int(mass), target) for mass, target in channel_tuples], offsets,
+                        json.loads(json.dumps(descriptions[0])))
+
+
+def _write_bigtiff(filepath, img_data, descriptions, tags, resolution, compression, compress,
+                   date):
+    """ Writes MIBI data to a multipage BigTIFF with tifffile, one page per channel
 
+    Args:
+        filepath (str): The path to the target file, or an open file object
+        img_data (np.ndarray): Image data
+        descriptions (list): ImageDescription metadata of each page
+        tags (list): extra tifffile tags of each page
+        resolution (tuple): x and y resolution, in pixels per cm
+        compression (int): TIFF compression code, as given by `_get_encoder`
+        compress (int | str | tuple): compression setting, as for `write_mibitiff`
+        date (datetime.datetime | None): acquisition date
+    """
+    if compression == 1:
+        compress = 0
+    else:
+        # tifffile wants the codec's TIFF name, rather than an alias like 'ZLIB'
+        name = TIFF.COMPRESSION(compression).name
+        if isinstance(compress, (tuple, list)):
+            compress = (name, compress[1])
+        elif not isinstance(compress, int):
+            compress = name
+
+    with TiffWriter(filepath, bigtiff=True) as infile:
+        for index, description in enumerate(descriptions):
             infile.save(
-                img_data[:, :, index], compress=6, resolution=resolution,
-                extratags=page_tags, metadata=_metadata,
-                datetime=date,
+                img_data[:, :, index], compress=compress,
+                resolution=resolution + ('CENTIMETER',), extratags=tags[index],
+                description=json.dumps(description), metadata=None, datetime=date,
                 software="IonpathMIBIv1.0"
             )
 
 
+# compression settings offered by the plugins, keyed by display name
+COMPRESSION_PRESETS = {
+    'zlib (6)': 6,
+    'zlib fast (1)': 1,
+    'zlib small (9)': 9,
+    'lzma': 'LZMA',
+    'none': 0,
+}
+
+
+def parse_compress(setting: str) -> Union[int, str, Tuple[str, int]]:
+    """ Parses a command line compression setting
+
+    Args:
+        setting (str):
+            a zlib level (0 for no compression), a codec name, or a codec name and level joined
+            by ':' (e.g '6', 'none', 'lzma', 'zstd:3')
+
+    Raises:
+        ValueError
+
+    Returns:
+        int | str | tuple:
+            compression setting, as for `write_mibitiff`
+    """
+    name, _, level = setting.partition(':')
+    if name.isdigit() and not level:
+        compress = int(name)
+    elif level:
+        compress = (name, int(level))
+    else:
+        compress = name
+
+    # fail before any work is done, rather than when the first page is written
+    try:
+        _get_encoder(compress)
+    except (KeyError, ValueError) as e:
+        raise ValueError(f'Unsupported compression {setting!r}') from e
+    return compress
+
+
+def _get_encoder(compress) -> Tuple[int, Union[Callable[[Any], bytes], None]]:
+    """ Resolves a tifffile style compression setting
+
+    Args:
+        compress (int | str | tuple): compression setting, as for `write_mibitiff`
+
+    Raises:
+        KeyError
+
+    Returns:
+        tuple (int, Callable | None):
+        - TIFF compression code
+        - strip encoder, or None if uncompressed
+    """
+    if compress in (0, None, False, 'NONE', 'none'):
+        return 1, None
+
+    if isinstance(compress, (tuple, list)):
+        name, level = compress
+    elif isinstance(compress, int):
+        name, level = 'ADOBE_DEFLATE', compress
+    else:
+        name, level = compress, None
+
+    name = name.upper()
+    compression = int(TIFF.COMPRESSION['ADOBE_DEFLATE' if name == 'ZLIB' else name])
+
+    # zlib and LZMA ship with python, other codecs come from imagecodecs
+    if compression in (8, 32946):
+        encoder = functools.partial(zlib.compress, level=6 if level is None else level)
+    elif compression == 34925:
+        encoder = functools.partial(lzma.compress, preset=level)
+    else:
+        try:
+            import imagecodecs
+        except ImportError:
+            raise KeyError(f'{name} compression requires the imagecodecs package')
+        encoder = getattr(imagecodecs, f'{name.lower()}_encode', None)
+        if encoder is None:
+            raise KeyError(f'imagecodecs has no {name} encoder')
+        if level is not None:
+            encoder = functools.partial(encoder, level=level)
+
+    return compression, encoder
+
+
+def _rational(value: float) -> Tuple[int, int]:
+    """ Converts a float to a (numerator, denominator) pair, as tifffile does
+    """
+    frac = Fraction(value).limit_denominator(1000000)
+    return frac.numerator, frac.denominator
+
+
 def _micron_to_cm(um):
     """ Converts microns to a fraction tuple in cm
     """
@@ -0,0 +1,82 @@
+""" Compares MIBItiff write time and file size across compression settings
+
+Usage:
+    python benchmarks/write_mibitiff_benchmark.py [--size 1024] [--channels 40] [--dtype float32]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from amp import tiff_utils
+
+# (label, compress, max_workers)
+_SETTINGS = [
+    ('none', 0, None),
+    ('zlib 1', 1, 1),
+    ('zlib 1', 1, None),
+    ('zlib 6', 6, 1),
+    ('zlib 6', 6, None),
+    ('lzma', 'LZMA', None),
+    ('zstd', 'ZSTD', None),
+    ('zstd 10', ('ZSTD', 10), None),
+    ('lzw', 'LZW', None),
+]
+
+
+def generate_stack(size: int, n_channels: int, dtype: str) -> np.ndarray:
+    """ Generates a sparse, count-like image stack resembling MIBI data
+
+    Args:
+        size (int): image width and height
+        n_channels (int): number of channels
+        dtype (str): image dtype
+
+    Returns:
+        np.ndarray:
+            image stack of shape (size, size, n_channels)
+    """
+    rng = np.random.default_rng(0)
+    rates = rng.uniform(0.05, 2, n_channels)
+    return rng.poisson(rates, (size, size, n_channels)).astype(dtype)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=1024)
+    parser.add_argument('--channels', type=int, default=40)
+    parser.add_argument('--dtype', default='float32')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    img_data = generate_stack(args.size, args.channels, args.dtype)
+    channels = [(mass, f'channel_{mass}') for mass in range(args.channels)]
+    metadata = {'coordinates': (0, 0), 'size': 500, 'run': 'benchmark'}
+
+    print(f'{args.size}x{args.size}x{args.channels} {args.dtype} stack, '
+          f'{img_data.nbytes / 2**20:.1f} MiB raw, {os.cpu_count()} cpus')
+    print(f'{"setting":<10}{"workers":>8}{"time (s)":>10}{"size (MiB)":>12}')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'benchmark.tiff')
+        for label, compress, max_workers in _SETTINGS:
+            times = []
+            try:
+                for _ in range(args.repeats):
+                    start = time.perf_counter()
+                    tiff_utils.write_mibitiff(path, img_data, channels, metadata,
+                                              compress=compress, max_workers=max_workers)
+                    times.append(time.perf_counter() - start)
+            except KeyError as e:
+                print(f'{label:<10}  skipped: {e}')
+                continue
+
+            workers = 'all' if max_workers is None else max_workers
+            print(f'{label:<10}{workers:>8}{min(times):>10.2f}'
+                  f'{os.path.getsize(path) / 2**20:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -6,13 +6,42 @@ from amp.main_viewer import MainViewer
 from amp.mplwidget import ImagePlot
 
 import numpy as np
-from scipy.ndimage import gaussian_filter
+
+from amp.background_removal_engine import (
+    generate_mask, evaluate_target, remove_cohort_background, MaskCache, SETTINGS_NAME
+)
+from amp.preview import PreviewRunner, preview_factor, downsample
+from amp.tiff_utils import COMPRESSION_PRESETS
 
 import os
-import shutil
 import json
 
-from typing import Tuple, List, Dict, Any, Union
+from typing import Tuple, List, Dict, Set, Any, Union
+
+# mask stages kept for previews (revisiting recent parameters skips refiltering)
+_PREVIEW_MASK_CACHE_ENTRIES = 8
+
+# figures recomputed when parameters change
+_PREVIEW_FIGURES = ('background_mask', 'target_preview', 'target_no_background')
+
+
+def _evalcap_view(channel_data: Any, evalcap: int) -> Any:
+    """Generates plot view of a channel, capped at the evaluation cap
+
+    Args:
+        channel_data (np.array):
+            channel data
+        evalcap (int):
+            evaluation cap
+
+    Returns:
+        np.array:
+            capped channel view
+    """
+    channel_view = np.copy(channel_data).astype('int')
+    channel_view[channel_view > evalcap] = evalcap
+
+    return channel_view
 
 
 class BackgroundRemoval(QtWidgets.QMainWindow):
@@ -125,6 +154,7 @@ class BackgroundRemoval(QtWidgets.QMainWindow):
 
             spin_box.editingFinished.connect(spinbox_change)
             slider.valueChanged.connect(slider_change)
+            slider.valueChanged.connect(lambda x, sli=slider: self.on_slider_moved(sli))
             slider.sliderReleased.connect(self.refocus_plots)
 
         # set up source tab callbacks
@@ -175,6 +205,28 @@ class BackgroundRemoval(QtWidgets.QMainWindow):
         self.source_data = None
         self.target_data = None
 
+        # Cache masks by point, source and mask parameters (prevents needless refiltering)
+        self.mask_cache = MaskCache(_PREVIEW_MASK_CACHE_ENTRIES)
+
+        # Cache processed target and the inputs each figure was last plotted with
+        self.processed_target = None
+        self.processed_key = None
+        self.preview_inputs: Dict[str, Tuple[Any, int]] = {}
+
+        # optional strided previews while tuning, with full resolution computed in the background
+        self.preview_runner = PreviewRunner(parent=self)
+        self.preview_runner.result_ready.connect(self.on_full_preview_ready)
+        self.fastPreviewCheckBox = QtWidgets.QCheckBox('Fast preview')
+        self.fastPreviewCheckBox.setToolTip(
+            'Preview downsampled images while adjusting, then refine at full resolution'
+        )
+        self.fastPreviewCheckBox.toggled.connect(self.on_fast_preview_toggle)
+        self.statusbar.addPermanentWidget(self.fastPreviewCheckBox)
+        self.compressionComboBox = QtWidgets.QComboBox()
+        self.compressionComboBox.addItems(COMPRESSION_PRESETS.keys())
+        self.compressionComboBox.setToolTip('Compression of written MIBItiff channels')
+        self.statusbar.addPermanentWidget(self.compressionComboBox)
+
         self.setWindowTitle("Background Removal New")
 
     # closeEvent is reserved by pyqt so it can't follow style guide :/
@@ -232,6 +284,9 @@ class BackgroundRemoval(QtWidgets.QMainWindow):
             new_figures (Dict[str, (str, mplwidget.ImagePlot)]):
                 Map from internal figure names to new plot objects (and name)
         """
+        if not new_figures:
+            return
+
         for internal_figure_name, (figure_name, figure_data) in new_figures.items():
             if self.figure_ids.get(internal_figure_name) is not None:
                 self.main_viewer.figures.update_figure(
@@ -414,14 +469,7 @@ class BackgroundRemoval(QtWidgets.QMainWindow):
         else:
             self.set_params(self.settings[source_channel][target_channel])
 
-        # generate mask
-        mask = self._generate_mask(self.source_data)
-        figure_updates['background_mask'] = (
-            f"{point_path.split('/')[-1]} channel {source_channel} mask {self.get_params()}",
-            ImagePlot(mask, fixed_contrast=True)
-        )
-
-        # get/refresh target channel plot
+        # get/refresh target channel data
         if (target_channel != self.current_target
             or point_path != self.current_point
             or self.target_data is None):
@@ -429,20 +477,201 @@ class BackgroundRemoval(QtWidgets.QMainWindow):
             self.target_data = self.main_viewer.CohortTreeWidget.get_item(
                 f'{point_path}/{target_channel}'
             ).get_image_data()
-        unprocessed_target, processed_target = self._evaluate_target_views(mask, self.target_data)        
 
-        figure_updates['target_preview'] = (
-            f"{point_path.split('/')[-1]} - {target_channel} Before",
-            ImagePlot(unprocessed_target, fixed_contrast=True)
-        )
-        figure_updates['target_no_background'] = (
-            f"{point_path.split('/')[-1]} - {target_channel} After {self.get_params()}",
-            ImagePlot(processed_target, fixed_contrast=True)
+        self.update_figures(figure_updates)
+
+        # fast previews are shown strided, then computed at full resolution in the background
+        self.preview_runner.cancel()
+        state = (
+            point_path, source_channel, target_channel, self.get_params(),
+            self.source_data, self.target_data
         )
+        factor = 1
+        if self.fastPreviewCheckBox.isChecked():
+            factor = preview_factor(self.source_data.shape)
+
+        self._show_previews(state, factor, self._compute_previews(
+            state, factor, *self._stale_previews(state, factor)
+        ))
+        if factor > 1:
+            self.preview_runner.schedule(
+                self._compute_previews, (state, 1), state, 1, *self._stale_previews(state, 1)
+            )
+
+        self.current_point = point_path
+
+    def _preview_keys(self, state: Tuple) -> Dict[str, Any]:
+        """ Gets everything each preview stage depends on
+
+        Args:
+            state (tuple):
+                point, source channel, target channel, parameters, source data and target data
+
+        Returns:
+            Dict[str, Any]:
+                inputs of each preview figure, and of the processed target ('processed')
+        """
+        point_path, source_channel, target_channel, params = state[:4]
+        mask_key = (point_path, source_channel, params['blur'], params['cap'], params['thresh'])
+        processed_key = (mask_key, target_channel, params['remove'])
+        return {
+            'background_mask': mask_key,
+            'target_preview': (point_path, target_channel, params['evalcap']),
+            'target_no_background': (processed_key, params['evalcap']),
+            'processed': processed_key,
+        }
+
+    def _is_stale(self, internal_figure_name: str, inputs: Any, factor: int) -> bool:
+        """ Checks if a preview figure is missing, its inputs changed, or it was plotted coarser
+
+        Args:
+            internal_figure_name (str):
+                internal name of the figure
+            inputs (Any):
+                everything the figure depends on (see `_preview_keys`)
+            factor (int):
+                preview stride
+
+        Returns:
+            bool:
+                True if the figure should be replotted
+        """
+        if self.figure_ids.get(internal_figure_name) is None:
+            return True
+        plotted = self.preview_inputs.get(internal_figure_name)
+        return plotted is None or plotted[0] != inputs or plotted[1] > factor
+
+    def _stale_previews(self, state: Tuple, factor: int) -> Tuple[Set[str], Any]:
+        """ Gets the preview figures to recompute, and the cached processed target if it's reusable
+
+        Args:
+            state (tuple):
+                see `_preview_keys`
+            factor (int):
+                preview stride
+
+        Returns:
+            (Set[str], np.array | None):
+                - stale preview figures
+                - processed target, or None if it needs recomputing
+        """
+        keys = self._preview_keys(state)
+        stages = {
+            name for name in _PREVIEW_FIGURES if self._is_stale(name, keys[name], factor)
+        }
+        processed = None
+        if self.processed_key == (keys['processed'], factor):
+            processed = self.processed_target
+        return stages, processed
+
+    def _compute_previews(self, state: Tuple, factor: int, stages: Set[str],
+                          processed: Any = None) -> Dict[str, Any]:
+        """ Computes preview figure data (thread safe)
+
+        Args:
+            state (tuple):
+                see `_preview_keys`
+            factor (int):
+                preview stride.  The blur is scaled to match.
+            stages (Set[str]):
+                preview figures to compute
+            processed (np.array | None):
+                cached processed target, or None to recompute it
+
+        Returns:
+            Dict[str, np.array]:
+                data of each computed figure, and the processed target ('processed') if recomputed
+        """
+        point_path, source_channel, target_channel, params, source_data, target_data = state
+        blur = params['blur']
+        if factor > 1:
+            source_data = downsample(source_data, factor)
+            target_data = downsample(target_data, factor)
+            blur = blur / factor
+
+        results = {}
+        if 'background_mask' in stages or ('target_no_background' in stages and processed is None):
+            results['background_mask'] = self.mask_cache.get_mask(
+                (point_path, source_channel, factor), source_data,
+                blur, params['thresh'], params['cap']
+            )
+        if 'target_preview' in stages:
+            results['target_preview'] = _evalcap_view(target_data, params['evalcap'])
+        if 'target_no_background' in stages:
+            if processed is None:
+                processed = evaluate_target(
+                    results['background_mask'], target_data, params['remove']
+                )
+                results['processed'] = processed
+            results['target_no_background'] = _evalcap_view(processed, params['evalcap'])
+
+        return results
+
+    def _show_previews(self, state: Tuple, factor: int, results: Dict[str, Any]) -> None:
+        """ Plots computed preview figures which are still stale
+
+        Args:
+            state (tuple):
+                see `_preview_keys`
+            factor (int):
+                preview stride
+            results (Dict[str, np.array]):
+                see `_compute_previews`
+        """
+        point_path, source_channel, target_channel, params = state[:4]
+        keys = self._preview_keys(state)
+        if 'processed' in results:
+            self.processed_target = results['processed']
+            self.processed_key = (keys['processed'], factor)
+
+        point_name = point_path.split('/')[-1]
+        scale = f' (preview 1/{factor})' if factor > 1 else ''
+        mask_params = {name: params[name] for name in ('blur', 'thresh', 'cap')}
+        titles = {
+            'background_mask': f"{point_name} channel {source_channel} mask {mask_params}{scale}",
+            'target_preview': f"{point_name} - {target_channel} Before{scale}",
+            'target_no_background': f"{point_name} - {target_channel} After {params}{scale}",
+        }
+
+        figure_updates = {}
+        for name, title in titles.items():
+            if name in results and self._is_stale(name, keys[name], factor):
+                figure_updates[name] = (title, ImagePlot(results[name], fixed_contrast=True))
+                self.preview_inputs[name] = (keys[name], factor)
 
         self.update_figures(figure_updates)
 
-        self.current_point = point_path
+    def on_full_preview_ready(self, tag: Tuple, results: Dict[str, Any]) -> None:
+        """ Callback for full resolution previews computed in the background
+
+        Args:
+            tag (tuple):
+                state and preview stride the previews were computed with
+            results (Dict[str, np.array]):
+                see `_compute_previews`
+        """
+        state, factor = tag
+        self._show_previews(state, factor, results)
+
+    def on_fast_preview_toggle(self, checked: bool) -> None:
+        """ Callback for toggling fast previews, which replots at full resolution when turned off
+
+        Args:
+            checked (bool):
+                fast preview checkbox state
+        """
+        if not checked:
+            self.refocus_plots()
+
+    def on_slider_moved(self, slider: QtWidgets.QSlider) -> None:
+        """ Callback for slider value changes, which replots live while dragging in fast mode
+
+        Args:
+            slider (QtWidgets.QSlider):
+                changed slider
+        """
+        if self.fastPreviewCheckBox.isChecked() and slider.isSliderDown():
+            self.refocus_plots()
 
     def _generate_mask(self, background_image: Any) -> Any:
         """Generates binaraized mask used for background removal
@@ -454,16 +683,7 @@ class BackgroundRemoval(QtWidgets.QMainWindow):
             background_mask (ndarray): generated binarized mask
         """
         params = self.get_params()
-
-        background_mask = np.zeros_like(background_image)
-        background_mask[background_image > params['cap']] = params['cap']
-        background_mask = gaussian_filter(background_mask, params['blur'])
-        background_mask = np.interp(background_mask,
-                                    (background_mask.min(),
-                                     background_mask.max()),
-                                    (0, 1))
-        background_mask = np.where(background_mask > params['thresh'], 1, 0)
-        return background_mask
+        return generate_mask(background_image, params['blur'], params['thresh'], params['cap'])
 
     def _evaluate_target(self, mask: Any, target_data: Any, remove_value: Union[int, None] = None) -> Any:
         """ Subtracts remove value from target image at positive mask values
@@ -483,35 +703,7 @@ class BackgroundRemoval(QtWidgets.QMainWindow):
         if remove_value is None:
             remove_value = self.get_params()['remove']
 
-        processed_channel = np.copy(target_data).astype('int')
-        processed_channel[mask.astype('bool')] -= remove_value
-        processed_channel[processed_channel < 0] = 0
-
-        return processed_channel
-
-    def _evaluate_target_views(self, mask: Any, target_data: Any) -> Tuple[Any]:
-        """Generates plot views for before/after targets
-
-        Args:
-            mask (np.array):
-                boolean background mask
-            target_data (np.array):
-                target channel data
-
-        Returns:
-            (np.array, np.array):
-                - unprocessed channel view (before)
-                - processed channel view (after)
-        """
-        params = self.get_params()
-
-        unprocessed_channel = np.copy(target_data).astype('int')
-        unprocessed_channel[unprocessed_channel > params['evalcap']] = params['evalcap']
-
-        processed_channel = self._evaluate_target(mask, target_data, params['remove'])        
-        processed_channel[processed_channel > params['evalcap']] = params['evalcap']
-
-        return unprocessed_channel, processed_channel
+        return evaluate_target(mask, target_data, remove_value)
 
     def toggle_settings_mode(self, mode: bool) -> None:
         """ toggles the 'set all targets' option
@@ -529,7 +721,7 @@ class BackgroundRemoval(QtWidgets.QMainWindow):
 
         settings_dir = self.main_viewer.CohortTreeWidget.topLevelItem(0).path
 
-        with open(os.path.join(settings_dir, 'background_settings.json'), 'w') as fp:
+        with open(os.path.join(settings_dir, SETTINGS_NAME), 'w') as fp:
             json.dump(self.settings, fp, indent=4)
 
     def load_settings(self) -> None:
@@ -578,39 +770,18 @@ class BackgroundRemoval(QtWidgets.QMainWindow):
 
         self.prevent_plotting = True
 
-        # copy directory
-        src_dir = self.main_viewer.CohortTreeWidget.topLevelItem(0).path
-        parent_dir = os.path.dirname(src_dir[:-1])
-        tmp_dir = os.path.join(parent_dir, 'bg_removed_temp')
-        final_dir = os.path.join(parent_dir, 'background_removed')
-
-        shutil.copytree(src_dir, tmp_dir)
-
-        # loop over all selected points
         points = [self.pointPlotSelect.itemText(i) for i in range(self.pointPlotSelect.count())]
-        for point in points:
-            # loop over settings
-            for source, targets in self.settings.items():
-                source_item = self.main_viewer.CohortTreeWidget.get_item(f'{point}/{source}')
-                if source_item is None:
-                    continue
-                source_data = source_item.get_image_data()
-                for target, params in targets.items():
-                    target_item = self.main_viewer.CohortTreeWidget.get_item(f'{point}/{target}')
-                    if target_item is None:
-                        continue
-                    target_data = target_item.get_image_data()
-                    self.set_params(params)
-                    mask = self._generate_mask(source_data)
-                    target_data_cleaned = self._evaluate_target(mask, target_data)
-
-                    target_item.write_image_data(target_data_cleaned)
-
-        # rename directories
-        os.rename(src_dir, final_dir)
-        os.rename(tmp_dir, src_dir)
-
-        self.prevent_plotting = False
+        try:
+            remove_cohort_background(
+                self.main_viewer.CohortTreeWidget.topLevelItem(0).path,
+                self.settings,
+                points,
+                compress=COMPRESSION_PRESETS[self.compressionComboBox.currentText()]
+            )
+        except Exception as e:
+            self.main_viewer.spawn_popup("Could not remove background", str(e))
+        finally:
+            self.prevent_plotting = False
 
 # function for amp plugin building
 def build_as_plugin(main_viewer: MainViewer, plugin_path: str) -> BackgroundRemoval:
@@ -6,118 +6,191 @@ from amp.main_viewer import MainViewer
 from amp.mplwidget import ImagePlot, HistPlot, Plot
 
 import numpy as np
-from scipy.stats import gamma
-from scipy.optimize import fsolve
-from scipy.special import digamma
-from scipy.special import gamma as gamma_func
-from sklearn.neighbors import NearestNeighbors
+
+from amp.knn_denoising_engine import (
+    generate_knn, evaluate_target, compute_knns, denoise_cohort, SETTINGS_NAME, KNN_METHODS,
+    _DEFAULT_KVAL, _DEFAULT_KNN_METHOD
+)
+from amp.knn_cache import KnnCache, knn_cache_dir
+from amp.preview import PreviewRunner, preview_factor, downsample
+from amp.tiff_utils import COMPRESSION_PRESETS
 
 import os
-import shutil
 import json
+import threading
 import traceback
+import concurrent.futures
 
 # TODO: figure out how to import util files
 #       one option is to do inject stuff on load
 #       not sure what the other options would be :/
 
-from typing import Tuple, List, Dict, Any, Union
-
-def _alpha_eqn(ahat: float, C: float) -> float:
-    return np.log(ahat) - digamma(ahat) - C
-
-def _calc_q(x, Ts, ws, alphas, betas):
-    param_terms = alphas * np.log(betas) - np.log(gamma_func(alphas)) + np.log(ws)
-    combined_terms = (
-        (alphas[:, np.newaxis] - 1) * np.log([x,]*alphas.shape[0])
-        - betas[:, np.newaxis] * np.array([x, ]* alphas.shape[0])
-    )
-    return np.sum(Ts * (param_terms[:, np.newaxis] + combined_terms))
-
-def _gamma_mixture(x, n_dists, max_iter, init_index, tol):
-
-    # for a gamma distribution, alpha = mean**2 / var, beta = mean / var
-    ws, alphas, betas = (np.zeros(n_dists), np.zeros(n_dists), np.zeros(n_dists))
-    dist_pdfs = np.zeros((n_dists, x.shape[0]))
-    for i in range(n_dists):
-        ws[i] = np.mean(init_index == i)
-        alphas[i] = (np.mean(x[init_index == i]) ** 2) / np.var(x[init_index == i])
-        betas[i] = np.mean(x[init_index == i]) / np.var(x[init_index == i])
-        dist_pdfs[i] = gamma.pdf(x, alphas[i], scale = 1 / betas[i])
-
-    total_dist = np.dot(dist_pdfs.T, ws)
-
-    z_cond_dists = (ws[:, np.newaxis] * dist_pdfs) / total_dist
-
-    for _iter in range(max_iter):
+from typing import Tuple, List, Dict, Set, Any, Union
 
-        sum_Ts = np.sum(z_cond_dists, axis=1)
-        sum_Txs = np.dot(z_cond_dists, x)
-        sum_Tlogxs = np.dot(z_cond_dists, np.log(x))
 
-        alpha_eq_consts = np.log(sum_Txs / sum_Ts) - (sum_Tlogxs / sum_Ts)
+class DenoiseRunner(QtCore.QObject):
+    """ Runs cohort denoising on a background thread, so the plugin stays responsive
 
-        # compute argmax's
-        a_hats = np.array([
-            fsolve(_alpha_eqn, alphas[i], args=(alpha_eq_consts[i]), xtol=1e-3)[0]
-            for i in range(n_dists)
-        ])
-        b_hats = a_hats * sum_Ts / sum_Txs
-        w_hats = sum_Ts / x.shape[0]
-
-        # get next iter distributions
-        dist_pdfs_next = np.array([
-            gamma.pdf(x, a_hats[i], scale = 1 / b_hats[i])
-            for i in range(n_dists)
-        ])
-        total_dist_next = np.dot(dist_pdfs_next.T, w_hats)
-        z_cond_dists_next = (w_hats[:, np.newaxis] * dist_pdfs_next) / total_dist_next
+    Signals are never emitted after `cancel` is called.
 
-        # compute delta_q
-        delta_q = (
-            _calc_q(x, z_cond_dists_next, w_hats, a_hats, b_hats)
-            - _calc_q(x, z_cond_dists, ws, alphas, betas)
-        )
+    Atributes:
+        progress (QtCore.pyqtSignal(int, int)):
+            number of denoised FOVs, and total FOVs to denoise
+        finished (QtCore.pyqtSignal(bool, str)):
+            emitted once denoising stops.  False if cancelled, along with any error.
+    """
+    progress = QtCore.pyqtSignal(int, int)
+    finished = QtCore.pyqtSignal(bool, str)
+
+    # cross-thread relays (queued onto the runner's thread)
+    _progress_ready = QtCore.pyqtSignal(int, int)
+    _run_done = QtCore.pyqtSignal(str)
+
+    def __init__(self, cohort_head: str, settings: Dict[str, Dict[str, Dict]],
+                 knns: Dict[str, Dict[str, Any]], max_workers: int,
+                 knn_method: str = _DEFAULT_KNN_METHOD, cache_dir: Union[str, None] = None,
+                 compress: Any = 6, parent: QtCore.QObject = None) -> None:
+        super().__init__(parent)
+        self.cohort_head = cohort_head
+        self.settings = settings
+        self.knns = knns
+        self.max_workers = max_workers
+        self.knn_method = knn_method
+        self.cache_dir = cache_dir
+        self.compress = compress
+
+        self.cancel_event = threading.Event()
+        self.done = False
+
+        self._progress_ready.connect(self._on_progress_ready)
+        self._run_done.connect(self._on_run_done)
+
+    def start(self) -> None:
+        """ Starts denoising in the background
+        """
+        threading.Thread(target=self._run, daemon=True).start()
 
-        # update params and distributions
-        ws, alphas, betas = (w_hats, a_hats, b_hats)
-        dist_pdfs = dist_pdfs_next
-        total_dist = total_dist_next
-        z_cond_dists = z_cond_dists_next
+    def cancel(self) -> None:
+        """ Stops denoising.  FOVs denoised so far are discarded.
+        """
+        if self.done or self.cancel_event.is_set():
+            return
+        self.cancel_event.set()
+        self.done = True
+        self.finished.emit(False, '')
 
-        if np.abs(delta_q) <= tol:
-            break
+    def _run(self) -> None:
+        """ Denoise routine (runs on a background thread)
+        """
+        try:
+            denoise_cohort(
+                self.cohort_head,
+                self.settings,
+                self.knns,
+                progress_callback=self._progress_ready.emit,
+                max_workers=self.max_workers,
+                knn_method=self.knn_method,
+                cache_dir=self.cache_dir,
+                compress=self.compress,
+                cancel_event=self.cancel_event
+            )
+        except concurrent.futures.CancelledError:
+            pass
+        except Exception as e:
+            self._run_done.emit(str(e) + '\n' + traceback.format_exc())
+            return
+        self._run_done.emit('')
 
-    return ws, alphas, betas
+    @QtCore.pyqtSlot(int, int)
+    def _on_progress_ready(self, done: int, total: int) -> None:
+        if self.cancel_event.is_set():
+            return
+        self.progress.emit(done, total)
 
-_INIT_KNN_THRESH = 6
+    @QtCore.pyqtSlot(str)
+    def _on_run_done(self, error: str) -> None:
+        if self.done:
+            return
+        self.done = True
+        self.finished.emit(True, error)
 
-def optimize_threshold(knn_dists, max_N = 20000):
 
-    knn_sample = None
-    if knn_dists.shape[0] > max_N:
-        knn_sample = np.random.choice(knn_dists, size=max_N, replace=False)
-    else:
-        knn_sample = knn_dists
+class KnnRunner(QtCore.QObject):
+    """ Computes knns/optimal thresholds on worker processes, streaming back results per channel
 
-    # approximate initial distribution assignments
-    assignment_guess = np.zeros_like(knn_sample)
-    assignment_guess[knn_sample > _INIT_KNN_THRESH] = 1
+    Signals are never emitted after `cancel` is called.
 
-    w, alpha, beta = _gamma_mixture(knn_sample, 2, 500, assignment_guess, 1e-3)
+    Atributes:
+        result (QtCore.pyqtSignal(str, str, object, object, float, str)):
+            FOV tree path, channel, mean knn distances, optimal threshold (None if not
+            optimized), display cap, and threshold optimization error (empty if none)
+        finished (QtCore.pyqtSignal(bool, str)):
+            emitted once computation stops.  False if cancelled, along with any error.
+    """
+    result = QtCore.pyqtSignal(str, str, object, object, float, str)
+    finished = QtCore.pyqtSignal(bool, str)
+
+    # cross-thread relays (queued onto the runner's thread)
+    _result_ready = QtCore.pyqtSignal(tuple)
+    _run_done = QtCore.pyqtSignal(str)
+
+    def __init__(self, tasks: List[Tuple[str, str, str, Any, bool]], max_workers: int,
+                 knn_method: str = _DEFAULT_KNN_METHOD, cache_dir: Union[str, None] = None,
+                 parent: QtCore.QObject = None) -> None:
+        super().__init__(parent)
+        self.tasks = tasks
+        self.max_workers = max_workers
+        self.knn_method = knn_method
+        self.cache_dir = cache_dir
+
+        self.cancel_event = threading.Event()
+        self.done = False
+
+        self._result_ready.connect(self._on_result_ready)
+        self._run_done.connect(self._on_run_done)
+
+    def start(self) -> None:
+        """ Starts computing in the background
+        """
+        threading.Thread(target=self._run, daemon=True).start()
 
-    means = np.sort(alpha / beta)
-    x = np.linspace(means[0], means[1], num=int(10*(means[1] - means[0])))
+    def cancel(self) -> None:
+        """ Stops computing.  Results found after this call are discarded.
+        """
+        if self.done or self.cancel_event.is_set():
+            return
+        self.cancel_event.set()
+        self.done = True
+        self.finished.emit(False, '')
 
-    dist1 = w[0] * gamma.pdf(x, alpha[0], scale = 1 / beta[0])
-    dist2 = w[1] * gamma.pdf(x, alpha[1], scale = 1 / beta[1])
+    def _run(self) -> None:
+        """ Knn routine (runs on a background thread)
+        """
+        try:
+            results = compute_knns(
+                self.tasks, self.max_workers, self.cancel_event, self.knn_method,
+                self.cache_dir
+            )
+            for result in results:
+                self._result_ready.emit(result)
+        except Exception as e:
+            self._run_done.emit(str(e) + '\n' + traceback.format_exc())
+            return
+        self._run_done.emit('')
 
-    if len(np.abs(dist1 - dist2)) == 0:
-        return _INIT_KNN_THRESH
+    @QtCore.pyqtSlot(tuple)
+    def _on_result_ready(self, result: Tuple[str, str, Any, Any, float, str]) -> None:
+        if self.cancel_event.is_set():
+            return
+        self.result.emit(*result)
 
-    return x[np.argmin(np.abs(dist1 - dist2))]
+    @QtCore.pyqtSlot(str)
+    def _on_run_done(self, error: str) -> None:
+        if self.done:
+            return
+        self.done = True
+        self.finished.emit(True, error)
 
-_DEFAULT_KVAL = 25
 
 class KnnDenoising(QtWidgets.QMainWindow):
 
@@ -197,6 +270,26 @@ class KnnDenoising(QtWidgets.QMainWindow):
         self.saveSettingsButton.clicked.connect(self.save_settings)
         self.loadSettingsButton.clicked.connect(self.load_settings)
 
+        # knns and full denoise run in the background, on worker processes
+        self.denoise_runner: Union[DenoiseRunner, None] = None
+        self.workersSpinBox = QtWidgets.QSpinBox()
+        self.workersSpinBox.setRange(1, os.cpu_count() or 1)
+        self.workersSpinBox.setValue(os.cpu_count() or 1)
+        self.workersSpinBox.setPrefix('Workers: ')
+        self.workersSpinBox.setToolTip('Number of processes used for knns and denoising')
+        self.statusbar.addPermanentWidget(self.workersSpinBox)
+        self.knnMethodComboBox = QtWidgets.QComboBox()
+        self.knnMethodComboBox.addItems(KNN_METHODS)
+        self.knnMethodComboBox.setCurrentText(_DEFAULT_KNN_METHOD)
+        self.knnMethodComboBox.setToolTip(
+            "Knn engine.  'grid' gives the same distances, and is faster on dense channels"
+        )
+        self.statusbar.addPermanentWidget(self.knnMethodComboBox)
+        self.compressionComboBox = QtWidgets.QComboBox()
+        self.compressionComboBox.addItems(COMPRESSION_PRESETS.keys())
+        self.compressionComboBox.setToolTip('Compression of denoised MIBItiff channels')
+        self.statusbar.addPermanentWidget(self.compressionComboBox)
+
         # connect sliders and spin boxes
         spin_slider_pairs: List[Tuple[QtWidgets.QSpinBox, QtWidgets.QSlider]] = \
             [
@@ -225,6 +318,7 @@ class KnnDenoising(QtWidgets.QMainWindow):
 
             spin_box.editingFinished.connect(spinbox_change)
             slider.valueChanged.connect(slider_change)
+            slider.valueChanged.connect(lambda x, sli=slider: self.on_slider_moved(sli))
             slider.sliderReleased.connect(self.refocus_plots)
 
         # add plot point select callback
@@ -233,6 +327,7 @@ class KnnDenoising(QtWidgets.QMainWindow):
 
         # set callback for threshold optimizing
         self.optThreshButton.clicked.connect(self.run_knns)
+        self.knn_runner: Union[KnnRunner, None] = None
 
         # initialize settings and extract default alg params
         # settings are per FOV
@@ -259,6 +354,19 @@ class KnnDenoising(QtWidgets.QMainWindow):
         self.channel_data = None
         self.non_zeros = None
 
+        # optional strided previews while tuning, with full resolution computed in the background
+        self.preview_runner = PreviewRunner(parent=self)
+        self.preview_runner.result_ready.connect(self.on_full_preview_ready)
+        self.fastPreviewCheckBox = QtWidgets.QCheckBox('Fast preview')
+        self.fastPreviewCheckBox.setToolTip(
+            'Preview downsampled images while adjusting, then refine at full resolution'
+        )
+        self.fastPreviewCheckBox.toggled.connect(self.on_fast_preview_toggle)
+        self.statusbar.addPermanentWidget(self.fastPreviewCheckBox)
+
+        # stride each preview figure was last plotted at
+        self.preview_factors: Dict[str, int] = {}
+
         # Store knn mean dist vals
         # Technically these depend on the nonzeros for each image, but that's deterministic
         # and quickly recomputable
@@ -465,6 +573,7 @@ class KnnDenoising(QtWidgets.QMainWindow):
             self.channel_data = self.main_viewer.CohortTreeWidget.get_item(
                 f'{point_path}/{target_channel}'
             ).get_image_data()
+            self.non_zeros = np.array(self.channel_data.nonzero()).T
 
         # update settings if necessary
         recalcs = {
@@ -483,149 +592,308 @@ class KnnDenoising(QtWidgets.QMainWindow):
             self.set_params(self.settings[point_path][target_channel])
             self.replot_on_spinchange = True
 
-        if recalcs['cap']:
-            data_preview = self.channel_data.copy()
-            data_preview[data_preview > self.get_params()['cap']] = self.get_params()['cap']
+        # fast previews are shown strided, then computed at full resolution in the background
+        self.preview_runner.cancel()
+        knn = self.knns.get(point_path, {}).get(target_channel)
+        if knn is None:
+            knn = self._load_cached_knn(point_path, target_channel)
+        state = (
+            point_path, target_channel, self.get_params(),
+            self.channel_data, self.non_zeros, knn
+        )
+        factor = 1
+        if self.fastPreviewCheckBox.isChecked():
+            factor = preview_factor(self.channel_data.shape)
 
-            figure_updates['target_preview'] = (
-                f"{point_path.split('/')[-1]} channel: {target_channel}",
-                ImagePlot(data_preview, fixed_contrast=True)
-            )
+        stages = self._coarse_previews(factor)
+        if recalcs['cap']:
+            stages.add('target_preview')
+        if any(recalcs.values()):
+            stages.add('target_denoised')
+        previews = self._preview_figures(
+            state, factor, self._compute_previews(state, factor, stages)
+        )
+        if 'target_preview' in previews:
+            figure_updates['target_preview'] = previews['target_preview']
 
         # generate mean dist knn
-        if point_path in self.knns.keys() and target_channel in self.knns[point_path].keys():
-
-            if recalcs['thresh']:
+        if knn is not None and recalcs['thresh']:
+            thresh = self.settings[point_path][target_channel]['thresh']
+            hist_id = self.figure_ids.get('knn_hist')
+            hist_plot = self.main_viewer.figures.get_figure(hist_id) if hist_id is not None else None
+            if hist_plot is not None and hist_plot.plot_data['flattened_data'] is knn:
+                # same distances, so only the threshold line moves (no rebinning)
+                self.main_viewer.figures.update_figure_data(hist_id, {'threshold': thresh})
+            else:
                 figure_updates['knn_hist'] = (
                     f"{point_path.split('/')[-1]} channel {target_channel} knn hist",
-                    HistPlot(
-                        self.knns[point_path][target_channel],
-                        n_bins=30,
-                        thresh=self.settings[point_path][target_channel]['thresh']
-                    )
-                )
-
-            # filter image using mean dist knn
-            if any(recalcs.values()):
-                processed_target = self._evaluate_target(
-                    np.array(self.channel_data.nonzero()).T,
-                    self.knns[point_path][target_channel],
-                    self.channel_data
+                    HistPlot(knn, n_bins=30, thresh=thresh)
                 )
 
-                figure_updates['target_denoised'] = (
-                    f"{point_path.split('/')[-1]} - {target_channel} w/ {self.get_params()}",
-                    ImagePlot(processed_target, fixed_contrast=True)
-                )
+        # filter image using mean dist knn
+        if 'target_denoised' in previews:
+            figure_updates['target_denoised'] = previews['target_denoised']
 
         self.update_figures(figure_updates)
 
+        if factor > 1:
+            self.preview_runner.schedule(
+                self._compute_previews, (state, 1), state, 1, self._coarse_previews(1)
+            )
+
         self.current_point = point_path
         self.current_channel = target_channel
 
-    def _generate_knn(self, channel_data: Any, k_val: int = _DEFAULT_KVAL) -> Any:
-        """Generates mean knn distance image for denoising
+    def _coarse_previews(self, factor: int) -> Set[str]:
+        """ Gets the preview figures plotted coarser than the given stride
 
         Args:
-            channel_data (ndarray): channel data used to compute mean knn dist
+            factor (int):
+                preview stride
 
         Returns:
-            tuple: nonzero indicies, generated mean knn distances
+            Set[str]:
+                preview figures to recompute
         """
+        return {
+            name for name, plotted_factor in self.preview_factors.items()
+            if plotted_factor > factor and self.figure_ids.get(name) is not None
+        }
+
+    def _compute_previews(self, state: Tuple, factor: int, stages: Set[str]) -> Dict[str, Any]:
+        """ Computes preview figure data (thread safe)
+
+        Args:
+            state (tuple):
+                point, channel, parameters, channel data, nonzero indicies and mean knn distances
+            factor (int):
+                preview stride.  Mean knn distances are per pixel, so strided previews are exact.
+            stages (Set[str]):
+                preview figures to compute
 
-        non_zeros = np.array(channel_data.nonzero()).T
-        nbrs = NearestNeighbors(
-            n_neighbors=int(k_val + 1),
-            algorithm='kd_tree').fit(non_zeros)
+        Returns:
+            Dict[str, np.array]:
+                data of each computed figure
+        """
+        point_path, target_channel, params, channel_data, non_zeros, knn = state
+        if knn is None:
+            stages = stages - {'target_denoised'}
+        if factor > 1:
+            channel_data = downsample(channel_data, factor)
+            if knn is not None:
+                strided = np.all(non_zeros % factor == 0, axis=1)
+                non_zeros, knn = non_zeros[strided] // factor, knn[strided]
+
+        results = {}
+        if 'target_preview' in stages:
+            data_preview = channel_data.copy()
+            data_preview[data_preview > params['cap']] = params['cap']
+            results['target_preview'] = data_preview
+        if 'target_denoised' in stages:
+            results['target_denoised'] = evaluate_target(
+                non_zeros, knn, channel_data, params['thresh'], params['cap']
+            )
 
-        distances, _ = nbrs.kneighbors(non_zeros)
+        return results
 
-        knn_mean = np.mean(distances[:, 1:], axis=1)
+    def _preview_figures(self, state: Tuple, factor: int,
+                         results: Dict[str, Any]) -> Dict[str, Tuple[str, Plot]]:
+        """ Builds plots of computed preview figures, and records the stride they're plotted at
 
-        return non_zeros, knn_mean
+        Args:
+            state (tuple):
+                see `_compute_previews`
+            factor (int):
+                preview stride
+            results (Dict[str, np.array]):
+                see `_compute_previews`
 
-    def _evaluate_target(self, non_zeros: Any, knn: Any, channel_data: Any, cap: bool = True) -> Any:
+        Returns:
+            Dict[str, (str, mplwidget.ImagePlot)]:
+                figure updates (see `update_figures`)
+        """
+        point_path, target_channel, params = state[:3]
+        point_name = point_path.split('/')[-1]
+        scale = f' (preview 1/{factor})' if factor > 1 else ''
+        titles = {
+            'target_preview': f"{point_name} channel: {target_channel}{scale}",
+            'target_denoised': f"{point_name} - {target_channel} w/ {params}{scale}",
+        }
+
+        figure_updates = {}
+        for name, title in titles.items():
+            if name in results:
+                figure_updates[name] = (title, ImagePlot(results[name], fixed_contrast=True))
+                self.preview_factors[name] = factor
+
+        return figure_updates
+
+    def on_full_preview_ready(self, tag: Tuple, results: Dict[str, Any]) -> None:
+        """ Callback for full resolution previews computed in the background
+
+        Args:
+            tag (tuple):
+                state and preview stride the previews were computed with
+            results (Dict[str, np.array]):
+                see `_compute_previews`
         """
+        state, factor = tag
+        self.update_figures(self._preview_figures(state, factor, results))
+
+    def on_fast_preview_toggle(self, checked: bool) -> None:
+        """ Callback for toggling fast previews, which replots at full resolution when turned off
+
+        Args:
+            checked (bool):
+                fast preview checkbox state
         """
-        params = self.get_params()
+        if not checked:
+            self.refocus_plots()
+
+    def on_slider_moved(self, slider: QtWidgets.QSlider) -> None:
+        """ Callback for slider value changes, which replots live while dragging in fast mode
 
-        denoised = channel_data.copy()
-        bad_inds = non_zeros[knn > params['thresh']].T
-        if bad_inds.size > 0:
-            denoised[bad_inds[0], bad_inds[1]] = 0
-        if cap:
-            denoised[denoised > params['cap']] = params['cap']
+        Args:
+            slider (QtWidgets.QSlider):
+                changed slider
+        """
+        if self.fastPreviewCheckBox.isChecked() and slider.isSliderDown():
+            self.refocus_plots()
 
-        return denoised
+    def _knn_cache_dir(self) -> Union[str, None]:
+        """ Gets the knn cache directory of the loaded cohort
 
-    def run_knns(self) -> None:
+        Returns:
+            str | None:
+                knn cache directory, or None if no cohort is loaded
+        """
+        cohort_item = self.main_viewer.CohortTreeWidget.topLevelItem(0)
+        if cohort_item is None:
+            return None
+        return knn_cache_dir(cohort_item.path)
+
+    def _load_cached_knn(self, point: str, channel: str) -> Any:
+        """ Loads a channel's mean knn distances from the knn cache, if an earlier session
+        computed them
+
+        Args:
+            point (str):
+                FOV tree path
+            channel (str):
+                channel name
+
+        Returns:
+            np.ndarray | None:
+                mean knn distances, or None if they aren't cached
+        """
+        cache_dir = self._knn_cache_dir()
+        channel_item = self.main_viewer.CohortTreeWidget.get_item(f'{point}/{channel}')
+        if cache_dir is None or channel_item is None:
+            return None
+
+        cached = KnnCache(cache_dir).get(channel_item.path, channel, _DEFAULT_KVAL)
+        if cached is None:
+            return None
+
+        if point not in self.knns.keys():
+            self.knns[point] = {}
+        self.knns[point][channel] = cached['knn']
+        return cached['knn']
+
+    def _generate_knn(self, channel_data: Any, k_val: int = _DEFAULT_KVAL) -> Any:
+        """Generates mean knn distance image for denoising
+
+        Args:
+            channel_data (ndarray): channel data used to compute mean knn dist
+
+        Returns:
+            tuple: nonzero indicies, generated mean knn distances
+        """
+        return generate_knn(channel_data, k_val, self.knnMethodComboBox.currentText())
+
+    def _evaluate_target(self, non_zeros: Any, knn: Any, channel_data: Any, cap: bool = True) -> Any:
+        """
         """
+        params = self.get_params()
+        return evaluate_target(
+            non_zeros, knn, channel_data, params['thresh'], params['cap'] if cap else None
+        )
+
+    def run_knns(self) -> None:
+        """ compute knns (and optimize thresholds) of all selected points/channels in the background
         """
+        if self.knn_runner is not None:
+            return
+
+        optimize = self.optAllButton.isChecked()
+        tasks = []
+        for point, channels in self.settings.items():
+            for channel, params in channels.items():
+                channel_item = self.main_viewer.CohortTreeWidget.get_item(f'{point}/{channel}')
+                if channel_item is None:
+                    continue
+                tasks.append((
+                    point,
+                    channel,
+                    channel_item.path,
+                    self.knns.get(point, {}).get(channel),
+                    optimize and 'opt_thresh' not in params
+                ))
 
         progress_dialog = QtWidgets.QProgressDialog(
             'Running KNNs..',
-            None,
-            0, 
-            self.pointPlotSelect.count() * self.channelPlotSelect.count(),
+            'Cancel',
+            0,
+            len(tasks),
             self
         )
         progress_dialog.setMinimumDuration(0)
-        progress_dialog.show()
         progress_dialog.setValue(0)
 
-        progress = 0
-        for point in self.settings.keys():
-            self.current_point = point
-            point_text = f'Running {point} - '
-            if point not in self.knns.keys():
-                self.knns[point] = {}
-            for i, channel in enumerate(self.settings[point].keys()):
-                self.current_channel = channel
-                channel_txt = f'channel {channel} - '
-                action_txt = f'computing knn...'
-                progress_dialog.setLabelText(point_text + channel_txt + action_txt)
-                progress_dialog.show()
-                QtCore.QCoreApplication.instance().processEvents()
-
-                params = self.settings[point][channel]
-                self.channel_data = self.main_viewer.CohortTreeWidget.get_item(
-                    f'{point}/{channel}'
-                ).get_image_data()
-
-                if channel not in self.knns[point].keys():
-                    _, self.knns[point][channel] = \
-                        self._generate_knn(self.channel_data)
-
-                if self.optAllButton.isChecked():
-                    action_txt = f'optimizing threshold...'
-                    progress_dialog.setLabelText(point_text + channel_txt + action_txt)
-                    progress_dialog.show()
-                    QtCore.QCoreApplication.instance().processEvents()
-
-                    if 'opt_thresh' not in self.settings[point][channel].keys():
-                        try:
-                            opt_thresh = optimize_threshold(self.knns[point][channel])
-                            self.settings[point][channel]['opt_thresh'] = opt_thresh
-                        except ValueError as e:
-                            self.main_viewer.spawn_popup(
-                                f"Could not optimize channel '{channel}' threshold",
-                                str(e) + '\n' + traceback.format_exc()
-                            )
-                            opt_thresh = params['thresh']
-                    else:
-                        opt_thresh = self.settings[point][channel]['opt_thresh']
-                    self.settings[point][channel]['thresh'] = opt_thresh
-
-                # set display cap to ~99th percentile
-                self.settings[point][channel]['cap'] = np.percentile(self.channel_data, 99) + 1
-
-                progress += 1
-                progress_dialog.setValue(progress)
-
-        progress_dialog.close()
-
-        # refresh plots
-        self.refocus_plots()
+        n_done = 0
+
+        def on_result(point: str, channel: str, knn: Any, opt_thresh: Union[float, None],
+                      cap: float, error: str) -> None:
+            nonlocal n_done
+            self.knns.setdefault(point, {})[channel] = knn
+
+            params = self.settings.get(point, {}).get(channel)
+            if params is not None:
+                if error:
+                    self.main_viewer.spawn_popup(
+                        f"Could not optimize channel '{channel}' threshold", error
+                    )
+                if opt_thresh is not None:
+                    params['opt_thresh'] = opt_thresh
+                if optimize:
+                    params['thresh'] = params.get('opt_thresh', params['thresh'])
+                params['cap'] = cap
+
+            # refresh the plots if they show this channel
+            if point == self.current_point and channel == self.current_channel:
+                self.current_channel = None
+                self.refocus_plots()
+
+            n_done += 1
+            progress_dialog.setLabelText(f'Finished {point} - channel {channel}')
+            progress_dialog.setValue(n_done)
+
+        def on_finished(completed: bool, error: str) -> None:
+            progress_dialog.close()
+            self.knn_runner = None
+            self.optThreshButton.setEnabled(True)
+            if error:
+                self.main_viewer.spawn_popup("Could not run KNNs", error)
+
+        self.knn_runner = KnnRunner(
+            tasks, self.workersSpinBox.value(), self.knnMethodComboBox.currentText(),
+            self._knn_cache_dir(), self
+        )
+        self.knn_runner.result.connect(on_result)
+        self.knn_runner.finished.connect(on_finished)
+        progress_dialog.canceled.connect(self.knn_runner.cancel)
+        self.optThreshButton.setEnabled(False)
+        self.knn_runner.start()
 
     def save_settings(self) -> None:
         """ write background removal settings out to json
@@ -633,7 +901,7 @@ class KnnDenoising(QtWidgets.QMainWindow):
 
         settings_dir = self.main_viewer.CohortTreeWidget.topLevelItem(0).path
 
-        with open(os.path.join(settings_dir, 'denoising_settings.json'), 'w') as fp:
+        with open(os.path.join(settings_dir, SETTINGS_NAME), 'w') as fp:
             json.dump(self.settings, fp, indent=4)
 
     def load_settings(self) -> None:
@@ -674,46 +942,50 @@ class KnnDenoising(QtWidgets.QMainWindow):
     def denoise(self) -> None:
         """ run full denoising on all selected points/channels and save output
         """
-        self.prevent_plotting = True
-
-        # copy directory
-        src_dir = self.main_viewer.CohortTreeWidget.topLevelItem(0).path
-        parent_dir = os.path.dirname(src_dir[:-1])
-        tmp_dir = os.path.join(parent_dir, 'denoised_temp')
-        final_dir = os.path.join(parent_dir, 'denoised')
+        if self.denoise_runner is not None:
+            return
 
-        shutil.copytree(src_dir, tmp_dir)
+        progress_dialog = QtWidgets.QProgressDialog(
+            'Denoising cohort..',
+            'Cancel',
+            0,
+            len(self.settings),
+            self
+        )
+        progress_dialog.setWindowModality(QtCore.Qt.WindowModal)
+        progress_dialog.setMinimumDuration(0)
+        progress_dialog.setValue(0)
 
-        # loop over settings
-        for point, targets in self.settings.items():
-            for target, params in targets.items():
-                target_item = self.main_viewer.CohortTreeWidget.get_item(f'{point}/{target}')
-                if target_item is None:
-                    continue
-                target_data = target_item.get_image_data()
-                self.set_params(params)
-
-                ## Do denoising here
-                if point in self.knns.keys() and target in self.knns[point].keys():
-                    target_data_cleaned = self._evaluate_target(
-                        np.array(target_data.nonzero()).T,
-                        self.knns[point][target],
-                        target_data
-                    )
-                else:
-                    nz, knn = self._generate_knn(target_data)
-                    target_data_cleaned = self._evaluate_target(
-                        nz,
-                        knn,
-                        target_data
-                    )
-                target_item.write_image_data(target_data_cleaned)
+        def on_progress(done: int, total: int) -> None:
+            progress_dialog.setLabelText(f'Denoised {done}/{total} FOVs')
+            progress_dialog.setValue(done)
 
-        # rename directories
-        os.rename(src_dir, final_dir)
-        os.rename(tmp_dir, src_dir)
+        def on_finished(completed: bool, error: str) -> None:
+            progress_dialog.close()
+            self.denoise_runner = None
+            self.runDenoiseButton.setEnabled(True)
+            if error:
+                self.main_viewer.spawn_popup("Could not denoise cohort", error)
 
-        self.prevent_plotting = False
+        # settings are copied, so edits made while denoising don't leak into the run
+        self.denoise_runner = DenoiseRunner(
+            self.main_viewer.CohortTreeWidget.topLevelItem(0).path,
+            {
+                point: {channel: dict(params) for channel, params in channels.items()}
+                for point, channels in self.settings.items()
+            },
+            {point: dict(channel_knns) for point, channel_knns in self.knns.items()},
+            self.workersSpinBox.value(),
+            self.knnMethodComboBox.currentText(),
+            self._knn_cache_dir(),
+            COMPRESSION_PRESETS[self.compressionComboBox.currentText()],
+            self
+        )
+        self.denoise_runner.progress.connect(on_progress)
+        self.denoise_runner.finished.connect(on_finished)
+        progress_dialog.canceled.connect(self.denoise_runner.cancel)
+        self.runDenoiseButton.setEnabled(False)
+        self.denoise_runner.start()
 
 
 # function for amp plugin building
@@ -2,6 +2,8 @@ from PyQt5 import QtWidgets, QtCore, uic
 
 from amp.main_viewer import MainViewer
 from amp.mplwidget import ImagePlot, HistPlot, Plot
+import amp.knn_denoising_engine
+import amp.background_removal_engine
 
 import numpy as np
 from scipy.ndimage import gaussian_filter
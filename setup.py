@@ -27,5 +27,11 @@ setuptools.setup(
         "Programming Language :: Python :: 3",
     ],
     install_requires=dependencies,
+    entry_points={
+        'console_scripts': [
+            'amp-denoise=amp.knn_denoising_engine:main',
+            'amp-remove-background=amp.background_removal_engine:main',
+        ],
+    },
     python_requires='==3.6.*'
 )
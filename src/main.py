@@ -1,3 +1,4 @@
+import multiprocessing
 import sys
 import traceback
 from PyQt5 import QtWidgets
@@ -8,6 +9,9 @@ from amp.main_viewer import MainViewer
 # start application
 if __name__ == "__main__":
 
+    # lets frozen builds start plugin worker processes
+    multiprocessing.freeze_support()
+
     app = QtWidgets.QApplication(sys.argv)
     window = MainViewer()
     window.show()
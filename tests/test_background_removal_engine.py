@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+import pytest
+import tifffile
+
+from amp import background_removal_engine
+
+
+def _make_cohort(tmp_path):
+    cohort = tmp_path / 'cohort'
+    for fov in ('fov1', 'fov2'):
+        tif_dir = cohort / fov / 'TIFs'
+        os.makedirs(tif_dir)
+        for channel in ('Au', 'CD3'):
+            tifffile.imwrite(str(tif_dir / f'{channel}.tif'), np.full((8, 8), 10, np.uint8))
+    return str(cohort)
+
+
+SETTINGS = {'Au': {'CD3': {'blur': 1, 'thresh': 0.5, 'cap': 5, 'remove': 2}}}
+
+
+def test_failed_run_removes_partial_copy(tmp_path, monkeypatch):
+    cohort = _make_cohort(tmp_path)
+
+    def fail(channels, settings):
+        raise RuntimeError('failed fov')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(background_removal_engine, 'remove_point_background', fail)
+        with pytest.raises(RuntimeError):
+            background_removal_engine.remove_cohort_background(cohort, SETTINGS)
+
+    assert not os.path.exists(tmp_path / 'bg_removed_temp')
+
+    # the next run isn't blocked by the failed one
+    final_dir = background_removal_engine.remove_cohort_background(cohort, SETTINGS)
+    assert os.path.isdir(final_dir)
+
+
+@pytest.mark.parametrize('out_dir', ['background_removed', 'bg_removed_temp'])
+def test_existing_output_fails_fast(tmp_path, monkeypatch, out_dir):
+    cohort = _make_cohort(tmp_path)
+    os.makedirs(tmp_path / out_dir)
+
+    def fail(cohort_head):
+        raise AssertionError('cohort was indexed')
+
+    monkeypatch.setattr(background_removal_engine.cohort_scanner, 'index_cohort', fail)
+    with pytest.raises(FileExistsError):
+        background_removal_engine.remove_cohort_background(cohort, SETTINGS)
+
+    # the existing output is left alone, and nothing else is written
+    assert sorted(os.listdir(tmp_path)) == sorted(['cohort', out_dir])
+    assert os.listdir(tmp_path / out_dir) == []
@@ -0,0 +1,81 @@
+import concurrent.futures
+import os
+
+import numpy as np
+import pytest
+from tifffile import imwrite
+
+from amp import cohort_scanner
+
+
+def _make_cohort(tmp_path):
+    cohort = tmp_path / 'cohort'
+    for fov in ('fov1', 'fov2'):
+        (cohort / fov).mkdir(parents=True)
+        for channel in ('CD3', 'CD8'):
+            imwrite(str(cohort / fov / f'{channel}.tif'), np.zeros((8, 8), np.uint8))
+    return str(cohort)
+
+
+class CancelAfter(object):
+    """ Cancel event that's set once it has been checked a number of times
+    """
+    def __init__(self, n_checks):
+        self.n_checks = n_checks
+
+    def is_set(self):
+        self.n_checks -= 1
+        return self.n_checks < 0
+
+    def set(self):
+        self.n_checks = 0
+
+
+def test_manifest_is_written_next_to_the_cohort(tmp_path):
+    cohort = _make_cohort(tmp_path)
+    before = {
+        root: os.stat(root).st_mtime_ns for root, _, _ in os.walk(cohort)
+    }
+
+    entries = cohort_scanner.scan_cohort(cohort)
+
+    assert cohort_scanner.manifest_path(cohort) == str(tmp_path / '.cohort_manifest.json')
+    assert os.path.exists(cohort_scanner.manifest_path(cohort))
+    assert sorted(os.listdir(cohort)) == ['fov1', 'fov2']
+    assert {root: os.stat(root).st_mtime_ns for root, _, _ in os.walk(cohort)} == before
+
+    # the manifest's layout is reused on the next scan
+    tif_dirs, _, known, reused = cohort_scanner.plan_scan(cohort)
+    assert reused
+    assert len(tif_dirs) == 2
+    assert set(known) == {entry['path'] for entry in entries}
+
+
+def test_manifest_follows_trailing_separators(tmp_path):
+    cohort = _make_cohort(tmp_path)
+    assert cohort_scanner.manifest_path(cohort + os.sep) == cohort_scanner.manifest_path(cohort)
+
+
+def test_changed_cohort_is_rescanned(tmp_path):
+    cohort = _make_cohort(tmp_path)
+    cohort_scanner.scan_cohort(cohort)
+
+    (tmp_path / 'cohort' / 'fov3').mkdir()
+    imwrite(str(tmp_path / 'cohort' / 'fov3' / 'CD3.tif'), np.zeros((8, 8), np.uint8))
+
+    assert not cohort_scanner.plan_scan(cohort)[3]
+    assert set(cohort_scanner.index_cohort(cohort)) == {
+        'cohort/fov1', 'cohort/fov2', 'cohort/fov3'
+    }
+    assert cohort_scanner.plan_scan(cohort)[3]
+
+
+def test_cancelled_walk_is_not_a_layout(tmp_path):
+    cohort = _make_cohort(tmp_path)
+
+    # cancelled while walking the fov layer
+    with pytest.raises(concurrent.futures.CancelledError):
+        cohort_scanner.plan_scan(cohort, cancel_event=CancelAfter(1))
+    assert not os.path.exists(cohort_scanner.manifest_path(cohort))
+
+    assert set(cohort_scanner.index_cohort(cohort)) == {'cohort/fov1', 'cohort/fov2'}
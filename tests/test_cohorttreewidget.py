@@ -0,0 +1,172 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+from tifffile import imwrite
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5 import QtWidgets  # noqa: E402
+
+from amp import tiff_utils  # noqa: E402
+from amp.cohorttreewidget import CohortTreeWidget  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def qapp():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+def _make_tif_cohort(tmp_path):
+    cohort = tmp_path / 'cohort'
+    for fov in ('fov1', 'fov2'):
+        (cohort / fov / 'TIFs').mkdir(parents=True)
+        for channel in ('CD3', 'CD8'):
+            imwrite(str(cohort / fov / 'TIFs' / f'{channel}.tif'), np.zeros((8, 8), np.uint8))
+    return str(cohort)
+
+
+def _make_mibitiff_cohort(tmp_path):
+    cohort = tmp_path / 'mibi'
+    (cohort / 'run').mkdir(parents=True)
+    for fov in ('fov1', 'fov2'):
+        tiff_utils.write_mibitiff(
+            str(cohort / 'run' / f'{fov}.tiff'), np.zeros((8, 8, 2), np.uint16),
+            [(150, 'CD3'), (160, 'CD8')], {'size': 500, 'coordinates': (0, 0)}
+        )
+    return str(cohort)
+
+
+def _children(item):
+    return [item.child(index).text(0) for index in range(item.childCount())]
+
+
+@pytest.mark.parametrize('make_cohort, fov_path', [
+    (_make_tif_cohort, 'cohort/fov1'),
+    (_make_mibitiff_cohort, 'mibi/fov1.tiff'),
+])
+def test_lazy_fovs_populate_on_expansion(qapp, tmp_path, make_cohort, fov_path):
+    tree = CohortTreeWidget()
+    tree.load_cohort(make_cohort(tmp_path), lazy=True)
+
+    assert sorted(tree.get_channels()) == ['CD3', 'CD8']
+    fov = tree.head
+    for part in fov_path.split('/')[1:]:
+        fov = next(
+            fov.child(index) for index in range(fov.childCount())
+            if fov.child(index).text(0) == part
+        )
+    assert fov.childCount() == 0
+
+    fov.setExpanded(True)
+    assert _children(fov) == ['CD3', 'CD8']
+
+    # indexing into a fov populates it too
+    other_fov = fov_path.replace('fov1', 'fov2')
+    channel = tree.get_item(f'{other_fov}/CD8')
+    assert channel is not None
+    assert channel.get_image_data().shape == (8, 8)
+
+
+def test_lazy_quickview_lists_fovs(qapp, tmp_path):
+    tree = CohortTreeWidget()
+    tree.load_cohort(_make_mibitiff_cohort(tmp_path), lazy=True)
+
+    # a shared run directory is trimmed from the tree
+    head = tree.gen_quickview()
+    assert _children(head) == ['fov1.tiff', 'fov2.tiff']
+    assert [head.child(index).childCount() for index in range(head.childCount())] == [0, 0]
+
+    head = tree.gen_quickview(include_channels=True)
+    assert _children(head.child(0)) == ['CD3', 'CD8']
+
+
+def test_eager_load_matches_lazy(qapp, tmp_path):
+    cohort = _make_tif_cohort(tmp_path)
+    eager = CohortTreeWidget()
+    eager.load_cohort(cohort)
+    lazy = CohortTreeWidget()
+    lazy.load_cohort(cohort, lazy=True)
+    lazy.populate_all()
+
+    for tree in (eager, lazy):
+        assert _children(tree.head) == ['fov1', 'fov2']
+        assert _children(tree.head.child(0)) == ['CD3', 'CD8']
+
+
+def test_scanner_signals(qapp, tmp_path):
+    from amp.cohorttreewidget import CohortScanner
+
+    cohort = _make_tif_cohort(tmp_path)
+    for cancel in (False, True):
+        scanner = CohortScanner(cohort)
+        events = []
+        scanner.tifs_found.connect(lambda batch: events.append(('found', len(batch))))
+        scanner.finished.connect(lambda: events.append('finished'))
+        scanner.cancelled.connect(lambda: events.append('cancelled'))
+        if cancel:
+            scanner.cancel()
+
+        # run on this thread, so relays are delivered directly
+        scanner._run()
+        if cancel:
+            assert events == ['cancelled']
+        else:
+            assert sum(n for _, n in events[:-1]) == 4
+            assert events[-1] == 'finished'
+            assert 'cancelled' not in events
+
+
+def test_cancelled_scan_writes_no_manifest(qapp, tmp_path):
+    from amp import cohort_scanner
+    from amp.cohorttreewidget import CohortScanner
+
+    class CancelAfter(threading.Event):
+        # set once it has been checked a number of times
+        def __init__(self, n_checks):
+            super().__init__()
+            self.n_checks = n_checks
+
+        def is_set(self):
+            self.n_checks -= 1
+            return self.n_checks < 0 or super().is_set()
+
+    cohort = _make_tif_cohort(tmp_path)
+    scanner = CohortScanner(cohort)
+    found = []
+    scanner.tifs_found.connect(found.extend)
+
+    # cancelled while walking the fov layer (the cohort is 3 levels deep)
+    scanner.cancel_event = CancelAfter(1)
+    scanner._run()
+    assert not found
+    assert not os.path.exists(cohort_scanner.manifest_path(cohort))
+
+    # a rescan still finds every fov
+    assert set(cohort_scanner.index_cohort(cohort)) == {'cohort/fov1', 'cohort/fov2'}
+
+
+def test_fov_item_writes_channels(qapp, tmp_path, monkeypatch):
+    tree = CohortTreeWidget()
+    tree.load_cohort(_make_mibitiff_cohort(tmp_path), lazy=True)
+    fov = tree.get_item('mibi/fov2.tiff')
+
+    rewrites = []
+    overwrite = tiff_utils.overwrite_mibitiff_channels
+    monkeypatch.setattr(
+        tiff_utils, 'overwrite_mibitiff_channels',
+        lambda file, channel_data, **kwargs: (
+            rewrites.append(file), overwrite(file, channel_data, **kwargs)
+        )
+    )
+
+    fov.write_channel_data({
+        'CD3': np.full((8, 8), 3, np.uint16),
+        'CD8': np.full((8, 8), 8, np.uint16),
+        'CD45': np.zeros((8, 8), np.uint16),
+    })
+
+    assert rewrites == [fov.path]
+    for channel, value in (('CD3', 3), ('CD8', 8)):
+        np.testing.assert_array_equal(fov.get_child_by_name(channel).get_image_data(), value)
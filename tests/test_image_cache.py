@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+
+from amp.image_cache import ImageCache
+
+
+def _write(path, value, shape=(16, 16)):
+    np.full(shape, value, dtype=np.uint8).tofile(path)
+
+
+def _mapped(path, shape=(16, 16)):
+    return lambda: np.memmap(path, dtype=np.uint8, mode='r', shape=shape)
+
+
+def test_mapped_arrays_are_budgeted(tmp_path):
+    cache = ImageCache(max_bytes=2 ** 20, max_mapped_bytes=2 * 16 * 16)
+    paths = [str(tmp_path / f'{i}.raw') for i in range(3)]
+    for path in paths:
+        _write(path, 1)
+        cache.get(path, _mapped(path))
+
+    stats = cache.stats()
+    assert stats['entries'] == 2
+    assert stats['mapped_bytes'] == 2 * 16 * 16
+    assert stats['bytes'] == 0
+
+
+def test_zero_budget_caches_nothing(tmp_path):
+    cache = ImageCache()
+    cache.set_max_bytes(0, 0)
+    path = str(tmp_path / 'a.raw')
+    _write(path, 1)
+    cache.get(path, _mapped(path))
+    cache.get(path, lambda: np.zeros((4, 4)))
+
+    assert cache.stats()['entries'] == 0
+
+
+def test_stale_versions_are_dropped(tmp_path):
+    cache = ImageCache()
+    path = str(tmp_path / 'a.raw')
+    _write(path, 1)
+    cache.get(f'{path}|CD3', lambda: np.ones((4, 4)))
+    cache.get(f'{path}|CD8', lambda: np.ones((4, 4)))
+
+    # rewritten outside of AMP
+    _write(path, 2, shape=(17, 16))
+    os.utime(path, ns=(0, 12345))
+    data = cache.get(f'{path}|CD3', lambda: np.full((4, 4), 2.0))
+
+    assert cache.stats()['entries'] == 1
+    assert np.all(data == 2)
@@ -0,0 +1,36 @@
+import numpy as np
+from tifffile import imread, imwrite
+
+from amp import image_io, tiff_utils
+
+
+def test_write_channel_data_groups_mibitiff_channels(tmp_path, monkeypatch):
+    mibitiff = str(tmp_path / 'fov1.tiff')
+    img_data = np.arange(2 * 8 * 8, dtype=np.uint16).reshape((8, 8, 2))
+    tiff_utils.write_mibitiff(mibitiff, img_data, [(150, 'CD3'), (160, 'CD8')],
+                              {'size': 500, 'coordinates': (0, 0)})
+    tif = str(tmp_path / 'CD45.tif')
+    imwrite(tif, np.zeros((8, 8), np.uint8))
+
+    # cached reads are refreshed by the write
+    assert image_io.read_image_data(f'{mibitiff}|CD3').max() == img_data[:, :, 0].max()
+
+    rewrites = []
+    overwrite = tiff_utils.overwrite_mibitiff_channels
+    monkeypatch.setattr(
+        tiff_utils, 'overwrite_mibitiff_channels',
+        lambda file, channel_data, **kwargs: (
+            rewrites.append(sorted(channel_data)), overwrite(file, channel_data, **kwargs)
+        )
+    )
+
+    image_io.write_channel_data({
+        f'{mibitiff}|CD3': np.ones((8, 8), np.uint16),
+        f'{mibitiff}|CD8': np.full((8, 8), 2, np.uint16),
+        tif: np.full((8, 8), 3, np.uint8),
+    })
+
+    assert rewrites == [['CD3', 'CD8']]
+    np.testing.assert_array_equal(image_io.read_image_data(f'{mibitiff}|CD3'), 1)
+    np.testing.assert_array_equal(image_io.read_image_data(f'{mibitiff}|CD8'), 2)
+    np.testing.assert_array_equal(imread(tif), 3)
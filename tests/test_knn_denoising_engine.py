@@ -0,0 +1,149 @@
+import concurrent.futures
+import os
+import threading
+
+import numpy as np
+import pytest
+import tifffile
+
+from amp import knn_denoising_engine
+
+
+@pytest.mark.parametrize('bin_width', [knn_denoising_engine._THRESH_BIN_WIDTH, None])
+def test_optimize_threshold_one_sided(bin_width):
+    # no distances above the initial threshold, so one mixture component is empty
+    rng = np.random.default_rng(0)
+    knn_dists = rng.gamma(4, 0.5, 10000)
+    knn_dists = knn_dists[knn_dists < knn_denoising_engine._INIT_KNN_THRESH]
+
+    with pytest.raises(ValueError):
+        knn_denoising_engine.optimize_threshold(knn_dists, bin_width=bin_width)
+
+
+def test_knn_task_reports_failed_fit(tmp_path):
+    # a failed fit is reported for its channel, rather than aborting the run
+    path = str(tmp_path / 'CD3.tif')
+    tifffile.imwrite(path, np.ones((8, 8), dtype=np.uint8))
+    knn_dists = np.random.default_rng(0).gamma(4, 0.5, 1000)
+    knn_dists = knn_dists[knn_dists < knn_denoising_engine._INIT_KNN_THRESH]
+
+    point, channel, knn, opt_thresh, cap, error = knn_denoising_engine._knn_task(
+        ('fov1', 'CD3', path, knn_dists, True), 'kd_tree', None
+    )
+
+    assert opt_thresh is None
+    assert 'No distances fall in initial mixture component' in error
+    assert knn is knn_dists
+
+
+def _make_cohort(tmp_path):
+    cohort = tmp_path / 'cohort'
+    rng = np.random.default_rng(0)
+    for fov in ('fov1', 'fov2', 'fov3'):
+        (cohort / fov).mkdir(parents=True)
+        channel_data = (rng.random((32, 32)) > 0.7).astype(np.uint8) * 5
+        tifffile.imwrite(str(cohort / fov / 'CD3.tif'), channel_data)
+    return str(cohort)
+
+
+SETTINGS = {
+    f'cohort/{fov}': {'CD3': {'thresh': 2, 'cap': 10}} for fov in ('fov1', 'fov2', 'fov3')
+}
+
+
+def test_cancelled_denoise_keeps_nothing(tmp_path):
+    cohort = _make_cohort(tmp_path)
+    cancel_event = threading.Event()
+    progress = []
+
+    def _cancel_after_first(done, total):
+        progress.append(done)
+        cancel_event.set()
+
+    with pytest.raises(concurrent.futures.CancelledError):
+        knn_denoising_engine.denoise_cohort(
+            cohort, SETTINGS, progress_callback=_cancel_after_first, max_workers=1,
+            cancel_event=cancel_event
+        )
+
+    assert progress == [1]
+    assert not os.path.exists(tmp_path / 'denoised')
+    assert not os.path.exists(tmp_path / 'denoised_temp')
+
+    # an uncancelled run still completes
+    final_dir = knn_denoising_engine.denoise_cohort(cohort, SETTINGS, max_workers=1)
+    assert sorted(os.listdir(final_dir)) == ['fov1', 'fov2', 'fov3']
+
+
+def _dense_image():
+    return (np.random.default_rng(1).random((64, 64)) > 0.3).astype(np.uint8)
+
+
+def _sparse_image():
+    # most pixels are further apart than the grid search radius
+    return (np.random.default_rng(2).random((128, 128)) > 0.995).astype(np.uint8)
+
+
+def _isolated_image():
+    image = np.zeros((96, 96), np.uint8)
+    image[10:30, 10:30] = np.random.default_rng(3).random((20, 20)) > 0.5
+    image[80, 5] = image[5, 90] = image[90, 90] = 1
+    return image
+
+
+def _edge_image():
+    image = np.zeros((40, 50), np.uint8)
+    image[0, :] = image[-1, ::3] = image[:, 0] = image[::4, -1] = 1
+    image[20, 25] = 1
+    return image
+
+
+@pytest.mark.parametrize('k_val', [1, 5, 25])
+@pytest.mark.parametrize('make_image', [_dense_image, _sparse_image, _isolated_image, _edge_image])
+def test_grid_matches_kd_tree(make_image, k_val):
+    image = make_image()
+    kd_non_zeros, kd_knn = knn_denoising_engine.generate_knn(image, k_val, method='kd_tree')
+    grid_non_zeros, grid_knn = knn_denoising_engine.generate_knn(image, k_val, method='grid')
+
+    np.testing.assert_array_equal(grid_non_zeros, kd_non_zeros)
+    assert grid_knn.shape == kd_knn.shape
+    assert np.allclose(grid_knn, kd_knn)
+
+
+@pytest.mark.parametrize('method', knn_denoising_engine.KNN_METHODS)
+@pytest.mark.parametrize('n_non_zeros', [1, 5])
+def test_knn_needs_more_than_k_pixels(method, n_non_zeros):
+    image = np.zeros((16, 16), np.uint8)
+    image.flat[np.arange(n_non_zeros) * 7] = 1
+
+    with pytest.raises(ValueError):
+        knn_denoising_engine.generate_knn(image, 5, method=method)
+
+
+def test_kd_tree_tunables_reach_the_tree(tmp_path, monkeypatch):
+    cohort = _make_cohort(tmp_path)
+    image = _dense_image()
+    _, default_knn = knn_denoising_engine.generate_knn(image, method='kd_tree')
+    _, tuned_knn = knn_denoising_engine.generate_knn(
+        image, method='kd_tree', leaf_size=4, chunk_size=100
+    )
+    assert np.allclose(tuned_knn, default_knn)
+
+    tunables = []
+    kd_tree_knn = knn_denoising_engine._kd_tree_knn
+    monkeypatch.setattr(
+        knn_denoising_engine, '_kd_tree_knn',
+        lambda *args: (tunables.append(args[3:5]), kd_tree_knn(*args))[1]
+    )
+
+    tasks = [('cohort/fov1', 'CD3', str(tmp_path / 'cohort' / 'fov1' / 'CD3.tif'), None, False)]
+    list(knn_denoising_engine.compute_knns(tasks, 1, leaf_size=4, chunk_size=100))
+    knn_denoising_engine.denoise_cohort(cohort, SETTINGS, max_workers=1, leaf_size=8,
+                                        chunk_size=200)
+    assert tunables == [(4, 100)] + [(8, 200)] * 3
+
+
+@pytest.mark.parametrize('option', ['--leaf-size', '--chunk-size'])
+def test_cli_rejects_empty_kd_tree_tunables(tmp_path, option):
+    with pytest.raises(SystemExit):
+        knn_denoising_engine.main([str(tmp_path), option, '0'])
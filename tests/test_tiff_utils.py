@@ -0,0 +1,274 @@
+import json
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+from tifffile import TiffFile
+
+from amp import image_io, tiff_utils
+
+CHANNELS = [(89, 'dsDNA'), (150, 'CD3'), (160, 'CD8')]
+
+METADATA = {
+    'run': 'run1',
+    'coordinates': (12000, -7500),
+    'size': 500,
+    'fov_name': 'R1C1',
+    'date': '2020-03-04T05:06:07',
+}
+
+
+def _image(shape=(300, 120), dtype=np.uint16, n_channels=len(CHANNELS)):
+    rng = np.random.default_rng(0)
+    return (rng.random(shape + (n_channels,)) * 1000).astype(dtype)
+
+
+def _write(path, img_data, **kwargs):
+    tiff_utils.write_mibitiff(str(path), img_data, CHANNELS, METADATA, **kwargs)
+    return str(path)
+
+
+def _raw_strips(page):
+    # encoded (still compressed) strips of a page
+    fh = page.parent.filehandle
+    strips = []
+    for offset, byte_count in zip(page.dataoffsets, page.databytecounts):
+        fh.seek(offset)
+        strips.append(fh.read(byte_count))
+    return strips
+
+
+@pytest.mark.parametrize('compress, compression', [
+    (0, 1),
+    (6, 8),
+    (('ZLIB', 9), 8),
+    ('LZMA', 34925),
+])
+def test_write_round_trip(tmp_path, compress, compression):
+    img_data = _image()
+    path = _write(tmp_path / 'fov.tif', img_data, compress=compress)
+
+    with TiffFile(path) as tif:
+        assert len(tif.pages) == len(CHANNELS)
+        for i, (page, (mass, target)) in enumerate(zip(tif.pages, CHANNELS)):
+            np.testing.assert_array_equal(page.asarray(), img_data[:, :, i])
+
+            tags = page.tags
+            assert tags['ImageWidth'].value == 120
+            assert tags['ImageLength'].value == 300
+            assert tags['BitsPerSample'].value == 16
+            assert tags['Compression'].value == compression
+            assert tags['Software'].value == 'IonpathMIBIv1.0'
+            assert tags['PageName'].value == f'{target} ({mass})'
+            assert tags['SMinSampleValue'].value == 0
+            assert tags['SMaxSampleValue'].value == img_data[:, :, i].max()
+            assert tags['XResolution'].value == (6000, 1)
+            assert tags['YResolution'].value == (2400, 1)
+            assert tags['XPosition'].value == (6, 5)
+            assert tags['YPosition'].value == (-3, 4)
+            assert tags['DateTime'].value == '2020:03:04 05:06:07'
+
+            description = json.loads(tags['ImageDescription'].value)
+            assert description == {
+                'mibi.run': 'run1',
+                'mibi.coordinates': [12000, -7500],
+                'mibi.size': 500,
+                'mibi.fov_name': 'R1C1',
+                'image.type': 'SIMS',
+                'channel.mass': mass,
+                'channel.target': target,
+                'shape': [300, 120],
+            }
+
+
+def test_write_float_round_trip(tmp_path):
+    img_data = _image(dtype=np.float32) / 7
+    path = _write(tmp_path / 'fov.tif', img_data)
+
+    with TiffFile(path) as tif:
+        for i, page in enumerate(tif.pages):
+            assert page.tags['SampleFormat'].value == 3
+            assert page.tags['BitsPerSample'].value == 32
+            assert page.tags['SMaxSampleValue'].value == pytest.approx(img_data[:, :, i].max())
+            np.testing.assert_array_equal(page.asarray(), img_data[:, :, i])
+
+
+def test_read_mibitiff_matches_written(tmp_path):
+    img_data = _image()
+    path = _write(tmp_path / 'fov.tif', img_data)
+
+    data, channels, metadata = tiff_utils.read_mibitiff(path, get_metadata=True)
+    np.testing.assert_array_equal(data, img_data)
+    assert channels == CHANNELS
+    assert metadata['mibi.fov_name'] == 'R1C1'
+
+    # indexed single channel reads
+    data, channels = tiff_utils.read_mibitiff(path, channels=['CD8'])
+    np.testing.assert_array_equal(data[:, :, 0], img_data[:, :, 2])
+    assert channels == [(160, 'CD8')]
+
+
+def test_overwrite_keeps_untouched_pages(tmp_path):
+    img_data = _image()
+    path = _write(tmp_path / 'fov.tif', img_data)
+    with TiffFile(path) as tif:
+        before = [(_raw_strips(page), page.tags['ImageDescription'].value) for page in tif.pages]
+
+    new_data = img_data[:, :, 1] // 2
+    tiff_utils.overwrite_mibitiff_channels(path, {'CD3': new_data}, compress=0)
+
+    with TiffFile(path) as tif:
+        for i, page in enumerate(tif.pages):
+            assert page.tags['ImageDescription'].value == before[i][1]
+            assert page.tags['PageName'].value == '{1} ({0})'.format(*CHANNELS[i])
+            if i == 1:
+                np.testing.assert_array_equal(page.asarray(), new_data)
+                assert page.tags['Compression'].value == 1
+                assert page.tags['SMaxSampleValue'].value == new_data.max()
+            else:
+                assert _raw_strips(page) == before[i][0]
+                assert page.tags['Compression'].value == 8
+                np.testing.assert_array_equal(page.asarray(), img_data[:, :, i])
+
+    # the seeded page index matches the rewritten file
+    data, _ = tiff_utils.read_mibitiff(path, channels=['CD8'])
+    np.testing.assert_array_equal(data[:, :, 0], img_data[:, :, 2])
+
+
+def test_overwrite_rejects_bad_channels(tmp_path):
+    path = _write(tmp_path / 'fov.tif', _image())
+    with open(path, 'rb') as fh:
+        before = fh.read()
+
+    with pytest.raises(ValueError):
+        tiff_utils.overwrite_mibitiff_channels(path, {'CD3': np.zeros((10, 10), np.uint16)})
+    with pytest.raises(IndexError):
+        tiff_utils.overwrite_mibitiff_channels(path, {'CD4': np.zeros((300, 120), np.uint16)})
+
+    with open(path, 'rb') as fh:
+        assert fh.read() == before
+    assert [p.name for p in tmp_path.iterdir()] == ['fov.tif']
+
+
+def test_decoded_overwrite(tmp_path):
+    img_data = _image()
+    path = _write(tmp_path / 'fov.tif', img_data)
+
+    new_data = img_data[:, :, 0] + 1
+    with open(path, 'r+b') as fh:
+        tiff_utils.overwrite_mibitiff_channels(fh, {'dsDNA': new_data}, compress='LZMA')
+
+    img_data[:, :, 0] = new_data
+    data, channels, metadata = tiff_utils.read_mibitiff(path, get_metadata=True)
+    np.testing.assert_array_equal(data, img_data)
+    assert channels == CHANNELS
+    assert metadata['mibi.fov_name'] == 'R1C1'
+    with TiffFile(path) as tif:
+        assert [page.tags['Compression'].value for page in tif.pages] == [34925] * 3
+
+
+def test_write_channel_data_compression(tmp_path):
+    img_data = _image()
+    path = _write(tmp_path / 'fov.tif', img_data)
+
+    image_io.write_channel_data({f'{path}|CD8': img_data[:, :, 2]}, compress=0)
+
+    with TiffFile(path) as tif:
+        assert [page.tags['Compression'].value for page in tif.pages] == [8, 8, 1]
+        np.testing.assert_array_equal(tif.pages[2].asarray(), img_data[:, :, 2])
+
+
+@pytest.mark.parametrize('setting, compress', [
+    ('6', 6),
+    ('0', 0),
+    ('none', 'none'),
+    ('lzma', 'lzma'),
+    ('zlib:9', ('zlib', 9)),
+])
+def test_parse_compress(setting, compress):
+    assert tiff_utils.parse_compress(setting) == compress
+
+
+def test_parse_compress_rejects_unknown_codecs():
+    with pytest.raises(ValueError):
+        tiff_utils.parse_compress('bogus')
+
+
+def test_overwrite_several_channels_rewrites_once(tmp_path, monkeypatch):
+    img_data = _image()
+    path = _write(tmp_path / 'fov.tif', img_data)
+
+    replaced = []
+    replace = tiff_utils.os.replace
+    monkeypatch.setattr(
+        tiff_utils.os, 'replace', lambda src, dst: (replaced.append(dst), replace(src, dst))
+    )
+
+    new_data = {'dsDNA': img_data[:, :, 0] // 3, 160: img_data[:, :, 2] // 5}
+    tiff_utils.overwrite_mibitiff_channels(path, new_data)
+    assert replaced == [path]
+
+    img_data[:, :, 0] //= 3
+    img_data[:, :, 2] //= 5
+    data, channels = tiff_utils.read_mibitiff(path)
+    np.testing.assert_array_equal(data, img_data)
+    assert channels == CHANNELS
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16, np.float32])
+@pytest.mark.parametrize('compress', [0, 6])
+def test_independent_reader(tmp_path, dtype, compress):
+    img_data = _image(dtype=dtype)
+    if dtype == np.float32:
+        img_data /= 7
+    path = _write(tmp_path / 'fov.tif', img_data, compress=compress)
+
+    with Image.open(path) as image:
+        assert image.n_frames == len(CHANNELS)
+        for i in range(len(CHANNELS)):
+            image.seek(i)
+            np.testing.assert_array_equal(np.array(image), img_data[:, :, i])
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16, np.float32])
+def test_large_files_are_written_as_bigtiff(tmp_path, monkeypatch, dtype):
+    monkeypatch.setattr(tiff_utils, '_CLASSIC_TIFF_LIMIT', 10000)
+    img_data = _image(dtype=dtype)
+    path = _write(tmp_path / 'fov.tif', img_data, compress=('ZLIB', 9))
+
+    with TiffFile(path) as tif:
+        assert tif.is_bigtiff
+        for i, (page, (mass, target)) in enumerate(zip(tif.pages, CHANNELS)):
+            assert page.tags['Compression'].value == 8
+            assert page.tags['PageName'].value == f'{target} ({mass})'
+            assert page.tags['SMaxSampleValue'].value == pytest.approx(img_data[:, :, i].max())
+            assert page.tags['XResolution'].value == (6000, 1)
+            assert json.loads(page.tags['ImageDescription'].value)['channel.target'] == target
+
+    data, channels, metadata = tiff_utils.read_mibitiff(path, get_metadata=True)
+    np.testing.assert_array_equal(data, img_data)
+    assert channels == CHANNELS
+    assert metadata['mibi.fov_name'] == 'R1C1'
+
+
+def test_large_overwrite_falls_back_to_bigtiff(tmp_path, monkeypatch):
+    img_data = _image()
+    path = _write(tmp_path / 'fov.tif', img_data)
+
+    monkeypatch.setattr(tiff_utils, '_CLASSIC_TIFF_LIMIT', 10000)
+    new_data = img_data[:, :, 1] // 2
+    tiff_utils.overwrite_mibitiff_channels(path, {'CD3': new_data})
+
+    img_data[:, :, 1] = new_data
+    with TiffFile(path) as tif:
+        assert tif.is_bigtiff
+    data, channels = tiff_utils.read_mibitiff(path)
+    np.testing.assert_array_equal(data, img_data)
+    assert channels == CHANNELS
+
+
+def test_parse_compress_needs_imagecodecs(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'imagecodecs', None)
+    with pytest.raises(ValueError):
+        tiff_utils.parse_compress('zstd:3')